@@ -0,0 +1,387 @@
+"""JSON API for Warbler, version 1.
+
+All endpoints live under /api/v1 and return `{"data": ..., "next": ...}`,
+where `next` is the cursor for the following page (or null). Message lists
+take `?before=`, user lists take `?after=`, as the HTML pages do. Every
+endpoint accepts `?fields=a,b,c` to return only some fields.
+
+Rows are built straight from Core SELECTs of just the requested columns,
+never ORM objects, so a page costs one or two queries and no per-object
+overhead.
+
+GET /api/v1/timeline                  home timeline (login required)
+GET /api/v1/users/<id>                a user's profile
+GET /api/v1/users/<id>/messages       a user's messages
+GET /api/v1/users/<id>/following      who a user follows (login required)
+GET /api/v1/users/<id>/followers      a user's followers (login required)
+GET /api/v1/users/<id>/likes          messages a user likes (login required)
+
+PUT /api/v1/messages/<id>/like        like a message (login required)
+DELETE /api/v1/messages/<id>/like     unlike a message (login required)
+PUT /api/v1/users/<id>/follow         follow a user (login required)
+DELETE /api/v1/users/<id>/follow      unfollow a user (login required)
+"""
+
+from flask import Blueprint, current_app, g, jsonify, request
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
+
+from following import set_following
+from models import db, Follows, Likes, Message, User
+from pagination import decode_cursor, encode_cursor, older_than
+from replicas import replica_reads
+from timelines import get_timelines
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+MESSAGE_FIELDS = {
+    'id': Message.id,
+    'text': Message.text,
+    'timestamp': Message.timestamp,
+    'user_id': Message.user_id,
+    'like_count': Message.like_count,
+    'username': User.username,
+    'image_url': User.image_url,
+}
+
+USER_FIELDS = {
+    'id': User.id,
+    'username': User.username,
+    'image_url': User.image_url,
+    'header_image_url': User.header_image_url,
+    'bio': User.bio,
+    'location': User.location,
+    'messages_count': User.messages_count,
+    'following_count': User.following_count,
+    'followers_count': User.followers_count,
+    'likes_count': User.likes_count,
+}
+
+MESSAGES_WITH_AUTHORS = Message.__table__.join(
+    User.__table__, Message.user_id == User.id)
+
+
+class APIError(Exception):
+    """An error to send back to the client as JSON."""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@api.errorhandler(APIError)
+def api_error(error):
+    return jsonify(error=error.message), error.status
+
+
+def require_login():
+    if not g.user:
+        raise APIError(401, "Login required.")
+
+
+def require_user(user_id):
+    # users marked deleted are on their way out; see purge.py
+    exists = db.session.execute(
+        select([User.id])
+        .where(User.id == user_id)
+        .where(User.deleted_at.is_(None))).scalar()
+
+    if exists is None:
+        raise APIError(404, "No such user.")
+
+
+def get_fields(allowed):
+    """Get the field names asked for with `?fields=` (default: all)."""
+
+    fields = request.args.get('fields')
+
+    if not fields:
+        return list(allowed)
+
+    fields = fields.split(',')
+    unknown = set(fields) - set(allowed)
+
+    if unknown:
+        raise APIError(400, f"Unknown fields: {', '.join(sorted(unknown))}.")
+
+    return fields
+
+
+def get_int_arg(name):
+    value = request.args.get(name)
+
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        raise APIError(400, f"Bad {name} cursor.")
+
+
+def get_before_cursor():
+    cursor = request.args.get('before')
+
+    if not cursor:
+        return None
+
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise APIError(400, "Bad before cursor.")
+
+
+def serialize(value):
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()
+    return value
+
+
+def to_rows(result, fields):
+    """Turn result rows into dicts of the requested `fields`."""
+
+    return [{field: serialize(row[field]) for field in fields}
+            for row in result]
+
+
+def message_page(query, per_page):
+    """Run a message SELECT (fetching per_page + 1) and build the page."""
+
+    fields = get_fields(MESSAGE_FIELDS)
+    columns = {field: MESSAGE_FIELDS[field] for field in fields}
+    columns.update(id=Message.id, timestamp=Message.timestamp)
+
+    result = db.session.execute(
+        query.with_only_columns([column.label(name)
+                                 for name, column in columns.items()])
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(per_page + 1)).fetchall()
+
+    next_cursor = None
+    if len(result) > per_page:
+        result = result[:per_page]
+        next_cursor = encode_cursor(result[-1]['timestamp'], result[-1]['id'])
+
+    return jsonify(data=to_rows(result, fields), next=next_cursor)
+
+
+def user_page(query):
+    """Run a user SELECT keyset-paged on id with `?after=`."""
+
+    fields = get_fields(USER_FIELDS)
+    per_page = current_app.config['USERS_PER_PAGE']
+    after = get_int_arg('after')
+
+    if after is not None:
+        query = query.where(User.id > after)
+
+    result = db.session.execute(
+        query.with_only_columns([User.id.label('id')] +
+                                [USER_FIELDS[field].label(field)
+                                 for field in fields if field != 'id'])
+        .order_by(User.id)
+        .limit(per_page + 1)).fetchall()
+
+    next_cursor = None
+    if len(result) > per_page:
+        result = result[:per_page]
+        next_cursor = result[-1]['id']
+
+    return jsonify(data=to_rows(result, fields), next=next_cursor)
+
+
+@api.route('/timeline')
+@replica_reads
+def timeline():
+    """The logged-in user's home timeline."""
+
+    require_login()
+
+    before = get_before_cursor()
+    per_page = current_app.config['MESSAGES_PER_PAGE']
+    query = select([Message.id]).select_from(MESSAGES_WITH_AUTHORS)
+
+    message_ids = get_timelines().read(g.user.id, per_page + 1, before)
+
+    if len(message_ids) > per_page:
+        query = query.where(Message.id.in_(message_ids))
+
+    else:
+        # timeline not built or paged past its end; see homepage()
+        followed_ids = [g.user.id, *g.user.follow_ids()[0]]
+        query = query.where(Message.user_id.in_(followed_ids))
+        if before:
+            query = query.where(older_than(Message.timestamp, Message.id, before))
+
+    return message_page(query, per_page)
+
+
+@api.route('/users/<int:user_id>')
+@replica_reads
+def user_detail(user_id):
+    """A user's profile."""
+
+    fields = get_fields(USER_FIELDS)
+    row = db.session.execute(
+        select([USER_FIELDS[field].label(field) for field in fields])
+        .where(User.id == user_id)
+        .where(User.deleted_at.is_(None))).first()
+
+    if row is None:
+        raise APIError(404, "No such user.")
+
+    return jsonify(data=to_rows([row], fields)[0])
+
+
+@api.route('/users/<int:user_id>/messages')
+@replica_reads
+def user_messages(user_id):
+    """A user's messages, newest first."""
+
+    require_user(user_id)
+
+    before = get_before_cursor()
+    query = (select([Message.id])
+             .select_from(MESSAGES_WITH_AUTHORS)
+             .where(Message.user_id == user_id))
+
+    if before:
+        query = query.where(older_than(Message.timestamp, Message.id, before))
+
+    return message_page(query, current_app.config['MESSAGES_PER_PAGE'])
+
+
+@api.route('/users/<int:user_id>/following')
+@replica_reads
+def user_following(user_id):
+    """The users `user_id` follows."""
+
+    require_login()
+    require_user(user_id)
+
+    return user_page(select([User.id])
+                     .select_from(User.__table__.join(
+                         Follows.__table__,
+                         Follows.user_being_followed_id == User.id))
+                     .where(Follows.user_following_id == user_id))
+
+
+@api.route('/users/<int:user_id>/followers')
+@replica_reads
+def user_followers(user_id):
+    """The users following `user_id`."""
+
+    require_login()
+    require_user(user_id)
+
+    return user_page(select([User.id])
+                     .select_from(User.__table__.join(
+                         Follows.__table__,
+                         Follows.user_following_id == User.id))
+                     .where(Follows.user_being_followed_id == user_id))
+
+
+@api.route('/users/<int:user_id>/likes')
+@replica_reads
+def user_likes(user_id):
+    """Messages `user_id` likes, most recently liked first.
+
+    Each message includes when it was liked, as `liked_at`.
+    """
+
+    require_login()
+    require_user(user_id)
+
+    fields = get_fields(MESSAGE_FIELDS)
+    per_page = current_app.config['MESSAGES_PER_PAGE']
+    before = get_before_cursor()
+
+    query = (select([Likes.created_at.label('liked_at'),
+                     Likes.message_id.label('liked_id')] +
+                    [MESSAGE_FIELDS[field].label(field) for field in fields])
+             .select_from(MESSAGES_WITH_AUTHORS.join(
+                 Likes.__table__, Likes.message_id == Message.id))
+             .where(Likes.user_id == user_id))
+
+    if before:
+        query = query.where(older_than(Likes.created_at, Likes.message_id,
+                                       before))
+
+    result = db.session.execute(
+        query.order_by(Likes.created_at.desc(), Likes.message_id.desc())
+        .limit(per_page + 1)).fetchall()
+
+    next_cursor = None
+    if len(result) > per_page:
+        result = result[:per_page]
+        next_cursor = encode_cursor(result[-1]['liked_at'],
+                                    result[-1]['liked_id'])
+
+    return jsonify(data=to_rows(result, ['liked_at', *fields]),
+                   next=next_cursor)
+
+
+@api.route('/messages/<int:message_id>/like', methods=['PUT', 'DELETE'])
+def message_like(message_id):
+    """Like (PUT) or unlike (DELETE) a message as the logged-in user.
+
+    Both are idempotent: liking a message twice counts it once. Returns
+    whether the message is now liked and its like count.
+    """
+
+    require_login()
+
+    liked = request.method == 'PUT'
+
+    try:
+        Likes.set(g.user.id, message_id, liked)
+    except IntegrityError:
+        # liking a missing message breaks the foreign key
+        db.session.rollback()
+        raise APIError(404, "No such message.")
+
+    like_count = db.session.execute(
+        select([Message.like_count])
+        .where(Message.id == message_id)).scalar()
+
+    if like_count is None:
+        # unliking one just deletes nothing
+        db.session.rollback()
+        raise APIError(404, "No such message.")
+
+    db.session.commit()
+
+    return jsonify(data=dict(message_id=message_id, liked=liked,
+                             like_count=like_count))
+
+
+@api.route('/users/<int:user_id>/follow', methods=['PUT', 'DELETE'])
+def user_follow(user_id):
+    """Follow (PUT) or unfollow (DELETE) a user as the logged-in user.
+
+    Both are idempotent. Returns whether the user is now followed and
+    their follower count.
+    """
+
+    require_login()
+
+    if user_id == g.user.id:
+        raise APIError(400, "You can't follow yourself.")
+
+    require_user(user_id)
+    following = request.method == 'PUT'
+
+    try:
+        set_following(g.user.id, user_id, following)
+    except IntegrityError:
+        # they were deleted meanwhile
+        db.session.rollback()
+        raise APIError(404, "No such user.")
+
+    followers_count = db.session.execute(
+        select([User.followers_count]).where(User.id == user_id)).scalar()
+    db.session.commit()
+
+    return jsonify(data=dict(user_id=user_id, following=following,
+                             followers_count=followers_count))
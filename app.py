@@ -1,11 +1,30 @@
 import os
 import pdb
-from flask import Flask, render_template, request, flash, redirect, session, g, jsonify
+import click
+from hashlib import sha1
+from flask import Flask, render_template, request, flash, redirect, session, g, jsonify, abort, make_response
 from flask_debugtoolbar import DebugToolbarExtension
+from flask_migrate import Migrate
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, load_only
+from werkzeug.http import is_resource_modified
 
+from api import api
+import assets
+from following import set_following
 from forms import UserAddForm, LoginForm, MessageForm, EditUserForm
-from models import db, connect_db, User, Message
+from hashing import hasher, HasherBusy
+import images
+from images import BadImage, ImagesBusy, thumbnailer
+import metrics
+import purge
+from models import db, connect_db, User, Message, Follows, Likes, user_cache
+from pagination import decode_cursor, older_than, split_page
+import replicas
+from replicas import replica_reads
+from search import search_users
+import suggestions
+from timelines import get_timelines
 
 CURR_USER_KEY = "curr_user"
 
@@ -16,25 +35,109 @@ app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgres:///warbler'))
 
+# Read replicas for read-only pages; see replicas.py
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    uri for uri in os.environ.get('DATABASE_REPLICA_URLS', '').split(',')
+    if uri]
+app.config['SQLALCHEMY_REPLICA_LAG_SECONDS'] = 5
+
+# Connection pool sizes, for the primary and for each replica
+if 'DATABASE_POOL_SIZE' in os.environ:
+    app.config['SQLALCHEMY_POOL_SIZE'] = int(os.environ['DATABASE_POOL_SIZE'])
+app.config['SQLALCHEMY_REPLICA_ENGINE_OPTIONS'] = {}
+if 'DATABASE_REPLICA_POOL_SIZE' in os.environ:
+    app.config['SQLALCHEMY_REPLICA_ENGINE_OPTIONS']['pool_size'] = int(
+        os.environ['DATABASE_REPLICA_POOL_SIZE'])
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = True
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
+app.config['TIMELINE_BACKEND'] = os.environ.get('TIMELINE_BACKEND', 'db')
+app.config['TIMELINE_MAX_LENGTH'] = int(
+    os.environ.get('TIMELINE_MAX_LENGTH', 800))
+app.config['MESSAGES_PER_PAGE'] = 20
+app.config['USER_SEARCH_LIMIT'] = 50
+app.config['USERS_PER_PAGE'] = 30
+app.config['SUGGESTIONS_PER_USER'] = 5
+app.config['PURGE_BATCH_SIZE'] = 1000
+app.config['PURGE_INLINE_MAX_ROWS'] = 5000
+app.config['BCRYPT_EXECUTOR'] = os.environ.get('BCRYPT_EXECUTOR', 'process')
+app.config['BCRYPT_TARGET_MS'] = int(os.environ.get('BCRYPT_TARGET_MS', 250))
+app.config['BCRYPT_MIN_ROUNDS'] = int(os.environ.get('BCRYPT_MIN_ROUNDS', 12))
+app.config['IDENTITY_CACHE_SIZE'] = 1024
+app.config['IDENTITY_CACHE_TTL'] = 30
+app.config['STATIC_CACHE_MAX_AGE'] = 365 * 24 * 60 * 60
+app.config['ASSETS_DIR'] = os.path.join(app.root_path, 'dist')
+app.config['UPLOADS_DIR'] = os.environ.get(
+    'UPLOADS_DIR', os.path.join(app.root_path, 'uploads'))
+app.config['MAX_CONTENT_LENGTH'] = 8 * 1024 * 1024
+app.config['IMAGE_MAX_PIXELS'] = 25 * 1000 * 1000
+app.config['IMAGE_WORKERS'] = 2
+app.config['IMAGE_MAX_PENDING'] = 8
+app.config['METRICS_SLOW_QUERY_MS'] = int(
+    os.environ.get('METRICS_SLOW_QUERY_MS', 100))
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+metrics.init_app(app)
+replicas.init_app(app, db)
+migrate = Migrate(app, db)
+app.register_blueprint(api)
+assets.init_app(app)
+images.init_app(app)
+hasher.init_app(app)
+user_cache.configure(app.config['IDENTITY_CACHE_SIZE'],
+                     app.config['IDENTITY_CACHE_TTL'])
+
+
+##############################################################################
+# Pagination
+
+
+def get_before_cursor():
+    """Get the (timestamp, id) position from a `?before=` cursor, if any."""
+
+    cursor = request.args.get('before')
+
+    if not cursor:
+        return None
+
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        abort(400)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
+@app.errorhandler(HasherBusy)
+def hasher_busy(error):
+    """Too many logins/signups at once: ask the client to retry shortly."""
+
+    flash("Warbler is busy right now. Please try again in a moment.", 'danger')
+    return render_template('busy.html'), 503, {'Retry-After': '1'}
+
+
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
 
-    if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+    The user usually comes from `user_cache` rather than the database;
+    static files, assets and uploads don't look the user up at all.
+    """
+
+    if request.endpoint in ('static', 'assets', 'uploads'):
+        g.user = None
+
+    elif CURR_USER_KEY in session:
+        g.user = user_cache.get(db.session, User, session[CURR_USER_KEY])
+
+        # deleted accounts are logged out at once, even before the purge
+        if g.user is not None and g.user.deleted_at is not None:
+            g.user = None
 
     else:
         g.user = None
@@ -75,6 +178,8 @@ def signup():
                 email=form.email.data,
                 image_url=form.image_url.data or User.image_url.default.arg,
             )
+            db.session.flush()
+            get_timelines().create(user.id)
             db.session.commit()
 
         except IntegrityError:
@@ -100,6 +205,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # authenticate may have upgraded the password hash
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -122,40 +229,89 @@ def logout():
 # General user routes:
 
 @app.route('/users')
+@replica_reads
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search usernames, bios and
+    locations; shows the best USER_SEARCH_LIMIT matches.
+
+    Without it, lists users a page at a time, in signup order; `?after=`
+    is the id of the last user on the previous page.
     """
 
     search = request.args.get('q')
+    next_after = None
 
     if not search:
-        users = User.query.all()
+        per_page = app.config['USERS_PER_PAGE']
+        after = request.args.get('after', 0, type=int)
+
+        # only load what the user cards show (no password hash, email...)
+        users = (User
+                 .query
+                 .options(load_only(User.id, User.username, User.image_url,
+                                    User.header_image_url, User.bio))
+                 .filter(User.id > after, User.deleted_at.is_(None))
+                 .order_by(User.id)
+                 .limit(per_page + 1)
+                 .all())
+
+        if len(users) > per_page:
+            users = users[:per_page]
+            next_after = users[-1].id
+    else:
+        users = search_users(search, app.config['USER_SEARCH_LIMIT'])
+
+    if g.user:
+        following = g.user.following_among([user.id for user in users])
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        following = set()
 
-    return render_template('users/index.html', users=users)
+    return render_template('users/index.html', users=users,
+                           following=following, next_after=next_after)
 
 
 @app.route('/users/<int:user_id>')
+@replica_reads
 def users_show(user_id):
-    """Show user profile."""
+    """Show user profile.
 
-    user = User.query.get_or_404(user_id)
+    Shows a page of the user's messages; `?before=` pages further back.
+    Users marked deleted are gone as far as visitors are concerned.
+    """
+
+    user = User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+    before = get_before_cursor()
+    per_page = app.config['MESSAGES_PER_PAGE']
+
+    # every change to the user or their messages bumps user.version
+    not_modified, etag = check_etag('user', user.id, user.version,
+                                    request.args.get('before'), per_page)
+    if not_modified:
+        return not_modified
 
     # snagging messages in order from the database;
     # user.messages won't be in order by default
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    query = Message.query.filter(Message.user_id == user_id)
+
+    if before:
+        query = query.filter(older_than(Message.timestamp, Message.id, before))
+
+    messages, next_cursor = split_page(
+        query
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(per_page + 1)
+        .all(),
+        per_page)
+    return with_validators(
+        render_template('users/show.html', user=user, messages=messages,
+                        next_cursor=next_cursor),
+        etag)
 
 
 @app.route('/users/<int:user_id>/following')
+@replica_reads
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -169,6 +325,7 @@ def show_following(user_id):
 
 
 @app.route('/users/<int:user_id>/followers')
+@replica_reads
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -188,10 +345,7 @@ def add_follow(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
-
+    change_following(follow_id, True)
     return redirect(f"/users/{g.user.id}/following")
 
 
@@ -203,22 +357,51 @@ def stop_following(follow_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
-
+    change_following(follow_id, False)
     return redirect(f"/users/{g.user.id}/following")
 
+
+def change_following(user_id, following):
+    """Follow or unfollow `user_id` as the logged-in user, or 404.
+
+    Following a user twice, or unfollowing one that isn't followed,
+    changes nothing. Users marked deleted can't be followed (see
+    purge.py).
+    """
+
+    if user_id == g.user.id:
+        abort(400)
+
+    User.query.filter_by(id=user_id, deleted_at=None).first_or_404()
+
+    try:
+        set_following(g.user.id, user_id, following)
+        db.session.commit()
+    except IntegrityError:
+        # they were deleted meanwhile
+        db.session.rollback()
+        abort(404)
+
+    g.pop('follow_ids', None)
+
 @app.route('/users/<int:user_id>/likes')
+@replica_reads
 def show_likes(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
     user = User.query.get_or_404(user_id)
-    liked_messages = []
-    for message in g.user.likes:
-            liked_messages.append(message.id)
-    return render_template('users/likes.html', user=user, likes = liked_messages)
+
+    # authors are joined in so the template doesn't query once per message
+    messages = (Message
+                .query
+                .join(Likes, Likes.message_id == Message.id)
+                .filter(Likes.user_id == user_id)
+                .options(joinedload(Message.user))
+                .order_by(Likes.created_at.desc(), Likes.message_id.desc())
+                .all())
+    liked_messages = g.user.liked_among([message.id for message in messages])
+    return render_template('users/likes.html', user=user, messages=messages, likes = liked_messages)
 
 
 
@@ -228,12 +411,18 @@ def add_like(msg_id):
     if not g.user:
         flash("Unauthorized action.", "danger")
         return redirect("/")
-    liked_message = Message.query.get_or_404(msg_id)
-    if liked_message in g.user.likes:
-        g.user.likes.remove(liked_message)
-    else:
-        g.user.likes.append(liked_message)
-    db.session.commit()
+    Message.query.get_or_404(msg_id)
+
+    # Toggle: unlike, or like if there was nothing to unlike. The JSON
+    # API's PUT/DELETE .../like set the state explicitly instead.
+    if not Likes.set(g.user.id, msg_id, False):
+        Likes.set(g.user.id, msg_id, True)
+
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # the message was deleted meanwhile
+        db.session.rollback()
 
     return redirect('/')
     # return redirect('/')
@@ -263,6 +452,20 @@ def profile():
             user.bio = form.bio.data
             db.session.commit()
             flash('Updated user successfully!', 'success')
+
+            # thumbnails are made in the background; the user's image
+            # changes once they're ready
+            for field in ('image_url', 'header_image_url'):
+                upload = getattr(form, field.replace('_url', '_file')).data
+                if upload:
+                    try:
+                        thumbnailer.ingest(user.id, field, upload.read())
+                        flash('Your new image will show up in a moment.', 'success')
+                    except BadImage as error:
+                        flash(str(error), 'danger')
+                    except ImagesBusy:
+                        flash('Warbler is busy right now. Please upload your image again in a moment.', 'danger')
+
             return redirect(f'/users/{user.id}')
 
         else:
@@ -276,16 +479,17 @@ def profile():
 
 @app.route('/users/delete', methods=["POST"])
 def delete_user():
-    """Delete user."""
+    """Delete user.
+
+    Big accounts are deleted in the background; see purge.py.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     do_logout()
-
-    db.session.delete(g.user)
-    db.session.commit()
+    purge.delete_user(g.user)
 
     return redirect("/signup")
 
@@ -309,6 +513,8 @@ def messages_add():
     if form.validate_on_submit():
         msg = Message(text=form.text.data)
         g.user.messages.append(msg)
+        User.adjust_counters([g.user.id], messages_count=1)
+        get_timelines().add_message(msg)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -317,11 +523,20 @@ def messages_add():
 
 
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@replica_reads
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    return render_template('messages/show.html', message=msg)
+    msg = Message.query.options(joinedload(Message.user)).get_or_404(message_id)
+
+    # messages can't be edited, but their author's name and picture can,
+    # and the page differs by viewer; so no Last-Modified, only the ETag
+    not_modified, etag = check_etag('message', msg.id, msg.user.version)
+    if not_modified:
+        return not_modified
+
+    return with_validators(render_template('messages/show.html', message=msg),
+                           etag)
 
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
@@ -338,6 +553,10 @@ def messages_destroy(message_id):
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    get_timelines().remove_message(msg.id)
+    User.adjust_counters([g.user.id], messages_count=-1)
+    User.adjust_counters(db.select([Likes.user_id])
+                         .where(Likes.message_id == msg.id), likes_count=-1)
     db.session.delete(msg)
     db.session.commit()
 
@@ -349,43 +568,174 @@ def messages_destroy(message_id):
 
 
 @app.route('/')
+@replica_reads
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: a page of the most recent messages of followed_users;
+      `?before=` pages further back
+
+    Messages come from the user's precomputed timeline. If it can't fill
+    the page (e.g. it was never built, or we've paged past its horizon),
+    they're queried from the followed users directly instead.
     """
     
     if g.user:
-        followed_ids = [g.user.id]
-        liked_messages = []
-        for user in g.user.following:
-            followed_ids.append(user.id)
-        for message in g.user.likes:
-            liked_messages.append(message.id)
-        
-        
-
-        messages = Message.query.filter(Message.user_id.in_(followed_ids)).order_by(Message.timestamp.desc()).limit(100).all()
-        return render_template('home.html', messages=messages, likes=liked_messages)
+        before = get_before_cursor()
+        per_page = app.config['MESSAGES_PER_PAGE']
+        timelines = get_timelines()
+        message_ids = timelines.read(g.user.id, per_page + 1, before)
+
+        if len(message_ids) > per_page and timelines.is_built(g.user.id):
+            by_id = {msg.id: msg for msg in
+                     Message.query
+                     .filter(Message.id.in_(message_ids))
+                     .options(joinedload(Message.user))}
+            messages = [by_id[id] for id in message_ids if id in by_id]
+
+        else:
+            followed_ids = [g.user.id, *g.user.follow_ids()[0]]
+
+            query = (Message
+                     .query
+                     .filter(Message.user_id.in_(followed_ids))
+                     .options(joinedload(Message.user)))
+            if before:
+                query = query.filter(older_than(Message.timestamp, Message.id, before))
+
+            messages = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(per_page + 1).all()
+
+        messages, next_cursor = split_page(messages, per_page)
+        liked_messages = g.user.liked_among([msg.id for msg in messages])
+        return render_template('home.html', messages=messages, likes=liked_messages,
+                               next_cursor=next_cursor,
+                               suggested_users=suggestions.suggestions_for(g.user.id))
 
     else:
         return render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
+# Maintenance commands
+
+
+@app.cli.command('repair-counters')
+def repair_counters():
+    """Recompute the follower/following/message/like counters of every
+    user and the like count of every message."""
+
+    User.repair_counters()
+    Message.repair_like_counts()
+    db.session.commit()
+
+
+@app.cli.command('rebuild-timelines')
+def rebuild_timelines():
+    """Recompute every user's home timeline from messages and follows."""
+
+    timelines = get_timelines()
+
+    for (user_id,) in db.session.query(User.id):
+        timelines.rebuild(user_id)
+
+    db.session.commit()
+
+
+@app.cli.command('rebuild-suggestions')
+def rebuild_suggestions():
+    """Recompute every user's "who to follow" suggestions."""
+
+    suggestions.rebuild()
+    db.session.commit()
+
+
+@app.cli.command('purge-user')
+@click.argument('user_id', type=int)
+def purge_user(user_id):
+    """Delete a user and all their rows, in batches."""
+
+    purge.purge_user(user_id, app.config['PURGE_BATCH_SIZE'])
+
+
+@app.cli.command('resume-purges')
+def resume_purges():
+    """Finish deleting accounts whose purge was interrupted."""
+
+    user_ids = purge.resume_purges(app.config['PURGE_BATCH_SIZE'])
+    print(f"purged {len(user_ids)} users")
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Fingerprint and compress static/ into ASSETS_DIR; see assets.py."""
+
+    manifest = assets.build(app.static_folder, app.config['ASSETS_DIR'])
+    print(f"built {len(manifest)} assets into {app.config['ASSETS_DIR']}")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines():
+    """Cut every home timeline down to TIMELINE_MAX_LENGTH entries."""
+
+    get_timelines().trim()
+    db.session.commit()
+
+
+##############################################################################
+# HTTP caching
 #
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
+# Built assets and uploaded thumbnails are named by their content (see
+# assets.py and images.py), so they're cached for STATIC_CACHE_MAX_AGE
+# without checking back. Plain /static files keep their names when they
+# change (default-pic.png is even stored in the users table), so like
+# HTML they're revalidated each time, which their Last-Modified answers
+# with a 304. HTML can be stored by the browser (privately, for logged-in
+# users); pages with validators answer revalidation with a 304 too.
+
+
+def check_etag(*parts):
+    """Work out a page's ETag and whether the client already has it.
+
+    The ETag covers `parts` and who's viewing, since pages differ by
+    viewer (g.user.version changes when their follows do). Returns
+    (a 304 response or None, etag); on a 304 there's no need to render.
+    """
+
+    viewer = (g.user.id, g.user.version) if g.user else None
+    etag = sha1(repr((parts, viewer)).encode('UTF-8')).hexdigest()
+
+    # a pending flash message would be lost in a 304
+    if session.get('_flashes'):
+        return None, etag
+
+    if is_resource_modified(request.environ, etag=etag):
+        return None, etag
+
+    return with_validators(app.response_class(status=304), etag), etag
+
+
+def with_validators(response, etag):
+    """Add an ETag to a response."""
+
+    response = make_response(response)
+    response.set_etag(etag)
+
+    return response
+
 
 @app.after_request
 def add_header(req):
-    """Add non-caching headers on every request."""
+    """Add caching headers to responses that haven't set their own."""
+
+    if request.endpoint == 'static':
+        req.headers['Cache-Control'] = 'public, no-cache'
+
+    elif 'Cache-Control' not in req.headers:
+        if g.get('user'):
+            req.headers['Cache-Control'] = 'private, no-cache'
+        else:
+            req.headers['Cache-Control'] = 'no-cache'
+        req.vary.add('Cookie')
 
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
     return req
@@ -0,0 +1,168 @@
+"""Fingerprinted, precompressed static assets.
+
+`flask build-assets` copies every file in static/ to ASSETS_DIR with a
+hash of its contents in its name (stylesheets/style.css becomes
+stylesheets/style.1a2b3c4d5e.css). It also writes gzip and brotli
+variants of text files, and a manifest.json mapping each original path
+to its hashed one. `/static/...` URLs inside stylesheets are rewritten
+to the hashed files. Images are already compressed, so they're only
+renamed.
+
+Templates link to assets with `asset_url('stylesheets/style.css')`.
+Once assets are built, that gives the hashed file's URL under /assets/.
+Those files never change, so they're served with an `immutable`
+far-future Cache-Control. Each gets the smallest encoding the browser
+accepts (Accept-Encoding) and `Vary: Accept-Encoding`. Without a build
+(in development, say) `asset_url` falls back to the plain /static/ URL.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+import brotli
+from flask import current_app, request, send_from_directory, url_for
+
+MANIFEST = 'manifest.json'
+
+# files worth compressing; the rest (images, fonts) already are
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ico', '.json', '.txt', '.html')
+
+# encodings we write, most preferred first, with their file suffix
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+STATIC_URL = re.compile(r'''url\((['"]?)/static/([^'")]+)\1\)''')
+
+
+def fingerprint(path, content):
+    """Get `path` with a hash of `content` before its extension."""
+
+    root, ext = os.path.splitext(path)
+    digest = hashlib.sha1(content).hexdigest()[:10]
+    return f"{root}.{digest}{ext}"
+
+
+def rewrite_urls(content, manifest):
+    """Point a stylesheet's /static/ URLs at the built assets."""
+
+    def replace(match):
+        quote, path = match.groups()
+        if path not in manifest:
+            return match.group(0)
+        return f"url({quote}/assets/{manifest[path]}{quote})"
+
+    return STATIC_URL.sub(replace, content.decode('UTF-8')).encode('UTF-8')
+
+
+def write(out_dir, path, content):
+    full_path = os.path.join(out_dir, path)
+    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+
+    with open(full_path, 'wb') as f:
+        f.write(content)
+
+    if path.endswith(COMPRESSIBLE):
+        with open(full_path + '.gz', 'wb') as f:
+            f.write(gzip.compress(content, 9))
+        with open(full_path + '.br', 'wb') as f:
+            f.write(brotli.compress(content))
+
+
+def build(static_dir, out_dir):
+    """Build every file in `static_dir` into `out_dir`; return the manifest.
+
+    Stylesheets are built last, so the files they refer to are in the
+    manifest already.
+    """
+
+    paths = sorted(
+        os.path.relpath(os.path.join(root, name), static_dir).replace(os.sep, '/')
+        for root, _, names in os.walk(static_dir) for name in names)
+    paths.sort(key=lambda path: path.endswith('.css'))
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    manifest = {}
+
+    for path in paths:
+        with open(os.path.join(static_dir, path), 'rb') as f:
+            content = f.read()
+
+        if path.endswith('.css'):
+            content = rewrite_urls(content, manifest)
+
+        manifest[path] = fingerprint(path, content)
+        write(out_dir, manifest[path], content)
+
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest(out_dir):
+    try:
+        with open(os.path.join(out_dir, MANIFEST)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def get_manifest():
+    """The current app's manifest, read once per process."""
+
+    manifest = current_app.extensions.get('assets')
+
+    if manifest is None:
+        manifest = load_manifest(current_app.config['ASSETS_DIR'])
+        current_app.extensions['assets'] = manifest
+
+    return manifest
+
+
+def asset_url(path):
+    """Get the URL to link to the static file `path` with."""
+
+    built = get_manifest().get(path)
+
+    if built is None:
+        return url_for('static', filename=path)
+
+    return url_for('assets', filename=built)
+
+
+def serve_asset(filename):
+    """Serve a built asset, compressed if the client accepts it."""
+
+    suffix = ''
+    encoding = None
+
+    if filename.endswith(COMPRESSIBLE) and filename in get_manifest().values():
+        for name, name_suffix in ENCODINGS:
+            if request.accept_encodings[name]:
+                suffix = name_suffix
+                encoding = name
+                break
+
+    response = send_from_directory(current_app.config['ASSETS_DIR'],
+                                   filename + suffix,
+                                   mimetype=mimetypes.guess_type(filename)[0])
+
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = (
+        f"public, max-age={current_app.config['STATIC_CACHE_MAX_AGE']}, "
+        "immutable")
+
+    return response
+
+
+def init_app(app):
+    """Serve built assets at /assets/ and give templates `asset_url`."""
+
+    app.add_url_rule('/assets/<path:filename>', 'assets', serve_asset)
+    app.jinja_env.globals['asset_url'] = asset_url
@@ -0,0 +1,363 @@
+"""Load and latency benchmarks for Warbler's main routes.
+
+    python bench.py [--dataset DIR [--scale N]] [--mode client|server]
+                    [--requests 200] [--concurrency 1] [--warmup 10]
+                    [--routes home,users,...] [--output results.json]
+                    [--compare earlier.json]
+
+Runs against whatever DATABASE_URL points at. With --dataset, every
+table is first dropped and reloaded from that directory, as seed.py does
+(make datasets with generator/create_csvs.py, which is reproducible from
+its --seed). A `benchuser` account, following the most followed users,
+is created if it isn't there and used for every logged-in request.
+
+--mode client sends requests through Flask's test client in this
+process. --mode server starts a threaded WSGI server on a local port
+and sends real HTTP requests over keep-alive connections, one per
+concurrent client.
+
+For each route it reports throughput, p50/p95/p99 latency, SQL
+statements per request and the process's peak RSS so far. --output
+writes the same as JSON, along with the commit and settings, and
+--compare prints the change in throughput and p95 from an earlier file.
+"""
+
+import argparse
+import json
+import logging
+import resource
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.client import HTTPConnection
+from urllib.parse import urlencode
+
+from sqlalchemy import event, func
+from werkzeug.serving import make_server
+
+from app import app, CURR_USER_KEY
+from loader import load_dataset
+from models import db, Follows, Message, User
+
+BENCH_USERNAME = 'benchuser'
+BENCH_PASSWORD = 'benchpassword'
+BENCH_FOLLOWS = 50
+
+ROUTES = ('home', 'users', 'user', 'message', 'login', 'like', 'follow')
+
+
+class Fixture:
+    """The ids the benchmark requests are made with."""
+
+    def __init__(self, user_id, user_ids, message_ids):
+        self.user_id = user_id
+        self.user_ids = user_ids
+        self.message_ids = message_ids
+
+    def request(self, route, i):
+        """Get the (method, path, form) of request number `i` to `route`."""
+
+        user_id = self.user_ids[i % len(self.user_ids)]
+        message_id = self.message_ids[i % len(self.message_ids)]
+
+        if route == 'home':
+            return 'GET', '/', None
+        if route == 'users':
+            return 'GET', '/users', None
+        if route == 'user':
+            return 'GET', f'/users/{user_id}', None
+        if route == 'message':
+            return 'GET', f'/messages/{message_id}', None
+        if route == 'login':
+            return 'POST', '/login', {'username': BENCH_USERNAME,
+                                      'password': BENCH_PASSWORD}
+        if route == 'like':
+            # likes toggle, so each message is liked and then unliked
+            message_id = self.message_ids[i // 2 % len(self.message_ids)]
+            return 'POST', f'/users/add_like/{message_id}', None
+        if route == 'follow':
+            user_id = self.user_ids[i // 2 % len(self.user_ids)]
+            if i % 2:
+                return 'POST', f'/users/stop-following/{user_id}', None
+            return 'POST', f'/users/follow/{user_id}', None
+
+        raise ValueError(f"Unknown route {route}")
+
+
+def reseed(path, scale):
+    """Drop every table and load the dataset at `path`, like seed.py."""
+
+    db.drop_all()
+    db.create_all()
+    load_dataset(path, scale)
+    User.repair_counters()
+    Message.repair_like_counts()
+    db.session.commit()
+
+
+def make_fixture(sample_size=500):
+    """Create the bench user if needed; pick users and messages to request."""
+
+    user = User.query.filter_by(username=BENCH_USERNAME).first()
+
+    if user is None:
+        user = User.signup(BENCH_USERNAME, f'{BENCH_USERNAME}@example.com',
+                           BENCH_PASSWORD, None)
+        db.session.commit()
+
+        for (followed_id,) in (db.session.query(User.id)
+                               .filter(User.id != user.id)
+                               .order_by(User.followers_count.desc())
+                               .limit(BENCH_FOLLOWS)):
+            db.session.add(Follows(user_being_followed_id=followed_id,
+                                   user_following_id=user.id))
+        db.session.commit()
+        User.repair_counters()
+        db.session.commit()
+
+    # users the bench user doesn't follow yet, so following them works
+    followed_ids = (db.session.query(Follows.user_being_followed_id)
+                    .filter(Follows.user_following_id == user.id))
+    user_ids = [id for (id,) in (db.session.query(User.id)
+                                 .filter(User.id != user.id,
+                                         ~User.id.in_(followed_ids))
+                                 .order_by(func.random())
+                                 .limit(sample_size))]
+    message_ids = [id for (id,) in (db.session.query(Message.id)
+                                    .order_by(func.random())
+                                    .limit(sample_size))]
+
+    if not user_ids or not message_ids:
+        raise SystemExit("No users or messages; seed the database first.")
+
+    return Fixture(user.id, user_ids, message_ids)
+
+
+class SQLCounter:
+    """Counts the SQL statements run on the engine, from any thread."""
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(db.engine, 'before_cursor_execute', self.record)
+
+    def record(self, *args):
+        with self.lock:
+            self.count += 1
+
+
+class TestClientSession:
+    """Sends requests through Flask's test client."""
+
+    def __init__(self, fixture):
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = fixture.user_id
+
+    def send(self, method, path, form):
+        resp = self.client.open(path, method=method, data=form)
+        return resp.status_code
+
+
+class HTTPSession:
+    """Sends requests over one keep-alive HTTP connection, logged in."""
+
+    def __init__(self, fixture, port):
+        self.conn = HTTPConnection('127.0.0.1', port)
+        self.cookie = None
+        self.send('POST', '/login', {'username': BENCH_USERNAME,
+                                     'password': BENCH_PASSWORD})
+
+    def send(self, method, path, form):
+        headers = {}
+        body = None
+
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+
+        self.conn.request(method, path, body, headers)
+        resp = self.conn.getresponse()
+        resp.read()
+
+        cookie = resp.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+
+        return resp.status
+
+
+def percentile(sorted_values, percent):
+    """Get the nearest-rank percentile of already sorted values."""
+
+    index = max(0, int(round(percent / 100 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def split(numbers, parts):
+    """Split a range into `parts` runs, each of an even length (but the last).
+
+    Requests 2k and 2k + 1 then go to the same client, in order, so each
+    unfollow comes after its follow.
+    """
+
+    size = -(-len(numbers) // parts)
+    size += size % 2
+    return [numbers[k * size:(k + 1) * size] for k in range(parts)]
+
+
+def run_route(route, fixture, sessions, requests, warmup):
+    """Send `requests` requests to `route`, spread over `sessions`."""
+
+    def worker(session, numbers):
+        latencies = []
+        errors = 0
+        for i in numbers:
+            method, path, form = fixture.request(route, i)
+            start = time.perf_counter()
+            status = session.send(method, path, form)
+            latencies.append(time.perf_counter() - start)
+            errors += status >= 400
+        return latencies, errors
+
+    concurrency = len(sessions)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, sessions, split(range(warmup), concurrency)))
+
+        with SQLCounter() as sql:
+            start = time.perf_counter()
+            results = list(pool.map(
+                worker, sessions,
+                split(range(warmup, warmup + requests), concurrency)))
+            elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency for (part, _) in results for latency in part)
+    ms = [latency * 1000 for latency in latencies]
+
+    return {
+        'route': route,
+        'requests': len(latencies),
+        'errors': sum(errors for (_, errors) in results),
+        'throughput': len(latencies) / elapsed,
+        'p50_ms': percentile(ms, 50),
+        'p95_ms': percentile(ms, 95),
+        'p99_ms': percentile(ms, 99),
+        'sql_per_request': sql.count / len(latencies),
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{'route':<9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'p99 ms':>8} {'sql/req':>8} {'rss MB':>7} {'errors':>6}")
+
+    for r in results:
+        print(f"{r['route']:<9} {r['throughput']:>8.1f} {r['p50_ms']:>8.1f} "
+              f"{r['p95_ms']:>8.1f} {r['p99_ms']:>8.1f} "
+              f"{r['sql_per_request']:>8.1f} {r['peak_rss_kb'] / 1024:>7.0f} "
+              f"{r['errors']:>6}")
+
+
+def print_comparison(results, earlier):
+    """Print each route's change in throughput and p95 since `earlier`."""
+
+    before = {r['route']: r for r in earlier['results']}
+    print(f"\ncompared with {earlier.get('commit') or 'earlier run'}:")
+
+    for r in results:
+        old = before.get(r['route'])
+        if old:
+            print(f"{r['route']:<9} req/s "
+                  f"{(r['throughput'] / old['throughput'] - 1) * 100:>+7.1f}% "
+                  f"p95 {(r['p95_ms'] / old['p95_ms'] - 1) * 100:>+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--dataset', help="reseed from this dataset first")
+    parser.add_argument('--scale', type=int, default=1)
+    parser.add_argument('--mode', choices=('client', 'server'),
+                        default='client')
+    parser.add_argument('--requests', type=int, default=200,
+                        help="measured requests per route")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--routes', default=','.join(ROUTES))
+    parser.add_argument('--output', help="write results as JSON here")
+    parser.add_argument('--compare', help="JSON results of an earlier run")
+    args = parser.parse_args()
+
+    # whole follow/unfollow and like/unlike pairs
+    args.warmup += args.warmup % 2
+    args.requests += args.requests % 2
+
+    routes = args.routes.split(',')
+    unknown = set(routes) - set(ROUTES)
+    if unknown:
+        parser.error(f"unknown routes: {', '.join(sorted(unknown))}")
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    with app.app_context():
+        if args.dataset:
+            reseed(args.dataset, args.scale)
+        fixture = make_fixture()
+
+    server = None
+    if args.mode == 'server':
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        server = make_server('127.0.0.1', 0, app, threaded=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        sessions = [HTTPSession(fixture, server.server_port)
+                    for _ in range(args.concurrency)]
+    else:
+        sessions = [TestClientSession(fixture)
+                    for _ in range(args.concurrency)]
+
+    try:
+        results = [run_route(route, fixture, sessions, args.requests,
+                             args.warmup)
+                   for route in routes]
+    finally:
+        if server:
+            server.shutdown()
+
+    print_results(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(results, json.load(f))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'commit': current_commit(),
+                'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'database': db.engine.dialect.name,
+                'settings': vars(args),
+                'results': results,
+            }, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Compare rows per second served by the JSON API and the HTML pages.
+
+Runs against whatever DATABASE_URL points at (seed it first), logged in
+as the user who follows the most people unless --user-id is given:
+
+    python bench_api.py [--user-id ID] [--requests 200]
+
+For each pair of routes it prints requests/sec and rows/sec, where the
+rows are the messages or users on the page (counted from the JSON `data`
+list, or from the list items / user cards in the HTML).
+"""
+
+import argparse
+import time
+
+from sqlalchemy import func
+
+from app import app, CURR_USER_KEY
+from models import db, Follows
+
+MESSAGE_ROW = b'class="list-group-item"'
+USER_ROW = b'class="card user-card"'
+
+
+def route_pairs(user_id):
+    """Get (name, html url, html row marker, api url) for each route."""
+
+    return [
+        ('timeline', '/', MESSAGE_ROW, '/api/v1/timeline'),
+        ('messages', f'/users/{user_id}', MESSAGE_ROW,
+         f'/api/v1/users/{user_id}/messages'),
+        ('following', f'/users/{user_id}/following', USER_ROW,
+         f'/api/v1/users/{user_id}/following'),
+        ('followers', f'/users/{user_id}/followers', USER_ROW,
+         f'/api/v1/users/{user_id}/followers'),
+        ('likes', f'/users/{user_id}/likes', MESSAGE_ROW,
+         f'/api/v1/users/{user_id}/likes'),
+    ]
+
+
+def bench(client, url, count_rows, requests):
+    """Fetch `url` `requests` times; get (requests/sec, rows/sec)."""
+
+    rows = 0
+    start = time.perf_counter()
+
+    for _ in range(requests):
+        resp = client.get(url)
+        assert resp.status_code == 200, (url, resp.status_code)
+        rows += count_rows(resp)
+
+    elapsed = time.perf_counter() - start
+    return requests / elapsed, rows / elapsed
+
+
+def busiest_user_id():
+    """Get the id of the user following the most people."""
+
+    return (db.session
+            .query(Follows.user_following_id)
+            .group_by(Follows.user_following_id)
+            .order_by(func.count().desc())
+            .limit(1)
+            .scalar())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--requests', type=int, default=200)
+    args = parser.parse_args()
+
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    with app.app_context():
+        user_id = args.user_id or busiest_user_id()
+
+    if user_id is None:
+        parser.error("no follows in the database; seed it or pass --user-id")
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    print(f"user {user_id}, {args.requests} requests per route\n")
+    print(f"{'route':<10} {'html req/s':>11} {'html rows/s':>12} "
+          f"{'api req/s':>10} {'api rows/s':>11} {'speedup':>8}")
+
+    for name, html_url, marker, api_url in route_pairs(user_id):
+        html = bench(client, html_url,
+                     lambda resp: resp.data.count(marker), args.requests)
+        api = bench(client, api_url,
+                    lambda resp: len(resp.get_json()['data']), args.requests)
+        speedup = api[1] / html[1] if html[1] else float('nan')
+
+        print(f"{name:<10} {html[0]:>11.0f} {html[1]:>12.0f} "
+              f"{api[0]:>10.0f} {api[1]:>11.0f} {speedup:>7.1f}x")
+
+
+if __name__ == '__main__':
+    main()
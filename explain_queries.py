@@ -0,0 +1,133 @@
+"""Show the query plan of every SELECT the main pages run.
+
+Requests each page through the test client, logged in as the user who
+follows the most people (or --user-id), records the SELECTs it runs and
+prints the plan for each one:
+
+    python explain_queries.py [--user-id ID] [--seq-scans-only]
+
+On PostgreSQL this is `EXPLAIN (ANALYZE, BUFFERS)`, so run it against a
+seeded database to see real row counts and check that the hot queries
+use index (or index-only) scans. Elsewhere it falls back to the
+database's plain EXPLAIN. Plans that scan a whole table are flagged.
+"""
+
+import argparse
+from itertools import chain
+
+from sqlalchemy import event
+
+from app import app, CURR_USER_KEY
+from bench_api import busiest_user_id
+from models import db, Message
+
+
+def page_urls(user_id, message_id):
+    """Get the URLs of the pages to explain."""
+
+    user_pages = ('', '/following', '/followers', '/likes')
+    api_pages = ('', '/messages', '/following', '/followers', '/likes')
+
+    return chain(
+        ['/', '/users', '/users?q=a', f'/messages/{message_id}',
+         '/api/v1/timeline'],
+        (f'/users/{user_id}{page}' for page in user_pages),
+        (f'/api/v1/users/{user_id}{page}' for page in api_pages),
+    )
+
+
+def record_selects(client, url):
+    """Request `url`; get the (statement, parameters) of its SELECTs."""
+
+    selects = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            selects.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        resp = client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    assert resp.status_code == 200, (url, resp.status_code)
+    return selects
+
+
+def explain(statement, parameters):
+    """Get the lines of the plan for a statement."""
+
+    if db.engine.dialect.name == 'postgresql':
+        prefix = 'EXPLAIN (ANALYZE, BUFFERS) '
+    elif db.engine.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+
+    conn = db.engine.raw_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(prefix + statement, parameters)
+        rows = cursor.fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+
+    # PostgreSQL gives one column of text; SQLite (id, parent, _, detail)
+    return [str(row[-1]) for row in rows]
+
+
+def is_full_scan(plan):
+    """Does the plan read a whole table?"""
+
+    return any('Seq Scan' in line or line.startswith('SCAN ')
+               for line in plan)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--user-id', type=int)
+    parser.add_argument('--seq-scans-only', action='store_true',
+                        help="only print plans that scan a whole table")
+    args = parser.parse_args()
+
+    app.config['DEBUG_TB_ENABLED'] = False
+
+    with app.app_context():
+        user_id = args.user_id or busiest_user_id()
+        message_id = (db.session.query(Message.id)
+                      .filter(Message.user_id == user_id)
+                      .limit(1)
+                      .scalar())
+
+    if message_id is None:
+        parser.error("no follows or messages; seed the database first")
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    full_scans = 0
+
+    for url in page_urls(user_id, message_id):
+        selects = record_selects(client, url)
+
+        with app.app_context():
+            for statement, parameters in selects:
+                plan = explain(statement, parameters)
+                if is_full_scan(plan):
+                    full_scans += 1
+                elif args.seq_scans_only:
+                    continue
+
+                print(f"=== {url}{'  [FULL SCAN]' if is_full_scan(plan) else ''}")
+                print(' '.join(statement.split()))
+                print('\n'.join(f"    {line}" for line in plan))
+                print()
+
+    print(f"{full_scans} queries scan a whole table")
+
+
+if __name__ == '__main__':
+    main()
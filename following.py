@@ -0,0 +1,42 @@
+"""Following and unfollowing, for the HTML pages and the JSON API.
+
+Each is one INSERT (that does nothing if the follow exists) or DELETE
+on `follows`, without loading anyone's `following` collection. The
+counters, the follower's timeline and suggestions are only updated if
+that changed a row. Repeating a request, or two racing each other,
+therefore has the same effect as sending it once.
+"""
+
+from models import Follows, User
+import suggestions
+from timelines import get_timelines
+
+
+def set_following(user_id, followed_id, following):
+    """Make `user_id` follow `followed_id`, or stop following them.
+
+    Returns whether anything changed. Raises IntegrityError if either
+    user doesn't exist.
+    """
+
+    if user_id == followed_id:
+        raise ValueError("Users can't follow themselves.")
+
+    if following:
+        changed = Follows.add(user_id, followed_id)
+    else:
+        changed = Follows.remove(user_id, followed_id)
+
+    if changed:
+        delta = 1 if following else -1
+        User.adjust_counters([user_id], following_count=delta)
+        User.adjust_counters([followed_id], followers_count=delta)
+
+        if following:
+            get_timelines().add_follow(user_id, followed_id)
+            suggestions.add_follow(user_id, followed_id)
+        else:
+            get_timelines().remove_follow(user_id, followed_id)
+            suggestions.remove_follow(user_id, followed_id)
+
+    return changed
@@ -3,28 +3,47 @@
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
 tweak the CSV formats or generate fewer/more rows.
+
+    python generator/create_csvs.py [--users 300] [--messages 1000]
+        [--follows 5000] [--skew 1.0] [--seed 0] [--end 2018-10-01]
+        [--shards 1] [--workers 4] [--out generator]
+
+Rows are written straight to disk as they're made, so any size fits in
+memory. Some users are much busier than others: the number of messages
+each user posts, how many people they follow and how many followers they
+get all follow a Zipf distribution with exponent --skew. Message and
+follow counts are therefore approximate. Each user's messages are
+written in time order.
+
+The same arguments always give the same files. With --shards N, users
+are split into N id ranges and each range is written by its own process
+to `users-000.csv`, `messages-000.csv`, `follows-000.csv` and so on, which
+`seed.py` loads in order.
 """
 
+import argparse
 import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
+import math
+import os
+import random
+from datetime import datetime
+from glob import glob
+from multiprocessing import Pool
+
 from faker import Faker
 from helpers import get_random_datetime
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
+USERS_CSV_HEADERS = ['id', 'email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
 MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
 FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+TABLES = ('users', 'messages', 'follows')
 
-fake = Faker()
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-# Generate random profile image URLs to use for users
+# Random profile image URLs to use for users
 
 image_urls = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
@@ -32,46 +51,231 @@ image_urls = [
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
+# Random header image URLs to use for users; these are made up from a
+# pattern, so generating data doesn't need the network
 
 header_image_urls = [
-    requests.get(f"http://www.splashbase.co/api/v1/images/{i}").json()['url']
+    f"https://picsum.photos/seed/warbler{i}/1280/400"
     for i in range(1, 46)
 ]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
 
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
+class Zipf:
+    """Ranks 1..n, where rank r is weighted 1 / r ** s.
+
+    This uses the continuous approximation of the distribution, whose
+    CDF has a closed form, so neither sampling nor looking up a rank's
+    share needs a table of n weights.
+    """
+
+    def __init__(self, n, s):
+        self.n = n
+        self.s = s
+
+    def cdf(self, x):
+        """Share of the total weight below `x` (for 1 <= x <= n + 1)."""
+
+        if math.isclose(self.s, 1):
+            return math.log(x) / math.log(self.n + 1)
+
+        return ((x ** (1 - self.s) - 1) /
+                ((self.n + 1) ** (1 - self.s) - 1))
+
+    def share(self, rank):
+        """Share of the total weight held by `rank`."""
+
+        return self.cdf(rank + 1) - self.cdf(rank)
+
+    def sample(self, rng):
+        """Draw a rank."""
+
+        u = rng.random()
+
+        if math.isclose(self.s, 1):
+            x = (self.n + 1) ** u
+        else:
+            x = (1 + u * ((self.n + 1) ** (1 - self.s) - 1)) ** (1 / (1 - self.s))
+
+        return min(int(x), self.n)
+
+
+class Shuffle:
+    """A random one-to-one mapping of 1..n onto itself, without a table.
+
+    Used to decide which user has which rank, so the busiest users are
+    spread over all ids rather than being the lowest ones.
+    """
+
+    def __init__(self, n, rng):
+        self.n = n
+        self.multiplier = 1
+        if n > 1:
+            self.multiplier = rng.randrange(1, n)
+            while math.gcd(self.multiplier, n) != 1:
+                self.multiplier = rng.randrange(1, n)
+        self.offset = rng.randrange(n)
+
+    def __call__(self, i):
+        return (self.multiplier * (i - 1) + self.offset) % self.n + 1
+
+    def inverse(self, j):
+        return (pow(self.multiplier, -1, self.n) * (j - 1 - self.offset)) % self.n + 1
+
+
+def make_rng(args, *parts):
+    """Get a Random seeded from --seed and `parts`."""
+
+    return random.Random('-'.join(map(str, [args.seed, *parts])))
+
+
+def rankings(args):
+    """Get the Shuffles giving each user's activity and popularity ranks.
+
+    Every process makes the same ones from --seed.
+    """
+
+    return {name: Shuffle(args.users, make_rng(args, name))
+            for name in ('posting', 'following', 'followed')}
+
+
+def draw_count(total, share, rng):
+    """Round `total * share` up or down at random, keeping the mean."""
+
+    expected = total * share
+    return int(expected) + (rng.random() < expected % 1)
+
+
+def write_users(args, shard, first_id, last_id, writer):
+    rng = make_rng(args, 'users', shard)
+    fake = Faker()
+    fake.seed_instance(rng.random())
+
+    for user_id in range(first_id, last_id + 1):
+        # ids keep the names unique however many users there are
+        username = f"{fake.user_name()}{user_id}"
+        writer.writerow(dict(
+            id=user_id,
+            email=f"{username}@{fake.free_email_domain()}",
+            username=username,
+            image_url=rng.choice(image_urls),
+            password=PASSWORD,
             bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
+            header_image_url=rng.choice(header_image_urls),
             location=fake.city()
         ))
 
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
 
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
-        ))
+def write_messages(args, shard, first_id, last_id, writer):
+    rng = make_rng(args, 'messages', shard)
+    fake = Faker()
+    fake.seed_instance(rng.random())
+    posting = rankings(args)['posting']
+    zipf = Zipf(args.users, args.skew)
+
+    for user_id in range(first_id, last_id + 1):
+        count = draw_count(args.messages, zipf.share(posting(user_id)), rng)
+        timestamps = sorted(get_random_datetime(rng=rng, now=args.end)
+                            for _ in range(count))
+
+        for timestamp in timestamps:
+            writer.writerow(dict(
+                text=fake.paragraph()[:MAX_WARBLER_LENGTH],
+                timestamp=timestamp,
+                user_id=user_id
+            ))
+
+
+def write_follows(args, shard, first_id, last_id, writer):
+    """Write the follows of users first_id..last_id.
+
+    How many people each user follows comes from their 'following' rank;
+    who they follow is drawn by 'followed' rank (popularity), skipping
+    repeats, so only one user's follows are held at a time.
+    """
+
+    rng = make_rng(args, 'follows', shard)
+    ranks = rankings(args)
+    followed = ranks['followed']
+    zipf = Zipf(args.users, args.skew)
+
+    for follower in range(first_id, last_id + 1):
+        count = min(args.users - 1,
+                    draw_count(args.follows,
+                               zipf.share(ranks['following'](follower)), rng))
+        following = set()
+
+        # popular users get drawn over and over; give up on the rest
+        # rather than loop forever for very sociable users
+        for _ in range(10 * count):
+            if len(following) == count:
+                break
+            user_id = followed.inverse(zipf.sample(rng))
+            if user_id != follower and user_id not in following:
+                following.add(user_id)
+                writer.writerow(dict(user_being_followed_id=user_id,
+                                     user_following_id=follower))
+
+
+WRITERS = {
+    'users': (USERS_CSV_HEADERS, write_users),
+    'messages': (MESSAGES_CSV_HEADERS, write_messages),
+    'follows': (FOLLOWS_CSV_HEADERS, write_follows),
+}
+
+
+def file_name(args, table, shard):
+    if args.shards == 1:
+        return os.path.join(args.out, f'{table}.csv')
+    return os.path.join(args.out, f'{table}-{shard:03d}.csv')
+
+
+def write_shard(task):
+    """Write one table's rows for one shard's range of users."""
+
+    args, table, shard = task
+    headers, write = WRITERS[table]
+
+    per_shard = math.ceil(args.users / args.shards)
+    first_id = shard * per_shard + 1
+    last_id = min(args.users, (shard + 1) * per_shard)
+
+    with open(file_name(args, table, shard), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=headers)
+        writer.writeheader()
+        write(args, shard, first_id, last_id, writer)
+
+    return file_name(args, table, shard)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=300)
+    parser.add_argument('--messages', type=int, default=1000)
+    parser.add_argument('--follows', type=int, default=5000)
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help="Zipf exponent for activity and popularity")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--end', type=datetime.fromisoformat,
+                        default=datetime(2018, 10, 1),
+                        help="latest message time (messages span 2 years)")
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--out', default='generator')
+    args = parser.parse_args()
+
+    # don't leave files from an earlier run with another --shards behind
+    for table in TABLES:
+        for pattern in (f'{table}.csv', f'{table}-*.csv'):
+            for name in glob(os.path.join(args.out, pattern)):
+                os.remove(name)
 
-# Generate follows.csv from random pairings of users
+    tasks = [(args, table, shard)
+             for table in TABLES for shard in range(args.shards)]
 
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
+    with Pool(min(args.workers, len(tasks))) as pool:
+        for name in pool.imap_unordered(write_shard, tasks):
+            print(f"wrote {name}")
 
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
 
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,224 @@
+"""Password hashing for Warbler.
+
+bcrypt is deliberately slow, so hashing and checking passwords runs in a
+small worker pool rather than on the request thread, and the pool is
+bounded: when every worker is busy and the queue is full, requests get a
+`HasherBusy` error (a 503) instead of piling up behind each other.
+
+The bcrypt cost ("log rounds") is either fixed with BCRYPT_LOG_ROUNDS or
+picked when the hasher is configured (at startup) so that one hash takes about BCRYPT_TARGET_MS on this
+machine, but never below BCRYPT_MIN_ROUNDS. `User.authenticate` rehashes
+passwords stored at a lower cost; hashes at a higher cost are left alone,
+so a slow or busy host never weakens them.
+
+If a pool worker dies (say, killed for using too much memory), the
+process pool is broken for good, so it's replaced and the work retried
+once rather than failing every later login.
+
+Config keys (read by `hasher.init_app`):
+
+- BCRYPT_EXECUTOR: 'process' (default), 'thread' or 'inline'
+- BCRYPT_MAX_WORKERS: worker count (default: CPU count)
+- BCRYPT_MAX_PENDING: hashes allowed to wait for a worker (default: 2x)
+- BCRYPT_QUEUE_TIMEOUT: seconds to wait for a queue slot (default: 0.5)
+- BCRYPT_TARGET_MS: target time per hash (default: 250)
+- BCRYPT_MIN_ROUNDS: lowest cost calibration may pick (default: 12)
+- BCRYPT_LOG_ROUNDS: fixed cost; skips calibration
+"""
+
+import math
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+MIN_ROUNDS = 4
+MAX_ROUNDS = 16
+CALIBRATION_ROUNDS = 8
+
+# Flask-Bcrypt's default, which existing hashes were made with
+DEFAULT_MIN_ROUNDS = 12
+
+
+class HasherBusy(Exception):
+    """Every hashing worker is busy and the queue is full."""
+
+
+class InlineExecutor:
+    """Stand-in executor that runs work on the calling thread."""
+
+    def submit(self, fn, *args):
+        return _Done(fn(*args))
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class _Done:
+    """An already-finished future."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def result(self):
+        return self.value
+
+
+EXECUTORS = {
+    'process': ProcessPoolExecutor,
+    'thread': ThreadPoolExecutor,
+    'inline': lambda max_workers: InlineExecutor(),
+}
+
+
+def hash_password(password, rounds):
+    """Hash `password` (bytes) at cost `rounds`. Runs in a worker."""
+
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def check_password(password, hashed):
+    """Does `password` match `hashed` (both bytes)? Runs in a worker."""
+
+    return bcrypt.checkpw(password, hashed)
+
+
+def get_rounds(hashed):
+    """Get the cost a bcrypt hash ('$2b$12$...') was made with."""
+
+    return int(hashed.split('$')[2])
+
+
+def calibrate(target_ms):
+    """Pick the highest cost whose hash takes at most `target_ms` here."""
+
+    start = time.perf_counter()
+    hash_password(b'calibration', CALIBRATION_ROUNDS)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    # each extra round doubles the work
+    rounds = CALIBRATION_ROUNDS + math.floor(math.log2(target_ms / elapsed_ms))
+    return max(MIN_ROUNDS, min(MAX_ROUNDS, rounds))
+
+
+class PasswordHasher:
+    """Bounded pool for hashing and checking passwords."""
+
+    def __init__(self):
+        self.configure({})
+
+    def init_app(self, app):
+        """Configure from `app.config`."""
+
+        self.configure(app.config)
+
+    def configure(self, config):
+        """(Re)configure from a config mapping; see module docstring."""
+
+        self.shutdown()
+
+        self.executor_kind = config.get('BCRYPT_EXECUTOR', 'process')
+        self.max_workers = config.get('BCRYPT_MAX_WORKERS') or os.cpu_count()
+        self.max_pending = config.get('BCRYPT_MAX_PENDING',
+                                      2 * self.max_workers)
+        self.queue_timeout = config.get('BCRYPT_QUEUE_TIMEOUT', 0.5)
+        self.target_ms = config.get('BCRYPT_TARGET_MS', 250)
+        self.min_rounds = config.get('BCRYPT_MIN_ROUNDS', DEFAULT_MIN_ROUNDS)
+
+        # the bcrypt cost new hashes are made with; calibrated here rather
+        # than on the first request, which would be kept waiting for it
+        self.rounds = config.get('BCRYPT_LOG_ROUNDS')
+        if self.rounds is None:
+            self.rounds = max(self.min_rounds, calibrate(self.target_ms))
+
+        self.slots = threading.BoundedSemaphore(self.max_workers +
+                                                self.max_pending)
+
+        # called after each run with (fn name, seconds spent waiting for a
+        # queue slot, seconds until the result came back); see metrics.py
+        self.on_timing = getattr(self, 'on_timing', None)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = EXECUTORS[self.executor_kind](
+                    max_workers=self.max_workers)
+            return self._executor
+
+    def shutdown(self):
+        """Stop the worker pool, if it's been started."""
+
+        executor = getattr(self, '_executor', None)
+
+        if executor is not None:
+            executor.shutdown(wait=True)
+            self._executor = None
+
+    def run(self, fn, *args):
+        """Run `fn(*args)` in the pool and wait for its result.
+
+        Raises HasherBusy if no queue slot frees up within queue_timeout.
+        If the process pool breaks, it's replaced and `fn` retried once.
+        """
+
+        queued = time.perf_counter()
+
+        if not self.slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy()
+
+        started = time.perf_counter()
+
+        try:
+            try:
+                return self.submit(fn, *args)
+            except BrokenProcessPool:
+                return self.submit(fn, *args)
+        finally:
+            self.slots.release()
+            if self.on_timing:
+                self.on_timing(fn.__name__, started - queued,
+                               time.perf_counter() - started)
+
+    def submit(self, fn, *args):
+        """Run `fn(*args)` on the executor, replacing it if it's broken."""
+
+        executor = self.executor
+
+        try:
+            return executor.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # another thread may have replaced it already
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+
+    def hash(self, password):
+        """Hash `password`, returning the hash as a string."""
+
+        if not password:
+            raise ValueError('Password must be non-empty.')
+
+        hashed = self.run(hash_password, password.encode('UTF-8'), self.rounds)
+        return hashed.decode('UTF-8')
+
+    def check(self, hashed, password):
+        """Does `password` match the string hash `hashed`?"""
+
+        return self.run(check_password, password.encode('UTF-8'),
+                        hashed.encode('UTF-8'))
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made at a lower cost than we use now?"""
+
+        return get_rounds(hashed) < self.rounds
+
+
+hasher = PasswordHasher()
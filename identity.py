@@ -0,0 +1,126 @@
+"""Cache of logged-in users' rows, so `g.user` doesn't cost a query.
+
+Each entry is a snapshot of a user's column values, kept for at most
+`ttl` seconds; the least recently used entries are dropped beyond
+`max_size`. On a hit the snapshot is merged into the session as an
+already-loaded object, so relationships still lazy-load normally.
+
+Anything that changes a user row must call `invalidate` (or `clear`)
+once the change is committed; `models.py` does this for ORM updates and
+the counter helpers. A lookup that raced an invalidation isn't stored,
+since it may have read the row as it was before the commit. Each
+process has its own cache, so `ttl` bounds how stale another process's
+copy can be.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class IdentityCache:
+    """TTL- and size-bounded LRU cache of model rows keyed by primary key."""
+
+    def __init__(self, max_size=1024, ttl=30):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # bumped by every invalidation, so lookups can tell they raced one
+        self.generation = 0
+
+        # called with True (a hit) or False (a miss) after each lookup;
+        # see metrics.py
+        self.on_lookup = None
+
+    def configure(self, max_size, ttl):
+        """Change the size limit and TTL, dropping all entries."""
+
+        with self.lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.entries.clear()
+
+    def get(self, session, model, id):
+        """Get the `model` with primary key `id`, attached to `session`.
+
+        Returns None if there's no such row.
+        """
+
+        now = time.monotonic()
+
+        with self.lock:
+            entry = self.entries.get(id)
+
+            if entry and entry[0] > now:
+                self.entries.move_to_end(id)
+                self.hits += 1
+                values = entry[1]
+            else:
+                self.misses += 1
+                values = None
+
+            generation = self.generation
+
+        if self.on_lookup:
+            self.on_lookup(values is not None)
+
+        if values is not None:
+            obj = model(**values)
+            make_transient_to_detached(obj)
+            return session.merge(obj, load=False)
+
+        obj = session.query(model).get(id)
+
+        if obj is not None:
+            self.put(id, {attr.key: getattr(obj, attr.key)
+                          for attr in inspect(model).column_attrs},
+                     generation)
+
+        return obj
+
+    def put(self, id, values, generation=None):
+        """Store a snapshot of column `values` for `id`.
+
+        If `generation` is given, the snapshot is only stored if nothing
+        was invalidated since it was read.
+        """
+
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+
+            self.entries[id] = (time.monotonic() + self.ttl, values)
+            self.entries.move_to_end(id)
+
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, *ids):
+        """Drop the entries for `ids`."""
+
+        with self.lock:
+            self.generation += 1
+            for id in ids:
+                self.entries.pop(id, None)
+
+    def clear(self):
+        """Drop every entry."""
+
+        with self.lock:
+            self.generation += 1
+            self.entries.clear()
+
+    def stats(self):
+        """Get hit/miss counts and the current size."""
+
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'size': len(self.entries)}
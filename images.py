@@ -0,0 +1,218 @@
+"""Uploaded profile and header images, with thumbnails.
+
+Users can upload their picture or header image instead of linking to
+one. `ingest` checks the upload's header, which is cheap. It then hands
+the bytes to a small thread pool and returns, so the request doesn't
+wait for decoding and resizing. The worker crops the image to each of
+the kind's SIZES. It saves every size as WebP and as JPEG, the fallback
+for browsers without WebP, under UPLOADS_DIR, named after a hash of the
+upload. Only then does it point the user's image_url (or
+header_image_url) at the 'large' JPEG.
+
+Memory is bounded three ways. Uploads are limited to MAX_CONTENT_LENGTH
+bytes and IMAGE_MAX_PIXELS pixels. At most IMAGE_WORKERS images are
+decoded at once. At most IMAGE_MAX_PENDING more wait for a worker;
+beyond that `ingest` raises ImagesBusy. JPEGs are also decoded at a
+reduced scale when that's still big enough (`Image.draft`).
+
+Templates show an image at a given size with the `picture` macro in
+_images.html. For uploaded images it links the small files with a WebP
+<source>, and for any other URL it falls back to a plain <img>. Files
+are named by content, so /uploads/ serves them with an immutable
+Cache-Control.
+"""
+
+import hashlib
+import logging
+import os
+import re
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from io import BytesIO
+
+from flask import current_app, send_from_directory
+from PIL import Image, ImageOps
+
+from models import db, User
+
+log = logging.getLogger('warbler.images')
+
+# (width, height) of each kind's thumbnails; 'small' is twice the size
+# timelines and user cards show them at, for high-DPI screens
+SIZES = {
+    'avatar': {'small': (140, 140), 'large': (400, 400)},
+    'header': {'small': (640, 200), 'large': (1600, 500)},
+}
+
+FIELDS = {'image_url': 'avatar', 'header_image_url': 'header'}
+
+FORMATS = {'JPEG', 'PNG', 'GIF', 'WEBP'}
+
+# the extension and Pillow options each thumbnail is saved with
+OUTPUTS = (('webp', 'WEBP', dict(quality=80, method=4)),
+           ('jpg', 'JPEG', dict(quality=85, optimize=True, progressive=True)))
+
+UPLOAD_URL = re.compile(r'^/uploads/([0-9a-f]+)-(avatar|header)-large\.jpg$')
+
+Thumbnail = namedtuple('Thumbnail', ['webp', 'fallback'])
+
+
+class ImagesBusy(Exception):
+    """Every thumbnail worker is busy and the queue is full."""
+
+
+class BadImage(ValueError):
+    """The upload isn't an image we take."""
+
+
+def file_name(digest, kind, size, ext):
+    return f"{digest}-{kind}-{size}.{ext}"
+
+
+def check(data, max_pixels):
+    """Raise BadImage unless `data` looks like an image we can take.
+
+    Only the header is read; nothing is decoded.
+    """
+
+    try:
+        with Image.open(BytesIO(data)) as image:
+            format, (width, height) = image.format, image.size
+    except (OSError, Image.DecompressionBombError):
+        raise BadImage("That isn't an image.")
+
+    if format not in FORMATS:
+        raise BadImage("Please upload a JPEG, PNG, GIF or WebP image.")
+
+    if width * height > max_pixels:
+        raise BadImage("That image is too big.")
+
+
+def make_thumbnails(data, kind, digest, out_dir):
+    """Write every size of `kind` for the image in `data` to `out_dir`."""
+
+    sizes = SIZES[kind]
+
+    with Image.open(BytesIO(data)) as image:
+        # JPEGs can decode straight to a smaller scale, saving memory
+        image.draft('RGB', max(sizes.values()))
+
+        # transparent parts go white rather than black
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        image = background
+
+    for size, dimensions in sizes.items():
+        thumbnail = ImageOps.fit(image, dimensions, Image.LANCZOS)
+
+        for ext, format, options in OUTPUTS:
+            path = os.path.join(out_dir, file_name(digest, kind, size, ext))
+            partial = f"{path}.{threading.get_ident()}.tmp"
+            thumbnail.save(partial, format, **options)
+            os.replace(partial, path)
+
+
+def thumbnail(url, size):
+    """Get the Thumbnail at `size` of an uploaded image URL, or None."""
+
+    match = UPLOAD_URL.match(url or '')
+
+    if match is None:
+        return None
+
+    digest, kind = match.groups()
+    return Thumbnail(*(f"/uploads/{file_name(digest, kind, size, ext)}"
+                       for ext, _, _ in OUTPUTS))
+
+
+class Thumbnailer:
+    """Bounded pool that makes thumbnails and then updates users."""
+
+    def init_app(self, app):
+        self.app = app
+        self.workers = app.config['IMAGE_WORKERS']
+        self.slots = threading.BoundedSemaphore(
+            self.workers + app.config['IMAGE_MAX_PENDING'])
+        self.executor = ThreadPoolExecutor(max_workers=self.workers,
+                                           thread_name_prefix='thumbnails')
+        self.pending = set()
+
+    def ingest(self, user_id, field, data):
+        """Start making thumbnails of `data` for a user's `field`.
+
+        Raises BadImage if it isn't an image we take, or ImagesBusy if
+        there are too many waiting already. Returns the future.
+        """
+
+        config = self.app.config
+        check(data, config['IMAGE_MAX_PIXELS'])
+
+        if not self.slots.acquire(blocking=False):
+            raise ImagesBusy()
+
+        digest = hashlib.sha256(data).hexdigest()[:32]
+        future = self.executor.submit(self.run, user_id, field, data, digest)
+        self.pending.add(future)
+        future.add_done_callback(self.pending.discard)
+        return future
+
+    def run(self, user_id, field, data, digest):
+        # nobody waits on the future, so failures are only seen in the log
+        try:
+            self.make(field, data, digest)
+            self.save(user_id, field, digest)
+        except Exception:
+            log.exception("Updating user %s's %s failed", user_id, field)
+            raise
+
+    def make(self, field, data, digest):
+        kind = FIELDS[field]
+        out_dir = self.app.config['UPLOADS_DIR']
+
+        try:
+            os.makedirs(out_dir, exist_ok=True)
+
+            # the same upload again needs no work
+            if not os.path.exists(os.path.join(
+                    out_dir, file_name(digest, kind, 'large', 'jpg'))):
+                make_thumbnails(data, kind, digest, out_dir)
+        finally:
+            self.slots.release()
+
+    def save(self, user_id, field, digest):
+        with self.app.app_context():
+            user = User.query.get(user_id)
+            if user is not None:
+                setattr(user, field, f"/uploads/"
+                        f"{file_name(digest, FIELDS[field], 'large', 'jpg')}")
+                db.session.commit()
+
+    def wait(self):
+        """Wait until every image submitted so far is done."""
+
+        wait(list(self.pending))
+
+
+thumbnailer = Thumbnailer()
+
+
+def serve_upload(filename):
+    """Serve a thumbnail; they're named by content, so never change."""
+
+    response = send_from_directory(current_app.config['UPLOADS_DIR'],
+                                   filename)
+    response.headers['Cache-Control'] = (
+        f"public, max-age={current_app.config['STATIC_CACHE_MAX_AGE']}, "
+        "immutable")
+
+    return response
+
+
+def init_app(app):
+    """Serve thumbnails at /uploads/ and start the thumbnail pool."""
+
+    app.add_url_rule('/uploads/<path:filename>', 'uploads', serve_upload)
+    app.jinja_env.globals['thumbnail'] = thumbnail
+    thumbnailer.init_app(app)
@@ -0,0 +1,270 @@
+"""Bulk loading of CSV datasets into the database, for seed.py.
+
+A dataset is a directory of CSV files named after their tables (users,
+messages and follows), each with a header row; a table may also be split
+across several files (`messages-000.csv`, `messages-001.csv`, ...), which
+are loaded in name order. Users without an `id` column are numbered from
+1 in file order, which is what the other files' user ids refer to.
+
+Files are read a batch at a time, never all at once. On PostgreSQL each
+batch goes in with `COPY`; elsewhere with a plain `executemany`. Users
+are loaded first, then the other tables side by side on their own
+connections. Secondary indexes are dropped for the load and rebuilt
+afterwards (even if the load fails), which is much faster than updating
+them row by row.
+
+`scale` loads the dataset that many times over, as copies with their
+own users, to make bigger datasets out of small ones.
+"""
+
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from itertools import islice
+
+from models import db
+
+TABLES = ('users', 'messages', 'follows')
+
+# columns holding user ids, which are offset in each scaled copy
+USER_ID_COLUMNS = {
+    'users': ('id',),
+    'messages': ('user_id',),
+    'follows': ('user_being_followed_id', 'user_following_id'),
+}
+
+# columns that must stay unique across scaled copies
+UNIQUE_COLUMNS = ('username', 'email')
+
+
+class LoadReport:
+    """How many rows went into a table, and how long it took."""
+
+    def __init__(self, table, rows, seconds):
+        self.table = table
+        self.rows = rows
+        self.seconds = seconds
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0
+
+    def __str__(self):
+        return (f"{self.table:<10} {self.rows:>12,} rows "
+                f"{self.seconds:>8.1f}s {self.rows_per_second:>12,.0f} rows/s")
+
+
+def dataset_files(path, table):
+    """Get the CSV files holding `table` in the dataset at `path`."""
+
+    return sorted(glob(os.path.join(path, f'{table}.csv')) +
+                  glob(os.path.join(path, f'{table}-*.csv')))
+
+
+def read_header(files):
+    with open(files[0], newline='') as f:
+        return next(csv.reader(f))
+
+
+def count_users(files):
+    """Get the number of users (the highest user id) in the users files."""
+
+    header = read_header(files)
+    count = 0
+
+    for name in files:
+        with open(name, newline='') as f:
+            reader = csv.reader(f)
+            next(reader)
+            if 'id' in header:
+                id_index = header.index('id')
+                for row in reader:
+                    count = max(count, int(row[id_index]))
+            else:
+                count += sum(1 for _ in reader)
+
+    return count
+
+
+def read_rows(table, files, scale, num_users):
+    """Get (columns, iterator over rows) for `table` from `files`."""
+
+    header = read_header(files)
+    numbered = table == 'users' and 'id' not in header
+    columns = ['id', *header] if numbered else header
+
+    # other tables' ids would clash between copies, so let the database
+    # number their rows instead
+    dropped = (columns.index('id')
+               if scale > 1 and table != 'users' and 'id' in columns
+               else None)
+    if dropped is not None:
+        columns = columns[:dropped] + columns[dropped + 1:]
+
+    offset_indexes = [columns.index(name) for name in USER_ID_COLUMNS[table]
+                      if name in columns]
+    unique_indexes = [columns.index(name) for name in UNIQUE_COLUMNS
+                      if name in columns]
+
+    def rows():
+        for copy in range(scale):
+            offset = copy * num_users
+            next_id = 1
+
+            for name in files:
+                with open(name, newline='') as f:
+                    reader = csv.reader(f)
+                    next(reader)
+
+                    for row in reader:
+                        if dropped is not None:
+                            del row[dropped]
+                        if numbered:
+                            row.insert(0, next_id)
+                            next_id += 1
+                        if copy:
+                            for i in offset_indexes:
+                                row[i] = int(row[i]) + offset
+                            for i in unique_indexes:
+                                row[i] = f"{copy}.{row[i]}"
+                        yield row
+
+    return columns, rows()
+
+
+def batches(rows, batch_size):
+    """Split an iterator of rows into lists of up to `batch_size`."""
+
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def copy_batch(cursor, table, columns, batch):
+    """Load rows with PostgreSQL's COPY. Empty fields become NULL."""
+
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) "
+                       f"FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def insert_batch(cursor, table, columns, batch):
+    """Load rows with executemany, for databases without COPY."""
+
+    placeholder = '?' if db.engine.dialect.paramstyle == 'qmark' else '%s'
+    cursor.executemany(
+        f"INSERT INTO {table} ({', '.join(columns)}) "
+        f"VALUES ({', '.join([placeholder] * len(columns))})",
+        ([value if value != '' else None for value in row] for row in batch))
+
+
+def load_table(table, files, scale, num_users, batch_size):
+    """Load one table on its own connection; get a LoadReport."""
+
+    columns, rows = read_rows(table, files, scale, num_users)
+    is_postgres = db.engine.dialect.name == 'postgresql'
+    load_batch = copy_batch if is_postgres else insert_batch
+
+    start = time.perf_counter()
+    count = 0
+    conn = db.engine.raw_connection()
+
+    try:
+        cursor = conn.cursor()
+        for batch in batches(rows, batch_size):
+            load_batch(cursor, table, columns, batch)
+            count += len(batch)
+
+        if is_postgres and 'id' in columns:
+            # ids were given explicitly, so move the sequence past them
+            cursor.execute(f"SELECT setval(pg_get_serial_sequence("
+                           f"'{table}', 'id'), max(id)) FROM {table}")
+        conn.commit()
+    finally:
+        conn.close()
+
+    return LoadReport(table, count, time.perf_counter() - start)
+
+
+def index_definitions(tables):
+    """Get (name, CREATE INDEX statement) for the tables' secondary indexes.
+
+    Indexes backing primary keys and unique constraints aren't included.
+    """
+
+    if db.engine.dialect.name == 'postgresql':
+        query = ("SELECT indexname, indexdef FROM pg_indexes "
+                 "WHERE tablename IN :tables AND indexname NOT IN "
+                 "(SELECT conname FROM pg_constraint)")
+    else:
+        query = ("SELECT name, sql FROM sqlite_master WHERE type = 'index' "
+                 "AND tbl_name IN :tables AND sql IS NOT NULL")
+
+    return list(db.engine.execute(
+        db.text(query).bindparams(db.bindparam('tables', expanding=True)),
+        tables=list(tables)))
+
+
+def run_statements(statements, workers):
+    """Run DDL statements, each in its own transaction, `workers` at a time."""
+
+    def run(statement):
+        conn = db.engine.raw_connection()
+        try:
+            conn.cursor().execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(run, statements))
+
+
+def load_dataset(path, scale=1, batch_size=10000, workers=4):
+    """Load the dataset at `path` into empty tables.
+
+    Returns a LoadReport for each table and the seconds spent rebuilding
+    indexes.
+    """
+
+    if db.engine.dialect.name != 'postgresql':
+        # SQLite allows one writer at a time
+        workers = 1
+
+    files = {table: dataset_files(path, table) for table in TABLES}
+    missing = [table for table in TABLES if not files[table]]
+    if missing:
+        raise ValueError(f"No CSV files for {', '.join(missing)} in {path}")
+
+    num_users = count_users(files['users'])
+
+    # indexes are rebuilt even if the load fails part way, so a failed
+    # load never leaves the tables without them
+    dropped = []
+
+    try:
+        for name, definition in index_definitions(TABLES):
+            run_statements([f"DROP INDEX {name}"], 1)
+            dropped.append(definition)
+
+        reports = [load_table('users', files['users'], scale, num_users,
+                              batch_size)]
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            reports += pool.map(
+                lambda table: load_table(table, files[table], scale,
+                                         num_users, batch_size),
+                TABLES[1:])
+    finally:
+        start = time.perf_counter()
+        run_statements(dropped, workers)
+
+    return reports, time.perf_counter() - start
@@ -0,0 +1,181 @@
+"""Always-on request, SQL and bcrypt metrics, served at /metrics.
+
+`init_app` records, per endpoint:
+
+- how long requests take (warbler_request_duration_seconds)
+- how many SQL statements each request runs, and how long they take in
+  total (warbler_request_sql_statements, warbler_request_sql_seconds)
+- statements slower than METRICS_SLOW_QUERY_MS
+  (warbler_slow_queries_total), which are also logged as warnings on
+  the 'warbler.slow_queries' logger with the endpoint that ran them
+
+and how long bcrypt takes (warbler_bcrypt_seconds) and waits for a
+worker (warbler_bcrypt_queue_seconds), and how often the logged-in user
+comes from `user_cache` (warbler_user_cache_lookups_total).
+
+/metrics serves them in Prometheus' text format. When the app runs in
+several worker processes, set PROMETHEUS_MULTIPROC_DIR to an empty
+directory shared by them (and emptied on each deploy). Each process then
+writes its metrics there and /metrics adds them all up, whichever
+process serves it. Under gunicorn, also call `prometheus_client.
+multiprocess.mark_process_dead(worker.pid)` from its `child_exit` hook.
+"""
+
+import logging
+import os
+import time
+
+from flask import Response, current_app, g, has_app_context, has_request_context, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry,
+                               Counter, Histogram, generate_latest, multiprocess)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from hashing import hasher
+from models import user_cache
+
+slow_query_log = logging.getLogger('warbler.slow_queries')
+
+# buckets from 1ms to 10s; most pages take tens of milliseconds
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5,
+                   5, 10)
+
+REQUEST_SECONDS = Histogram(
+    'warbler_request_duration_seconds',
+    "Time taken to handle a request.",
+    ['endpoint', 'method', 'status'],
+    buckets=LATENCY_BUCKETS)
+
+REQUEST_SQL_STATEMENTS = Histogram(
+    'warbler_request_sql_statements',
+    "SQL statements run while handling a request.",
+    ['endpoint'],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89))
+
+REQUEST_SQL_SECONDS = Histogram(
+    'warbler_request_sql_seconds',
+    "Total time spent in SQL statements while handling a request.",
+    ['endpoint'],
+    buckets=LATENCY_BUCKETS)
+
+SLOW_QUERIES = Counter(
+    'warbler_slow_queries_total',
+    "SQL statements slower than METRICS_SLOW_QUERY_MS.",
+    ['endpoint'])
+
+BCRYPT_SECONDS = Histogram(
+    'warbler_bcrypt_seconds',
+    "Time taken to hash or check a password, once a worker was free.",
+    ['operation'],
+    buckets=(.01, .025, .05, .1, .25, .5, 1, 2.5, 5))
+
+BCRYPT_QUEUE_SECONDS = Histogram(
+    'warbler_bcrypt_queue_seconds',
+    "Time spent waiting for a slot in the password hashing queue.",
+    ['operation'],
+    buckets=LATENCY_BUCKETS)
+
+USER_CACHE_LOOKUPS = Counter(
+    'warbler_user_cache_lookups_total',
+    "Logged-in user lookups, by whether user_cache had them.",
+    ['result'])
+
+
+def current_endpoint():
+    """Get the endpoint being handled, for labelling metrics."""
+
+    if not has_request_context():
+        return 'none'
+
+    return request.endpoint or 'unmatched'
+
+
+def start_query(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def end_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+
+    if has_app_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.sql_seconds = g.get('sql_seconds', 0) + elapsed
+
+        slow_ms = current_app.config['METRICS_SLOW_QUERY_MS']
+
+        if elapsed * 1000 >= slow_ms:
+            endpoint = current_endpoint()
+            SLOW_QUERIES.labels(endpoint).inc()
+            slow_query_log.warning("%.0fms in %s: %s", elapsed * 1000,
+                                   endpoint, ' '.join(statement.split()))
+
+
+def abandon_query(context):
+    """Forget the start time of a statement that raised an error."""
+
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+def start_request():
+    g.request_start = time.perf_counter()
+    g.sql_statements = 0
+    g.sql_seconds = 0
+
+
+def end_request(response):
+    if 'request_start' in g:
+        endpoint = current_endpoint()
+        REQUEST_SECONDS.labels(endpoint, request.method,
+                               response.status_code).observe(
+            time.perf_counter() - g.request_start)
+        REQUEST_SQL_STATEMENTS.labels(endpoint).observe(g.sql_statements)
+        REQUEST_SQL_SECONDS.labels(endpoint).observe(g.sql_seconds)
+
+    return response
+
+
+def record_bcrypt(operation, queued_seconds, seconds):
+    BCRYPT_QUEUE_SECONDS.labels(operation).observe(queued_seconds)
+    BCRYPT_SECONDS.labels(operation).observe(seconds)
+
+
+def record_user_cache_lookup(hit):
+    USER_CACHE_LOOKUPS.labels('hit' if hit else 'miss').inc()
+
+
+def metrics():
+    """Serve every metric, from every worker process if there are several."""
+
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Start recording metrics for `app`, and serve them at /metrics.
+
+    Call this before registering other request hooks, so that the time
+    they take is counted too.
+    """
+
+    app.before_request(start_request)
+    app.after_request(end_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+    # on every engine, so statements on read replicas (see replicas.py)
+    # are counted too
+    for name, listener in (('before_cursor_execute', start_query),
+                           ('after_cursor_execute', end_query),
+                           ('handle_error', abandon_query)):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
+
+    hasher.on_timing = record_bcrypt
+    user_cache.on_lookup = record_user_cache_lookup
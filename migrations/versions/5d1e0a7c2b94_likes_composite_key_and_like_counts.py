@@ -0,0 +1,90 @@
+"""likes composite key and like counts
+
+Likes used to have their own id and a unique `message_id`, so only one
+user could like each message. They're now keyed on (user_id,
+message_id) with a `created_at`, and messages get a `like_count`.
+
+Existing likes are copied across with created_at set to the time of the
+upgrade, so their relative order is lost. Downgrading keeps only the
+earliest like of each message.
+
+Revision ID: 5d1e0a7c2b94
+Revises: fb3b44b3b1b8
+Create Date: 2026-10-17 01:30:12.402317
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d1e0a7c2b94'
+down_revision = 'fb3b44b3b1b8'
+branch_labels = None
+depends_on = None
+
+
+def rename_constraints(old_table, new_table, names):
+    """Give constraints made on a staging table the names they'd have had."""
+
+    if op.get_bind().dialect.name == 'postgresql':
+        for name in names:
+            op.execute(f"ALTER TABLE {new_table} RENAME CONSTRAINT "
+                       f"{old_table}_{name} TO {new_table}_{name}")
+
+
+def upgrade():
+    op.add_column('messages', sa.Column('like_count', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('likes_new',
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), server_default=sa.text('CURRENT_TIMESTAMP'), nullable=False),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('user_id', 'message_id')
+    )
+    op.execute("INSERT INTO likes_new (user_id, message_id) "
+               "SELECT DISTINCT user_id, message_id FROM likes "
+               "WHERE user_id IS NOT NULL AND message_id IS NOT NULL")
+    op.drop_table('likes')
+    op.rename_table('likes_new', 'likes')
+    rename_constraints('likes_new', 'likes',
+                       ['pkey', 'user_id_fkey', 'message_id_fkey'])
+
+    op.create_index('ix_likes_user_id_created_at', 'likes', ['user_id', sa.text('created_at DESC'), 'message_id'], unique=False)
+    op.create_index('ix_likes_message_id', 'likes', ['message_id'], unique=False)
+
+    op.execute("UPDATE messages SET like_count = "
+               "(SELECT count(*) FROM likes WHERE likes.message_id = messages.id)")
+    op.execute("UPDATE users SET likes_count = "
+               "(SELECT count(*) FROM likes WHERE likes.user_id = users.id)")
+
+
+def downgrade():
+    op.create_table('likes_old',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('message_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['message_id'], ['messages.id'], ondelete='cascade'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='cascade'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('message_id')
+    )
+    op.execute("INSERT INTO likes_old (user_id, message_id) "
+               "SELECT user_id, message_id FROM likes AS earliest "
+               "WHERE NOT EXISTS (SELECT 1 FROM likes AS earlier "
+               "WHERE earlier.message_id = earliest.message_id "
+               "AND (earlier.created_at, earlier.user_id) < "
+               "(earliest.created_at, earliest.user_id)) "
+               "ORDER BY created_at, user_id")
+    op.drop_table('likes')
+    op.rename_table('likes_old', 'likes')
+    rename_constraints('likes_old', 'likes',
+                       ['pkey', 'user_id_fkey', 'message_id_fkey',
+                        'message_id_key'])
+    op.create_index('ix_likes_user_id_message_id', 'likes', ['user_id', 'message_id'], unique=False)
+
+    op.execute("UPDATE users SET likes_count = "
+               "(SELECT count(*) FROM likes WHERE likes.user_id = users.id)")
+    op.drop_column('messages', 'like_count')
@@ -0,0 +1,35 @@
+"""add user search indexes
+
+Trigram indexes for user search (see search.py). They're PostgreSQL
+only; other databases fall back to an in-process index.
+
+Revision ID: d85a3b6e2f10
+Revises: 6c3e8f1b0a57
+Create Date: 2026-10-17 00:59:31.927554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd85a3b6e2f10'
+down_revision = '6c3e8f1b0a57'
+branch_labels = None
+depends_on = None
+
+COLUMNS = ('username', 'bio', 'location')
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        for column in COLUMNS:
+            op.execute(f"CREATE INDEX ix_users_{column}_trgm "
+                       f"ON users USING gin ({column} gin_trgm_ops)")
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for column in COLUMNS:
+            op.execute(f"DROP INDEX ix_users_{column}_trgm")
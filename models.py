@@ -2,11 +2,36 @@
 
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
-from flask_sqlalchemy import SQLAlchemy
+from flask import g, has_app_context
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, object_session
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+from hashing import hasher
+from identity import IdentityCache
+from replicas import RoutingSQLAlchemy
+
+db = RoutingSQLAlchemy()
+
+# Logged-in users' rows, cached for `add_user_to_g` in app.py
+user_cache = IdentityCache()
+
+
+def insert_ignore(table, **values):
+    """INSERT a row unless one with the same key exists; True if it didn't.
+
+    This is a single statement, so concurrent inserts of the same row
+    can't fail.
+    """
+
+    if db.engine.dialect.name == 'postgresql':
+        statement = (postgresql.insert(table).values(**values)
+                     .on_conflict_do_nothing())
+    else:
+        statement = (table.insert().values(**values)
+                     .prefix_with('OR IGNORE', dialect='sqlite'))
+
+    return db.session.execute(statement).rowcount == 1
 
 
 class Follows(db.Model):
@@ -26,28 +51,93 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # The primary key leads with the followed user, which serves
+    # "who follows X"; this serves "who does X follow".
+    __table_args__ = (
+        db.Index('ix_follows_user_following_id_user_being_followed_id',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
+    @classmethod
+    def add(cls, user_id, followed_id):
+        """Have `user_id` follow `followed_id`; False if they already did."""
+
+        return insert_ignore(cls.__table__, user_following_id=user_id,
+                             user_being_followed_id=followed_id)
+
+    @classmethod
+    def remove(cls, user_id, followed_id):
+        """Have `user_id` stop following `followed_id`; False if they didn't."""
+
+        return bool(cls
+                    .query
+                    .filter_by(user_following_id=user_id,
+                               user_being_followed_id=followed_id)
+                    .delete(synchronize_session=False))
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
     __tablename__ = 'likes' 
 
-    id = db.Column(
-        db.Integer,
-        primary_key=True
-    )
-
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
     )
 
     message_id = db.Column(
         db.Integer,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
     )
 
+    created_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+        server_default=db.func.now(),
+    )
+
+    # The primary key serves `liked_among`; these serve a user's likes
+    # page (most recent first) and a message's likes.
+    __table_args__ = (
+        db.Index('ix_likes_user_id_created_at',
+                 user_id, created_at.desc(), message_id),
+        db.Index('ix_likes_message_id', message_id),
+    )
+
+    @classmethod
+    def add(cls, user_id, message_id):
+        """Like a message; False if it was liked already."""
+
+        return insert_ignore(cls.__table__, user_id=user_id,
+                             message_id=message_id)
+
+    @classmethod
+    def remove(cls, user_id, message_id):
+        """Unlike a message; False if it wasn't liked."""
+
+        return bool(cls
+                    .query
+                    .filter_by(user_id=user_id, message_id=message_id)
+                    .delete(synchronize_session=False))
+
+    @classmethod
+    def set(cls, user_id, message_id, liked):
+        """Like or unlike a message, adjusting the counters if that
+        changed anything. Returns whether it did."""
+
+        changed = (cls.add if liked else cls.remove)(user_id, message_id)
+
+        if changed:
+            delta = 1 if liked else -1
+            User.adjust_counters([user_id], likes_count=delta)
+            Message.adjust_like_counts([message_id], delta)
+
+        return changed
+
 
 class User(db.Model):
     """User in the system."""
@@ -94,41 +184,203 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message')
+    # Denormalized sizes of the collections below, kept up to date by the
+    # routes that change them (see `adjust_counters`) so pages can show
+    # them without loading the collections. `repair_counters` recomputes
+    # them from scratch.
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Bumped whenever anything about the user changes, including their
+    # counters; pages showing the user derive their ETags from it.
+    version = db.Column(
+        db.Integer,
+        nullable=False,
+        default=1,
+        server_default='1',
+    )
+
+    # Set when the user deletes their account, in the same transaction
+    # that schedules the purge. They can't log in from then on, and the
+    # row stays until purge.py has removed the rest, so a purge that was
+    # interrupted can be found and finished.
+    deleted_at = db.Column(
+        db.DateTime,
+    )
+
+    __table_args__ = (
+        db.Index('ix_users_deleted_at', 'deleted_at',
+                 postgresql_where=db.text('deleted_at IS NOT NULL')),
+    )
+
+    # Deleting a user leaves their rows in these tables to the foreign
+    # keys' ON DELETE CASCADE, rather than the ORM loading and deleting
+    # them one by one (see purge.py for very big accounts).
+
+    messages = db.relationship('Message', passive_deletes=True)
 
     followers = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_being_followed_id == id),
-        secondaryjoin=(Follows.user_following_id == id)
+        secondaryjoin=(Follows.user_following_id == id),
+        passive_deletes=True,
     )
 
     following = db.relationship(
         "User",
         secondary="follows",
         primaryjoin=(Follows.user_following_id == id),
-        secondaryjoin=(Follows.user_being_followed_id == id)
+        secondaryjoin=(Follows.user_being_followed_id == id),
+        passive_deletes=True,
     )
 
     likes = db.relationship(
         'Message',
-        secondary="likes"
+        secondary="likes",
+        passive_deletes=True,
     )
 
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    def follow_ids(self):
+        """Get (ids this user follows, ids following this user) as sets.
+
+        Both sets come from one query on `follows`. For the logged-in user
+        (`g.user`) they're cached on `g` for the rest of the request, so
+        every `is_following` check a page makes shares them; routes that
+        change follows should `g.pop('follow_ids', None)`.
+        """
+
+        cache = has_app_context() and g.get('user') is self
+
+        if cache and 'follow_ids' in g:
+            return g.follow_ids
+
+        following = set()
+        followers = set()
+
+        rows = (db.session
+                .query(Follows.user_following_id,
+                       Follows.user_being_followed_id)
+                .filter((Follows.user_following_id == self.id) |
+                        (Follows.user_being_followed_id == self.id)))
+
+        for follower_id, followed_id in rows:
+            if follower_id == self.id:
+                following.add(followed_id)
+            if followed_id == self.id:
+                followers.add(follower_id)
+
+        if cache:
+            g.follow_ids = (following, followers)
+
+        return following, followers
+
+    def following_among(self, user_ids):
+        """Get the set of `user_ids` that this user follows, in one query."""
+
+        if not user_ids:
+            return set()
+
+        rows = (db.session
+                .query(Follows.user_being_followed_id)
+                .filter(Follows.user_following_id == self.id,
+                        Follows.user_being_followed_id.in_(user_ids)))
+
+        return {followed_id for (followed_id,) in rows}
+
+    def liked_among(self, message_ids):
+        """Get the set of `message_ids` that this user likes, in one query."""
+
+        if not message_ids:
+            return set()
+
+        rows = (db.session
+                .query(Likes.message_id)
+                .filter(Likes.user_id == self.id,
+                        Likes.message_id.in_(message_ids)))
+
+        return {message_id for (message_id,) in rows}
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follow_ids()[1]
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.id in self.follow_ids()[0]
+
+    @classmethod
+    def adjust_counters(cls, user_ids, **deltas):
+        """Add to the counters of the users in `user_ids`.
+
+        `user_ids` is a list of ids or a select of ids, and `deltas`
+        maps counter names to amounts, e.g. `followers_count=1`. This is a
+        single UPDATE in the current transaction, so concurrent requests
+        can't lose each other's changes.
+        """
+
+        (cls
+         .query
+         .filter(cls.id.in_(user_ids))
+         .update({cls.version: cls.version + 1,
+                  **{getattr(cls, name): getattr(cls, name) + delta
+                     for name, delta in deltas.items()}},
+                 synchronize_session=False))
+
+        if isinstance(user_ids, (list, tuple, set)):
+            evict_cached_users(db.session, user_ids)
+        else:
+            evict_cached_users(db.session)
+
+    @classmethod
+    def repair_counters(cls):
+        """Recompute every user's counters from the underlying tables."""
+
+        def count(user_column):
+            return (db.select([db.func.count()])
+                    .where(user_column == cls.id)
+                    .as_scalar())
+
+        cls.query.update({
+            cls.messages_count: count(Message.user_id),
+            cls.following_count: count(Follows.user_following_id),
+            cls.followers_count: count(Follows.user_being_followed_id),
+            cls.likes_count: count(Likes.user_id),
+            cls.version: cls.version + 1,
+        }, synchronize_session=False)
+
+        evict_cached_users(db.session)
 
     @classmethod
     def signup(cls, username, email, password, image_url):
@@ -137,7 +389,7 @@ class User(db.Model):
         Hashes password and adds user to system.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -158,18 +410,89 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        If the user's hash was made at a lower bcrypt cost than we use
+        now, it's replaced with a fresh one; the caller should commit.
+        Deleted accounts waiting to be purged can't log in.
         """
 
-        user = cls.query.filter_by(username=username).first()
+        user = cls.query.filter_by(username=username, deleted_at=None).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
 
 
+@event.listens_for(User, 'before_update')
+def bump_user_version(mapper, connection, user):
+    if db.session.is_modified(user, include_collections=False):
+        user.version = User.version + 1
+
+
+def evict_cached_users(session, user_ids=None):
+    """Drop `user_ids` (or every user) from `user_cache` when `session` ends.
+
+    Evicting at flush time would let a concurrent request cache the row
+    as it was before the commit, for the whole TTL.
+    """
+
+    if user_ids is None:
+        session.info['evict_all_users'] = True
+    else:
+        session.info.setdefault('evict_users', set()).update(user_ids)
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def invalidate_cached_user(mapper, connection, user):
+    evict_cached_users(object_session(user), [user.id])
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def clear_user_cache(delete_context):
+    if delete_context.mapper.class_ is User:
+        evict_cached_users(delete_context.session)
+
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def evict_pending_users(session):
+    # on rollback nothing changed, but a lookup inside the transaction
+    # may have cached its uncommitted values, so evict anyway
+    user_ids = session.info.pop('evict_users', None)
+
+    if session.info.pop('evict_all_users', False):
+        user_cache.clear()
+    elif user_ids:
+        user_cache.invalidate(*user_ids)
+
+
+# Trigram indexes for user search (see search.py). These are PostgreSQL
+# only; other databases fall back to an in-process index.
+
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm").execute_if(
+        dialect='postgresql'),
+)
+
+for column in ('username', 'bio', 'location'):
+    event.listen(
+        User.__table__,
+        'after_create',
+        DDL(f"CREATE INDEX ix_users_{column}_trgm "
+            f"ON users USING gin ({column} gin_trgm_ops)").execute_if(
+            dialect='postgresql'),
+    )
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
@@ -188,7 +511,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -197,8 +520,171 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Denormalized number of likes, kept up to date by the routes that
+    # add and remove likes (see `adjust_like_counts`) so timelines can
+    # show it without counting.
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User')
 
+    # a user's messages, newest first: profile pages and the home page
+    # when it reads messages directly
+    __table_args__ = (
+        db.Index('ix_messages_user_id_timestamp_id',
+                 user_id, timestamp.desc(), id.desc()),
+    )
+
+    @classmethod
+    def adjust_like_counts(cls, message_ids, delta):
+        """Add `delta` to the like counts of the messages in `message_ids`.
+
+        `message_ids` is a list of ids or a select of ids. Like
+        `User.adjust_counters`, this is a single UPDATE.
+        """
+
+        (cls
+         .query
+         .filter(cls.id.in_(message_ids))
+         .update({cls.like_count: cls.like_count + delta},
+                 synchronize_session=False))
+
+    @classmethod
+    def repair_like_counts(cls):
+        """Recompute every message's like count from `likes`."""
+
+        cls.query.update({
+            cls.like_count: (db.select([db.func.count()])
+                             .where(Likes.message_id == cls.id)
+                             .as_scalar()),
+        }, synchronize_session=False)
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Rows are written when a message is posted (fan-out on write) so that
+    the home page can read a user's timeline without touching `follows`.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        nullable=False,
+        index=True,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_id_timestamp',
+                 'user_id', 'timestamp', 'message_id'),
+        db.Index('ix_timeline_entries_message_id', 'message_id'),
+    )
+
+
+class TimelineState(db.Model):
+    """Whose home timelines are built, and how far back they're complete.
+
+    A user's timeline entries hold every message by them and the users
+    they follow from the horizon (horizon_timestamp, horizon_message_id)
+    on; anything older may have been trimmed. With no horizon, the
+    timeline holds all of them. Users without a row have no timeline yet,
+    and the home page queries their messages directly.
+    """
+
+    __tablename__ = 'timeline_states'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    horizon_timestamp = db.Column(
+        db.DateTime,
+    )
+
+    horizon_message_id = db.Column(
+        db.Integer,
+    )
+
+    @property
+    def horizon(self):
+        """The (timestamp, message_id) the timeline is complete back to."""
+
+        if self.horizon_timestamp is None:
+            return None
+
+        return (self.horizon_timestamp, self.horizon_message_id)
+
+    @horizon.setter
+    def horizon(self, horizon):
+        self.horizon_timestamp, self.horizon_message_id = horizon or (None, None)
+
+
+class Suggestion(db.Model):
+    """A user worth following, precomputed for the home page.
+
+    `score` is how many of the people `user_id` follows already follow
+    `suggested_id`; see suggestions.py.
+    """
+
+    __tablename__ = 'suggestions'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    suggested_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    suggested = db.relationship('User', foreign_keys=[suggested_id])
+
+    __table_args__ = (
+        db.Index('ix_suggestions_user_id_score',
+                 'user_id', score.desc(), 'suggested_id'),
+        db.Index('ix_suggestions_suggested_id', 'suggested_id'),
+    )
+
+
+def enable_foreign_keys(dbapi_connection, connection_record):
+    """Have SQLite enforce foreign keys, and so their ON DELETE CASCADE."""
+
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -208,3 +694,7 @@ def connect_db(app):
 
     db.app = app
     db.init_app(app)
+
+    with app.app_context():
+        if db.engine.dialect.name == 'sqlite':
+            event.listen(db.engine, 'connect', enable_foreign_keys)
@@ -0,0 +1,49 @@
+"""Keyset (cursor) pagination for message lists.
+
+Messages are ordered newest first by (timestamp, id); the id breaks ties
+between messages posted at the same moment. A cursor names the last
+message on a page, and the next page is everything strictly older than
+it. Unlike OFFSET, every page is a single index range scan, so the
+hundredth page costs the same as the first.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import tuple_
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(timestamp, id):
+    """Make a cursor pointing at the message with `timestamp` and `id`."""
+
+    return f"{timestamp.strftime(CURSOR_TIME_FORMAT)}-{id}"
+
+
+def decode_cursor(cursor):
+    """Turn a cursor back into a (timestamp, id) pair.
+
+    Raises ValueError if `cursor` is malformed.
+    """
+
+    timestamp, _, id = cursor.partition('-')
+    return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(id)
+
+
+def older_than(timestamp_column, id_column, position):
+    """Filter for rows that sort after `position` in newest-first order."""
+
+    return tuple_(timestamp_column, id_column) < tuple_(*position)
+
+
+def split_page(messages, per_page):
+    """Split a page fetched with one extra row into (page, next cursor).
+
+    The next cursor is None when there is nothing older to load.
+    """
+
+    if len(messages) <= per_page:
+        return messages, None
+
+    last = messages[per_page - 1]
+    return messages[:per_page], encode_cursor(last.timestamp, last.id)
@@ -0,0 +1,246 @@
+"""Deleting users, a bounded batch at a time.
+
+Deleting a user's row is a single statement. Their messages, likes,
+follows, timeline entries and suggestions go with it, through the
+foreign keys' ON DELETE CASCADE. That doesn't fix up the counters of
+the users and messages they touched, though. For an account with many
+thousands of rows, one cascading delete would also hold locks on all of
+them until it finishes.
+
+So `purge_user` first removes the account's follows, likes, messages
+and suggestions PURGE_BATCH_SIZE rows at a time. Each batch fixes the
+counters it affects and is committed on its own. Then it deletes the
+user. `delete_user` does this during the request for accounts with at
+most PURGE_INLINE_MAX_ROWS rows. Bigger accounts are purged on a
+background thread.
+
+Before any of that, the user's `deleted_at` is set and committed, so
+they can't log in any more and the purge is recorded in the database.
+From then on their profile 404s, they're left out of user lists and
+search, and nobody can follow them. A follow that raced the marking is
+swept up with the user's row locked, just before it's deleted, so the
+cascade never drops a follow without fixing its follower's counter.
+Purging is idempotent: if one fails part-way, or the process stops
+before the background thread finishes, `flask resume-purges` finishes
+every account marked deleted (or `flask purge-user ID` just one).
+"""
+
+import logging
+from collections import defaultdict
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import current_app
+from sqlalchemy import func, tuple_
+
+from models import db, Follows, Likes, Message, Suggestion, User
+from timelines import get_timelines
+
+log = logging.getLogger('warbler.purge')
+
+# one purge at a time, so big deletions don't compete for the database
+executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='purge')
+
+
+def footprint(user):
+    """Roughly how many rows deleting `user` touches, from their counters."""
+
+    return (user.messages_count + user.likes_count + user.following_count +
+            user.followers_count)
+
+
+def delete_follows(user_id, batch_size):
+    """Delete a batch of follows to or from `user_id`; False if none are left."""
+
+    rows = [tuple(row) for row in (
+        db.session
+        .query(Follows.user_following_id, Follows.user_being_followed_id)
+        .filter((Follows.user_following_id == user_id) |
+                (Follows.user_being_followed_id == user_id))
+        .limit(batch_size))]
+
+    if not rows:
+        return False
+
+    followed_ids = [followed for (follower, followed) in rows
+                    if follower == user_id]
+    follower_ids = [follower for (follower, followed) in rows
+                    if followed == user_id]
+
+    if followed_ids:
+        User.adjust_counters(followed_ids, followers_count=-1)
+    if follower_ids:
+        User.adjust_counters(follower_ids, following_count=-1)
+
+    (Follows
+     .query
+     .filter(tuple_(Follows.user_following_id,
+                    Follows.user_being_followed_id).in_(rows))
+     .delete(synchronize_session=False))
+
+    return True
+
+
+def delete_likes(user_id, batch_size):
+    """Delete a batch of `user_id`'s likes; False if none are left."""
+
+    message_ids = [message_id for (message_id,) in (
+        db.session
+        .query(Likes.message_id)
+        .filter(Likes.user_id == user_id)
+        .limit(batch_size))]
+
+    if not message_ids:
+        return False
+
+    Message.adjust_like_counts(message_ids, -1)
+
+    (Likes
+     .query
+     .filter(Likes.user_id == user_id, Likes.message_id.in_(message_ids))
+     .delete(synchronize_session=False))
+
+    return True
+
+
+def delete_messages(user_id, batch_size):
+    """Delete a batch of `user_id`'s messages; False if none are left.
+
+    Likes of the messages and their timeline entries go with them.
+    """
+
+    message_ids = [message_id for (message_id,) in (
+        db.session
+        .query(Message.id)
+        .filter(Message.user_id == user_id)
+        .limit(batch_size))]
+
+    if not message_ids:
+        return False
+
+    # users who liked several of these lose several likes
+    likers_by_count = defaultdict(list)
+    for liker_id, count in (db.session
+                            .query(Likes.user_id, func.count())
+                            .filter(Likes.message_id.in_(message_ids))
+                            .group_by(Likes.user_id)):
+        likers_by_count[count].append(liker_id)
+
+    for count, liker_ids in likers_by_count.items():
+        User.adjust_counters(liker_ids, likes_count=-count)
+
+    (Message
+     .query
+     .filter(Message.id.in_(message_ids))
+     .delete(synchronize_session=False))
+
+    return True
+
+
+def delete_suggestions(user_id, batch_size):
+    """Delete a batch of suggestions of `user_id`; False if none are left."""
+
+    suggested_to = [id for (id,) in (
+        db.session
+        .query(Suggestion.user_id)
+        .filter(Suggestion.suggested_id == user_id)
+        .limit(batch_size))]
+
+    if not suggested_to:
+        return False
+
+    (Suggestion
+     .query
+     .filter(Suggestion.suggested_id == user_id,
+             Suggestion.user_id.in_(suggested_to))
+     .delete(synchronize_session=False))
+
+    return True
+
+
+STEPS = (delete_follows, delete_likes, delete_messages, delete_suggestions)
+
+
+def mark_deleted(user):
+    """Stop `user` logging in, and record that they need purging."""
+
+    if user.deleted_at is None:
+        user.deleted_at = datetime.utcnow()
+
+
+def pending_user_ids():
+    """Get the ids of users marked deleted but not purged yet."""
+
+    return [id for (id,) in (db.session
+                             .query(User.id)
+                             .filter(User.deleted_at.isnot(None))
+                             .order_by(User.id))]
+
+
+def purge_user(user_id, batch_size):
+    """Delete a user and everything of theirs, committing after each batch."""
+
+    user = User.query.get(user_id)
+    if user is not None:
+        mark_deleted(user)
+        db.session.commit()
+
+    for step in STEPS:
+        while step(user_id, batch_size):
+            db.session.commit()
+
+    get_timelines().remove_user(user_id)
+
+    # with the row locked nobody can follow them; catch any follow that
+    # slipped in after the marking before the cascade would drop it
+    user = User.query.filter_by(id=user_id).with_for_update().first()
+    if user is not None:
+        while delete_follows(user_id, batch_size):
+            pass
+        db.session.delete(user)
+
+    db.session.commit()
+
+
+def purge_in_background(app, user_id, batch_size):
+    with app.app_context():
+        try:
+            purge_user(user_id, batch_size)
+        except Exception:
+            db.session.rollback()
+            log.exception("Purging user %s failed; finish it with "
+                          "`flask purge-user %s`", user_id, user_id)
+            raise
+
+
+def resume_purges(batch_size):
+    """Finish purging every user marked deleted; return their ids."""
+
+    user_ids = pending_user_ids()
+
+    for user_id in user_ids:
+        log.info("Resuming the purge of user %s", user_id)
+        purge_user(user_id, batch_size)
+
+    return user_ids
+
+
+def delete_user(user):
+    """Delete `user`, on a background thread if their account is big.
+
+    The user is marked deleted first, in its own committed transaction.
+    Returns the background purge's future, or None if `user` is already
+    gone.
+    """
+
+    app = current_app._get_current_object()
+    batch_size = app.config['PURGE_BATCH_SIZE']
+
+    mark_deleted(user)
+    db.session.commit()
+
+    if footprint(user) <= app.config['PURGE_INLINE_MAX_ROWS']:
+        purge_user(user.id, batch_size)
+        return None
+
+    return executor.submit(purge_in_background, app, user.id, batch_size)
@@ -0,0 +1,108 @@
+"""Sending read-only requests' queries to read replicas.
+
+Set SQLALCHEMY_REPLICA_URIS to a list of replica database URIs (from
+DATABASE_REPLICA_URLS, comma-separated, in app.py). Views decorated with
+`@replica_reads` then run their SELECTs on one of the replicas, picked
+at random per request; everything else stays on the primary.
+
+A request goes back to the primary as soon as it writes anything (a
+flush, or an INSERT/UPDATE/DELETE statement), so it reads its own
+writes. After a request has committed a write, that client's requests
+also read from the primary for SQLALCHEMY_REPLICA_LAG_SECONDS. Until
+then a replica may not have caught up, and a user would miss the
+message they just posted. This is tracked with a timestamp in the
+Flask session.
+
+Pool sizes are set separately for the primary (SQLALCHEMY_POOL_SIZE and
+SQLALCHEMY_MAX_OVERFLOW, as usual) and for each replica engine
+(SQLALCHEMY_REPLICA_ENGINE_OPTIONS, passed to `create_engine`).
+"""
+
+import random
+import time
+from functools import wraps
+
+from flask import current_app, request, session
+from flask_sqlalchemy import SignallingSession, SQLAlchemy
+from sqlalchemy import create_engine, orm
+from sqlalchemy.sql import Delete, Insert, Update
+from sqlalchemy.sql.elements import TextClause
+
+PRIMARY_UNTIL_KEY = 'primary_until'
+
+
+def is_write(clause):
+    """Could executing `clause` change the database?"""
+
+    if isinstance(clause, (Insert, Update, Delete)):
+        return True
+
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+    return False
+
+
+class RoutingSession(SignallingSession):
+    """Session that reads from a replica until it writes.
+
+    Reads go to `replica` when it's set (see `init_app`); flushes, write
+    statements and everything after them go to the primary.
+    """
+
+    def __init__(self, db, **options):
+        self.replica = None
+        self.wrote = False
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or is_write(clause):
+            self.wrote = True
+
+        if self.replica is None or self.wrote:
+            return super().get_bind(mapper, clause)
+
+        return self.replica
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy whose sessions can read from replicas."""
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+def replica_reads(view):
+    """Mark a view as read-only, so its queries may go to a replica."""
+
+    view.replica_reads = True
+    return view
+
+
+def init_app(app, db):
+    """Create the replica engines and route requests to them."""
+
+    app.extensions['replicas'] = [
+        create_engine(uri, **app.config['SQLALCHEMY_REPLICA_ENGINE_OPTIONS'])
+        for uri in app.config['SQLALCHEMY_REPLICA_URIS']]
+
+    @app.before_request
+    def use_replica():
+        replicas = current_app.extensions['replicas']
+        view = current_app.view_functions.get(request.endpoint)
+
+        # the session may outlive a request (it's per thread), so start over
+        db_session = db.session()
+        db_session.replica = None
+        db_session.wrote = False
+
+        if (replicas and getattr(view, 'replica_reads', False) and
+                session.get(PRIMARY_UNTIL_KEY, 0) < time.time()):
+            db_session.replica = random.choice(replicas)
+
+    @app.after_request
+    def remember_write(response):
+        if current_app.extensions['replicas'] and db.session().wrote:
+            session[PRIMARY_UNTIL_KEY] = (
+                time.time() + current_app.config['SQLALCHEMY_REPLICA_LAG_SECONDS'])
+        return response
@@ -0,0 +1,272 @@
+"""User search for Warbler.
+
+`/users?q=` finds users whose username, bio or location contains the
+search text, best matches first. On PostgreSQL this runs against pg_trgm
+GIN indexes (see `models.py`), which serve `ILIKE '%text%'` without a
+sequential scan. Elsewhere (SQLite, tests) an in-process trigram index,
+`user_index`, is used instead.
+
+Both rank results by pg_trgm's word_similarity (how closely the search
+text matches the most alike word in a field), counting a match in the
+username fully and a match in the bio or location at half weight.
+"""
+
+import re
+import threading
+
+from flask import current_app
+from sqlalchemy import event, func, or_
+from sqlalchemy.orm import Session
+
+from models import db, User
+
+SEARCH_FIELDS = ('username', 'bio', 'location')
+
+FIELD_WEIGHTS = {
+    'username': 1.0,
+    'bio': 0.5,
+    'location': 0.5,
+}
+
+
+def trigrams(text):
+    """Get the set of 3-character substrings of lowercased `text`."""
+
+    text = text.lower()
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def word_trigrams(text):
+    """Get pg_trgm's trigrams for `text`: those of each word, padded."""
+
+    return set().union(*(trigrams(f"  {word} ")
+                         for word in re.findall(r'\w+', text.lower())))
+
+
+def word_similarity(search, text):
+    """How alike `search` is to the closest word in `text`, from 0 to 1.
+
+    This approximates pg_trgm's word_similarity(): the share of trigrams
+    the search text has in common with the most alike word of `text`.
+    """
+
+    search_grams = word_trigrams(search)
+    best = 0.0
+
+    for word in re.findall(r'\w+', text.lower()):
+        grams = word_trigrams(word)
+        best = max(best, len(search_grams & grams) / len(search_grams | grams))
+
+    return best
+
+
+def rank(search, fields):
+    """Score a user's `fields` (a dict of field name to text) for `search`."""
+
+    return max(FIELD_WEIGHTS[name] * word_similarity(search, text)
+               for name, text in fields.items())
+
+
+class NgramIndex:
+    """In-process inverted index from trigrams to users.
+
+    Each posting list holds the ids of users with that trigram somewhere
+    in their username, bio or location. A search intersects the lists for
+    the search text's trigrams, then checks the few candidates for the
+    whole text, so it doesn't grow with the number of users.
+
+    The index is built from the database on first use. ORM inserts,
+    updates and deletes of users mark those users stale, and they're
+    re-read on the next search; a bulk `User.query.delete()` throws the
+    whole index away.
+    """
+
+    def __init__(self):
+        self.postings = {}
+        self.documents = {}
+        self.stale_ids = set()
+        self.built = False
+        # held while the index changes, so searches on other threads
+        # never see it half-updated; `mark_stale` runs inside flushes
+        # (including autoflushes under `refresh`), so it doesn't take it
+        self.lock = threading.Lock()
+
+    def add(self, user_id, fields):
+        """Index a user's `fields`, replacing anything indexed for them."""
+
+        with self.lock:
+            self._add(user_id, fields)
+
+    def remove(self, user_id):
+        """Drop a user from the index."""
+
+        with self.lock:
+            self._remove(user_id)
+
+    def mark_stale(self, user_id):
+        """Have a user re-read from the database before the next search."""
+
+        self.stale_ids.add(user_id)
+
+    def clear(self):
+        """Forget everything; the next search rebuilds the index."""
+
+        with self.lock:
+            self._clear()
+
+    def search(self, search, limit):
+        """Get ids of the `limit` best matching users, best first."""
+
+        needle = search.lower()
+        grams = trigrams(needle)
+
+        with self.lock:
+            self._refresh()
+
+            if grams:
+                candidates = set.intersection(*(self.postings.get(gram, set())
+                                                for gram in grams))
+            else:
+                # too short to have trigrams; the index can't narrow it down
+                candidates = self.documents.keys()
+
+            # rank a copy, so other threads can change the index meanwhile
+            documents = [(user_id, self.documents[user_id])
+                         for user_id in candidates]
+
+        matches = []
+
+        for user_id, fields in documents:
+            if any(needle in text.lower() for text in fields.values()):
+                matches.append((rank(search, fields), user_id))
+
+        matches.sort(key=lambda match: (-match[0], match[1]))
+
+        return [user_id for (_, user_id) in matches[:limit]]
+
+    def refresh(self):
+        """Build the index, or re-read users marked stale since last time."""
+
+        with self.lock:
+            self._refresh()
+
+    def _add(self, user_id, fields):
+        self._remove(user_id)
+        self.documents[user_id] = fields
+
+        for gram in trigrams(' '.join(fields.values())):
+            self.postings.setdefault(gram, set()).add(user_id)
+
+    def _remove(self, user_id):
+        fields = self.documents.pop(user_id, None)
+
+        if fields is None:
+            return
+
+        for gram in trigrams(' '.join(fields.values())):
+            self.postings[gram].discard(user_id)
+
+    def _clear(self):
+        self.postings = {}
+        self.documents = {}
+        self.stale_ids = set()
+        self.built = False
+
+    def _refresh(self):
+        if self.built:
+            ids, self.stale_ids = self.stale_ids, set()
+            if not ids:
+                return
+            for user_id in ids:
+                self._remove(user_id)
+            query = User.query.filter(User.id.in_(ids))
+
+        else:
+            self._clear()
+            self.built = True
+            query = User.query
+
+        # users marked deleted (an update, so stale) drop out of the index
+        rows = (query
+                .filter(User.deleted_at.is_(None))
+                .with_entities(User.id, *(getattr(User, name)
+                                          for name in SEARCH_FIELDS)))
+
+        for user_id, *values in rows:
+            self._add(user_id, {name: value or ''
+                                for name, value in zip(SEARCH_FIELDS, values)})
+
+
+user_index = NgramIndex()
+
+
+@event.listens_for(User, 'after_insert')
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def mark_user_stale(mapper, connection, user):
+    user_index.mark_stale(user.id)
+
+
+@event.listens_for(Session, 'after_bulk_delete')
+def clear_user_index(delete_context):
+    if delete_context.mapper.class_ is User:
+        user_index.clear()
+
+
+def escape_like(text):
+    """Escape LIKE wildcards in `text` (with backslash as escape char)."""
+
+    return re.sub(r'([\\%_])', r'\\\1', text)
+
+
+def search_users_postgres(search, limit):
+    """Find users with the pg_trgm indexes; returns User objects, best first."""
+
+    pattern = f"%{escape_like(search)}%"
+
+    score = func.greatest(*(
+        FIELD_WEIGHTS[name] * func.word_similarity(
+            search, func.coalesce(getattr(User, name), ''))
+        for name in SEARCH_FIELDS))
+
+    return (User
+            .query
+            .filter(or_(*(getattr(User, name).ilike(pattern, escape='\\')
+                          for name in SEARCH_FIELDS)),
+                    User.deleted_at.is_(None))
+            .order_by(score.desc(), User.id)
+            .limit(limit)
+            .all())
+
+
+def search_users_memory(search, limit):
+    """Find users with `user_index`; returns User objects, best first."""
+
+    ids = user_index.search(search, limit)
+    by_id = {user.id: user for user in User.query.filter(User.id.in_(ids))}
+
+    return [by_id[id] for id in ids if id in by_id]
+
+
+def has_trigram_support():
+    """Is the database PostgreSQL with the pg_trgm extension installed?"""
+
+    supported = current_app.extensions.get('pg_trgm')
+
+    if supported is None:
+        supported = (db.engine.dialect.name == 'postgresql' and
+                     db.session.execute(
+                         "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+                     ).scalar() is not None)
+        current_app.extensions['pg_trgm'] = supported
+
+    return supported
+
+
+def search_users(search, limit):
+    """Get up to `limit` users matching `search`, best match first."""
+
+    if has_trigram_support():
+        return search_users_postgres(search, limit)
+
+    return search_users_memory(search, limit)
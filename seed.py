@@ -1,20 +1,50 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+    python seed.py [--path generator] [--scale 1] [--batch-size 10000]
+                   [--workers 4]
+
+This drops and recreates every table, then loads the dataset at --path
+with `loader.load_dataset` (see there for the file layout) and fills in
+the denormalized counters. Run `flask rebuild-timelines` afterwards to
+build home timelines.
+"""
+
+import argparse
+import time
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follows
+from loader import load_dataset
+from models import User, Message
 
+parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+parser.add_argument('--path', default='generator',
+                    help="directory holding the dataset's CSV files")
+parser.add_argument('--scale', type=int, default=1,
+                    help="load this many copies of the dataset")
+parser.add_argument('--batch-size', type=int, default=10000)
+parser.add_argument('--workers', type=int, default=4,
+                    help="tables/indexes to load at once (PostgreSQL only)")
+args = parser.parse_args()
+
+start = time.perf_counter()
 
 db.drop_all()
 db.create_all()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
-
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+reports, index_seconds = load_dataset(args.path, args.scale, args.batch_size,
+                                      args.workers)
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follows, DictReader(follows))
+for report in reports:
+    print(report)
+print(f"{'indexes':<10} {index_seconds:>27.1f}s")
 
+counter_start = time.perf_counter()
+User.repair_counters()
+Message.repair_like_counts()
 db.session.commit()
+print(f"{'counters':<10} {time.perf_counter() - counter_start:>27.1f}s")
+
+total_rows = sum(report.rows for report in reports)
+elapsed = time.perf_counter() - start
+print(f"{'total':<10} {total_rows:>12,} rows {elapsed:>8.1f}s "
+      f"{total_rows / elapsed:>12,.0f} rows/s")
@@ -0,0 +1,41 @@
+// Follow buttons on the user lists toggle in place through the JSON API
+// (PUT/DELETE /api/v1/users/<id>/follow) instead of submitting their
+// form and reloading the page. If the API call fails, the form is
+// submitted as usual.
+
+document.addEventListener('submit', async function (event) {
+  const form = event.target;
+  const button = form.querySelector('.follow-btn');
+
+  if (!button) {
+    return;
+  }
+
+  event.preventDefault();
+
+  const following = button.classList.contains('btn-primary');
+  let resp;
+
+  try {
+    resp = await fetch(`/api/v1/users/${button.dataset.id}/follow`, {
+      method: following ? 'DELETE' : 'PUT',
+      credentials: 'same-origin',
+    });
+  } catch (err) {
+    form.submit();
+    return;
+  }
+
+  if (!resp.ok) {
+    form.submit();
+    return;
+  }
+
+  const { data } = await resp.json();
+  button.classList.toggle('btn-primary', data.following);
+  button.classList.toggle('btn-outline-primary', !data.following);
+  button.textContent = data.following ? 'Unfollow' : 'Follow';
+  form.action = data.following
+    ? `/users/stop-following/${data.user_id}`
+    : `/users/follow/${data.user_id}`;
+});
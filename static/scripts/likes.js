@@ -0,0 +1,38 @@
+// Like buttons toggle in place through the JSON API
+// (PUT/DELETE /api/v1/messages/<id>/like) instead of submitting their
+// form and reloading the page. If the API call fails, the form is
+// submitted as usual.
+
+document.addEventListener('submit', async function (event) {
+  const form = event.target;
+  const button = form.querySelector('.like-btn');
+
+  if (!button) {
+    return;
+  }
+
+  event.preventDefault();
+
+  const liked = button.classList.contains('btn-primary');
+  let resp;
+
+  try {
+    resp = await fetch(`/api/v1/messages/${button.dataset.id}/like`, {
+      method: liked ? 'DELETE' : 'PUT',
+      credentials: 'same-origin',
+    });
+  } catch (err) {
+    form.submit();
+    return;
+  }
+
+  if (!resp.ok) {
+    form.submit();
+    return;
+  }
+
+  const { data } = await resp.json();
+  button.classList.toggle('btn-primary', data.liked);
+  button.classList.toggle('btn-secondary', !data.liked);
+  button.querySelector('.like-count').textContent = data.like_count;
+});
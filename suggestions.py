@@ -0,0 +1,209 @@
+""""Who to follow" suggestions for Warbler.
+
+A user is suggested the people most followed by the people they follow
+(friends of friends), leaving out anyone they already follow. With the
+follow graph as a sparse 0/1 matrix A, where A[u, v] = 1 if u follows
+v, row u of A @ A counts, for every v, the people u follows who follow
+v. The `limit` best of each row are stored in the `suggestions` table,
+so the home page reads them with one indexed query. Matrices only have
+rows and columns for the users in the follows read (see `make_graph`),
+so their size doesn't grow with the highest user id.
+
+`rebuild` recomputes every user's suggestions from the whole `follows`
+table, a chunk of rows of A @ A at a time; run it now and then with the
+`rebuild-suggestions` command. Between rebuilds, `add_follow` and
+`remove_follow` keep things roughly up to date. The follower's own
+suggestions are recomputed from their two-hop neighbourhood. Their
+followers' scores for the newly (un)followed user are adjusted in
+place, but a user who wasn't in someone's top `limit` doesn't enter it
+until the next rebuild.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from flask import current_app
+from scipy import sparse
+from sqlalchemy import select
+
+from models import db, Follows, Suggestion, User
+
+DEFAULT_LIMIT = 10
+
+# rows of follows read, and users scored, at a time
+READ_BATCH_SIZE = 100000
+SCORE_BATCH_SIZE = 1000
+
+
+# a CSR adjacency matrix whose row and column i are the user ids[i]
+Graph = namedtuple('Graph', ['matrix', 'ids'])
+
+
+def make_graph(follower_ids, followed_ids, user_ids=()):
+    """Make the Graph of some follows.
+
+    Its `ids` are every user in the follows, plus `user_ids`, sorted.
+    """
+
+    follower_ids, followed_ids, user_ids = (
+        np.asarray(ids, dtype=np.int64)
+        for ids in (follower_ids, followed_ids, user_ids))
+    ids, positions = np.unique(
+        np.concatenate([follower_ids, followed_ids, user_ids]),
+        return_inverse=True)
+    count = len(follower_ids)
+
+    matrix = sparse.csr_matrix(
+        (np.ones(count, dtype=np.int32),
+         (positions[:count], positions[count:2 * count])),
+        shape=(len(ids), len(ids)))
+    return Graph(matrix, ids)
+
+
+def load_graph(user_ids=None):
+    """Read follows into a Graph.
+
+    With `user_ids`, only the follows needed to score those users are
+    read: theirs, and those of the people they follow.
+    """
+
+    query = select([Follows.user_following_id,
+                    Follows.user_being_followed_id])
+
+    if user_ids is not None:
+        followed = (select([Follows.user_being_followed_id])
+                    .where(Follows.user_following_id.in_(user_ids)))
+        query = query.where(Follows.user_following_id.in_(user_ids) |
+                            Follows.user_following_id.in_(followed))
+
+    result = db.session.execute(query)
+    chunks = [np.zeros((0, 2), dtype=np.int64)]
+
+    for rows in iter(lambda: result.fetchmany(READ_BATCH_SIZE), []):
+        chunks.append(np.array([tuple(row) for row in rows], dtype=np.int64))
+
+    pairs = np.concatenate(chunks)
+    return make_graph(pairs[:, 0], pairs[:, 1],
+                      () if user_ids is None else user_ids)
+
+
+def top_suggestions(graph, user_ids, limit):
+    """Yield (user_id, suggested_id, score) for the best `limit` per user.
+
+    Ties go to the lower id, so the result doesn't depend on the order
+    the follows were read in.
+    """
+
+    matrix, graph_ids = graph
+    user_ids = np.asarray(user_ids, dtype=np.int64)
+    positions = np.searchsorted(graph_ids, user_ids)
+    rows = matrix[positions]
+    counts = sparse.csr_matrix(rows @ matrix)
+
+    # nobody is suggested themselves, or someone they already follow
+    known = rows + sparse.csr_matrix(
+        (np.ones(len(user_ids), dtype=np.int32),
+         (np.arange(len(user_ids)), positions)),
+        shape=counts.shape)
+    counts = sparse.csr_matrix(counts - counts.multiply(known > 0))
+    counts.eliminate_zeros()
+
+    for i, user_id in enumerate(user_ids):
+        start, end = counts.indptr[i], counts.indptr[i + 1]
+        ids = graph_ids[counts.indices[start:end]]
+        scores = counts.data[start:end]
+
+        for j in np.lexsort((ids, -scores))[:limit]:
+            yield int(user_id), int(ids[j]), int(scores[j])
+
+
+def save(suggestions):
+    rows = [dict(user_id=user_id, suggested_id=suggested_id, score=score)
+            for user_id, suggested_id, score in suggestions]
+
+    if rows:
+        db.session.execute(Suggestion.__table__.insert(), rows)
+
+
+def get_limit():
+    return current_app.config.get('SUGGESTIONS_PER_USER', DEFAULT_LIMIT)
+
+
+def rebuild():
+    """Recompute every user's suggestions from the `follows` table."""
+
+    graph = load_graph()
+    limit = get_limit()
+
+    Suggestion.query.delete(synchronize_session=False)
+
+    # only users who follow someone can have friends of friends
+    user_ids = graph.ids[np.flatnonzero(np.diff(graph.matrix.indptr))]
+
+    for start in range(0, len(user_ids), SCORE_BATCH_SIZE):
+        save(top_suggestions(graph, user_ids[start:start + SCORE_BATCH_SIZE],
+                             limit))
+
+
+def refresh(user_ids):
+    """Recompute the suggestions of just `user_ids`.
+
+    This reads and multiplies only their two-hop neighbourhood, so it's
+    cheap enough to run inline when someone follows or unfollows.
+    """
+
+    db.session.flush()
+
+    graph = load_graph(user_ids)
+
+    (Suggestion
+     .query
+     .filter(Suggestion.user_id.in_(user_ids))
+     .delete(synchronize_session=False))
+    save(top_suggestions(graph, user_ids, get_limit()))
+
+
+def add_follow(user_id, followed_id):
+    """Update suggestions after `user_id` follows `followed_id`."""
+
+    refresh([user_id])
+    _adjust_followers(user_id, followed_id, 1)
+
+
+def remove_follow(user_id, followed_id):
+    """Update suggestions after `user_id` stops following `followed_id`."""
+
+    refresh([user_id])
+    _adjust_followers(user_id, followed_id, -1)
+
+    (Suggestion
+     .query
+     .filter(Suggestion.score <= 0)
+     .filter(Suggestion.suggested_id == followed_id)
+     .delete(synchronize_session=False))
+
+
+def _adjust_followers(user_id, followed_id, delta):
+    """Change the score `user_id`'s followers give `followed_id`."""
+
+    follower_ids = (select([Follows.user_following_id])
+                    .where(Follows.user_being_followed_id == user_id))
+
+    (Suggestion
+     .query
+     .filter(Suggestion.user_id.in_(follower_ids),
+             Suggestion.suggested_id == followed_id)
+     .update({Suggestion.score: Suggestion.score + delta},
+             synchronize_session=False))
+
+
+def suggestions_for(user_id):
+    """Get `user_id`'s suggested users, best first, in one query."""
+
+    return (User
+            .query
+            .join(Suggestion, Suggestion.suggested_id == User.id)
+            .filter(Suggestion.user_id == user_id)
+            .order_by(Suggestion.score.desc(), Suggestion.suggested_id)
+            .limit(get_limit())
+            .all())
@@ -0,0 +1,166 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_api.py
+
+
+import os
+from datetime import datetime
+from unittest import TestCase
+from models import db, Message, User, Likes, user_cache
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+class APITestCase(TestCase):
+    """Test the /api/v1 endpoints."""
+
+    def setUp(self):
+        """Create test client, add sample data."""
+
+        User.query.delete()
+        Message.query.delete()
+        user_cache.clear()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser", email="test@test.com", password="testuser", image_url=None)
+        self.testuser2 = User.signup(username="testuser2", email="test@test2.com", password="testuser2", image_url=None)
+        self.testuser.id = 1
+        self.testuser2.id = 2
+        db.session.commit()
+
+        self.testuser.following.append(self.testuser2)
+        for i in range(3):
+            db.session.add(Message(id=10 + i, text=f"message {i}", user_id=2,
+                                   timestamp=datetime(2021, 1, 1, 12, i)))
+        db.session.commit()
+        db.session.add(Likes(user_id=1, message_id=10))
+        db.session.commit()
+        User.repair_counters()
+        Message.repair_like_counts()
+        db.session.commit()
+
+        app.config['MESSAGES_PER_PAGE'] = 2
+        self.addCleanup(app.config.__setitem__, 'MESSAGES_PER_PAGE', 20)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = 1
+
+    def test_timeline(self):
+        '''is the home timeline paged with a cursor?'''
+        with self.client as c:
+            self.assertEqual(c.get('/api/v1/timeline').status_code, 401)
+            self.login(c)
+
+            page = c.get('/api/v1/timeline').get_json()
+            self.assertEqual([row['id'] for row in page['data']], [12, 11])
+            self.assertEqual(page['data'][0]['username'], 'testuser2')
+            self.assertEqual(page['data'][0]['timestamp'], '2021-01-01T12:02:00')
+
+            page = c.get(f"/api/v1/timeline?before={page['next']}").get_json()
+            self.assertEqual([row['id'] for row in page['data']], [10])
+            self.assertIsNone(page['next'])
+
+            self.assertEqual(c.get('/api/v1/timeline?before=junk').status_code, 400)
+
+    def test_fields(self):
+        '''are only the requested fields returned, and unknown ones refused?'''
+        resp = self.client.get('/api/v1/users/2/messages?fields=id,text')
+        self.assertEqual(resp.get_json()['data'][0], {'id': 12, 'text': 'message 2'})
+
+        resp = self.client.get('/api/v1/users/2?fields=username,messages_count')
+        self.assertEqual(resp.get_json()['data'], {'username': 'testuser2', 'messages_count': 3})
+
+        resp = self.client.get('/api/v1/users/2?fields=password')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('password', resp.get_json()['error'])
+
+    def test_missing_user(self):
+        '''does an unknown user get a JSON 404?'''
+        resp = self.client.get('/api/v1/users/99')
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.get_json(), {'error': 'No such user.'})
+        self.assertEqual(self.client.get('/api/v1/users/99/messages').status_code, 404)
+
+    def test_follows(self):
+        '''are following and followers listed, paged by id?'''
+        with self.client as c:
+            self.login(c)
+
+            page = c.get('/api/v1/users/1/following?fields=username').get_json()
+            self.assertEqual(page, {'data': [{'username': 'testuser2'}], 'next': None})
+
+            page = c.get('/api/v1/users/2/followers').get_json()
+            self.assertEqual([row['id'] for row in page['data']], [1])
+
+            page = c.get('/api/v1/users/2/followers?after=1').get_json()
+            self.assertEqual(page['data'], [])
+
+    def test_likes(self):
+        '''are a user's liked messages listed?'''
+        with self.client as c:
+            self.login(c)
+
+            page = c.get('/api/v1/users/1/likes?fields=id,like_count').get_json()
+            self.assertEqual(len(page['data']), 1)
+            self.assertEqual(page['data'][0]['id'], 10)
+            self.assertEqual(page['data'][0]['like_count'], 1)
+            self.assertIn('liked_at', page['data'][0])
+            self.assertIsNone(page['next'])
+
+    def test_like_and_unlike(self):
+        '''do PUT and DELETE set a like once, however often they're sent?'''
+        with self.client as c:
+            self.assertEqual(c.put('/api/v1/messages/11/like').status_code, 401)
+            self.login(c)
+
+            for _ in range(2):
+                resp = c.put('/api/v1/messages/11/like')
+                self.assertEqual(resp.get_json()['data'],
+                                 {'message_id': 11, 'liked': True, 'like_count': 1})
+
+            for _ in range(2):
+                resp = c.delete('/api/v1/messages/10/like')
+                self.assertEqual(resp.get_json()['data'],
+                                 {'message_id': 10, 'liked': False, 'like_count': 0})
+
+            self.assertEqual(c.put('/api/v1/messages/99/like').status_code, 404)
+            self.assertEqual(c.delete('/api/v1/messages/99/like').status_code, 404)
+
+        self.assertEqual(User.query.get(1).likes_count, 1)
+        self.assertEqual(Likes.query.filter_by(user_id=1).one().message_id, 11)
+
+    def test_follow_and_unfollow(self):
+        '''do PUT and DELETE set a follow once, however often they're sent?'''
+        with self.client as c:
+            self.assertEqual(c.delete('/api/v1/users/2/follow').status_code, 401)
+            self.login(c)
+
+            for _ in range(2):
+                resp = c.delete('/api/v1/users/2/follow')
+                self.assertEqual(resp.get_json()['data'],
+                                 {'user_id': 2, 'following': False, 'followers_count': 0})
+
+            for _ in range(2):
+                resp = c.put('/api/v1/users/2/follow')
+                self.assertEqual(resp.get_json()['data'],
+                                 {'user_id': 2, 'following': True, 'followers_count': 1})
+
+            self.assertEqual(c.put('/api/v1/users/99/follow').status_code, 404)
+            self.assertEqual(c.put('/api/v1/users/1/follow').status_code, 400)
+
+        self.assertEqual(User.query.get(1).following_count, 1)
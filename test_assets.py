@@ -0,0 +1,94 @@
+"""Static asset build and serving tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_assets.py
+
+
+import gzip
+import json
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+import brotli
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app
+import assets
+
+app.config['TESTING'] = True
+
+
+class AssetsTestCase(TestCase):
+    """Test fingerprinting, compressing and serving assets."""
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+        self.static = os.path.join(self.dir.name, 'static')
+        self.dist = os.path.join(self.dir.name, 'dist')
+
+        self.write('images/logo.png', b'\x89PNG not really')
+        self.write('stylesheets/style.css', b'nav { background: url("/static/images/logo.png"); }\n' * 20)
+
+        self.manifest = assets.build(self.static, self.dist)
+
+        old_dir = app.config['ASSETS_DIR']
+        app.config['ASSETS_DIR'] = self.dist
+        app.extensions.pop('assets', None)
+        self.addCleanup(app.config.__setitem__, 'ASSETS_DIR', old_dir)
+        self.addCleanup(app.extensions.pop, 'assets', None)
+
+        self.client = app.test_client()
+
+    def write(self, path, content):
+        path = os.path.join(self.static, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(content)
+
+    def read(self, path):
+        with open(os.path.join(self.dist, path), 'rb') as f:
+            return f.read()
+
+    def test_build(self):
+        '''are assets renamed by content, compressed and listed in the manifest?'''
+        self.assertRegex(self.manifest['images/logo.png'], r'^images/logo\.[0-9a-f]{10}\.png$')
+        with open(os.path.join(self.dist, 'manifest.json')) as f:
+            self.assertEqual(json.load(f), self.manifest)
+
+        css = self.manifest['stylesheets/style.css']
+        self.assertIn(f'url("/assets/{self.manifest["images/logo.png"]}")'.encode(), self.read(css))
+        self.assertEqual(gzip.decompress(self.read(css + '.gz')), self.read(css))
+        self.assertEqual(brotli.decompress(self.read(css + '.br')), self.read(css))
+
+        # images are already compressed
+        self.assertFalse(os.path.exists(os.path.join(self.dist, self.manifest['images/logo.png'] + '.gz')))
+
+    def test_asset_url(self):
+        '''do templates link to built assets, or to static/ without a build?'''
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url('stylesheets/style.css'),
+                             f"/assets/{self.manifest['stylesheets/style.css']}")
+            self.assertEqual(assets.asset_url('scripts/other.js'), '/static/scripts/other.js')
+
+    def test_serve(self):
+        '''are assets served immutable, in the best encoding the client accepts?'''
+        url = f"/assets/{self.manifest['stylesheets/style.css']}"
+
+        for accept, encoding, suffix in [('gzip, deflate, br', 'br', '.br'),
+                                         ('gzip', 'gzip', '.gz'),
+                                         ('', None, '')]:
+            resp = self.client.get(url, headers={'Accept-Encoding': accept})
+            self.assertEqual(resp.status_code, 200)
+            self.assertEqual(resp.headers.get('Content-Encoding'), encoding)
+            self.assertEqual(resp.mimetype, 'text/css')
+            self.assertEqual(resp.get_data(), self.read(self.manifest['stylesheets/style.css'] + suffix))
+            self.assertIn('Accept-Encoding', resp.headers['Vary'])
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            resp.close()
+
+        self.assertEqual(self.client.get('/assets/nothing.css').status_code, 404)
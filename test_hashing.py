@@ -0,0 +1,96 @@
+"""Password hasher tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_hashing.py
+
+
+import os
+from concurrent.futures.process import BrokenProcessPool
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from hashing import PasswordHasher, HasherBusy, get_rounds
+
+
+def die_once(path):
+    """Kill the worker the first time it's called for `path`."""
+
+    if not os.path.exists(path):
+        open(path, 'w').close()
+        os._exit(1)
+
+    return path
+
+
+class PasswordHasherTestCase(TestCase):
+    """Tests for the bounded password hasher."""
+
+    def setUp(self):
+        self.hasher = PasswordHasher()
+        self.hasher.configure({
+            'BCRYPT_EXECUTOR': 'thread',
+            'BCRYPT_MAX_WORKERS': 1,
+            'BCRYPT_MAX_PENDING': 0,
+            'BCRYPT_QUEUE_TIMEOUT': 0,
+            'BCRYPT_LOG_ROUNDS': 4,
+        })
+
+    def tearDown(self):
+        self.hasher.shutdown()
+
+    def test_hash_and_check(self):
+        '''does a hash check out against the right password only?'''
+        hashed = self.hasher.hash('password')
+
+        self.assertEqual(get_rounds(hashed), 4)
+        self.assertTrue(self.hasher.check(hashed, 'password'))
+        self.assertFalse(self.hasher.check(hashed, 'wrong'))
+        self.assertRaises(ValueError, self.hasher.hash, '')
+
+    def test_needs_rehash(self):
+        '''are hashes made at a lower cost, and only those, flagged for rehashing?'''
+        hashed = self.hasher.hash('password')
+        self.assertFalse(self.hasher.needs_rehash(hashed))
+
+        self.hasher.rounds = 5
+        self.assertTrue(self.hasher.needs_rehash(hashed))
+
+        stronger = self.hasher.hash('password')
+        self.hasher.rounds = 4
+        self.assertFalse(self.hasher.needs_rehash(stronger))
+
+    def test_busy(self):
+        '''is work rejected, rather than queued, when every slot is taken?'''
+        self.hasher.slots.acquire()
+        try:
+            self.assertRaises(HasherBusy, self.hasher.hash, 'password')
+        finally:
+            self.hasher.slots.release()
+
+    def test_calibrate(self):
+        '''is the cost picked from the target time?'''
+        self.hasher.configure({'BCRYPT_EXECUTOR': 'inline',
+                               'BCRYPT_TARGET_MS': 1,
+                               'BCRYPT_MIN_ROUNDS': 4})
+        self.assertEqual(self.hasher.rounds, 4)
+
+    def test_min_rounds(self):
+        '''does calibration never pick a cost below the minimum?'''
+        self.hasher.configure({'BCRYPT_EXECUTOR': 'inline',
+                               'BCRYPT_TARGET_MS': 1})
+        self.assertEqual(self.hasher.rounds, 12)
+
+    def test_broken_pool(self):
+        '''is a pool broken by a dead worker replaced, and the work retried once?'''
+        self.hasher.configure({'BCRYPT_EXECUTOR': 'process',
+                               'BCRYPT_MAX_WORKERS': 1,
+                               'BCRYPT_LOG_ROUNDS': 4})
+
+        with TemporaryDirectory() as dir:
+            path = os.path.join(dir, 'died')
+            self.assertEqual(self.hasher.run(die_once, path), path)
+
+        # dying twice gives up, but doesn't break later work
+        self.assertRaises(BrokenProcessPool, self.hasher.run, os._exit, 1)
+        self.assertTrue(self.hasher.check(self.hasher.hash('password'), 'password'))
@@ -0,0 +1,132 @@
+"""Image upload and thumbnail tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_images.py
+
+
+import os
+from io import BytesIO
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from PIL import Image
+
+from models import db, User, Message, user_cache
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import images
+from images import BadImage, thumbnailer
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+def make_image(size, format='PNG', mode='RGBA'):
+    data = BytesIO()
+    Image.new(mode, size, (255, 0, 0, 0) if mode == 'RGBA' else 'red').save(data, format)
+    return data.getvalue()
+
+
+class ImagesTestCase(TestCase):
+    """Test ingesting uploads and showing their thumbnails."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+        db.session.commit()
+        user_cache.clear()
+
+        self.dir = TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+        old_dir = app.config['UPLOADS_DIR']
+        app.config['UPLOADS_DIR'] = self.dir.name
+        self.addCleanup(app.config.__setitem__, 'UPLOADS_DIR', old_dir)
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser", email="test@test.com", password="testuser", image_url=None)
+        self.testuser.id = 1
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_make_thumbnails(self):
+        '''is every size written as WebP and JPEG, cropped to fit?'''
+        images.make_thumbnails(make_image((1000, 500)), 'avatar', 'abc', self.dir.name)
+
+        for size, dimensions in images.SIZES['avatar'].items():
+            for ext, format in [('webp', 'WEBP'), ('jpg', 'JPEG')]:
+                with Image.open(os.path.join(self.dir.name, f'abc-avatar-{size}.{ext}')) as thumb:
+                    self.assertEqual((thumb.format, thumb.size), (format, dimensions))
+
+        # transparent pixels become white, not black
+        with Image.open(os.path.join(self.dir.name, 'abc-avatar-small.jpg')) as thumb:
+            self.assertGreater(min(thumb.getpixel((0, 0))), 240)
+
+    def test_check(self):
+        '''are non-images and huge images turned away before decoding?'''
+        images.check(make_image((10, 10)), 1000)
+
+        with self.assertRaises(BadImage):
+            images.check(b'not an image', 1000)
+        with self.assertRaises(BadImage):
+            images.check(make_image((100, 100)), 1000)
+
+    def test_thumbnail(self):
+        '''do uploaded image URLs map to their thumbnails, and others to nothing?'''
+        self.assertEqual(images.thumbnail('/uploads/ab12-header-large.jpg', 'small'),
+                         ('/uploads/ab12-header-small.webp', '/uploads/ab12-header-small.jpg'))
+        self.assertIsNone(images.thumbnail('https://example.com/me.jpg', 'small'))
+        self.assertIsNone(images.thumbnail(None, 'small'))
+
+    def test_bad_upload_logged(self):
+        '''is an upload that fails in the background logged?'''
+        image = make_image((300, 300), 'JPEG', 'RGB')
+        truncated = image[:len(image) // 2]
+
+        with self.assertLogs('warbler.images', 'ERROR') as logs:
+            future = thumbnailer.ingest(1, 'image_url', truncated)
+            self.assertRaises(OSError, future.result)
+
+        self.assertIn("Updating user 1's image_url failed", logs.output[0])
+        self.assertIsNone(images.thumbnail(User.query.get(1).image_url, 'small'))
+
+    def test_upload(self):
+        '''does an uploaded picture become the user's image, shown as a small thumbnail?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.post('/users/profile', content_type='multipart/form-data', data={
+                'username': 'testuser', 'email': 'test@test.com', 'password': 'testuser',
+                'image_file': (BytesIO(make_image((300, 300), 'JPEG', 'RGB')), 'me.jpg'),
+            })
+            self.assertEqual(resp.status_code, 302)
+            thumbnailer.wait()
+
+            # the worker committed on its own session; don't read ours
+            db.session.expire_all()
+            image_url = User.query.get(1).image_url
+            self.assertRegex(image_url, r'^/uploads/[0-9a-f]+-avatar-large\.jpg$')
+
+            small = images.thumbnail(image_url, 'small')
+            html = c.get('/').get_data(as_text=True)
+            self.assertIn(f'<source srcset="{small.webp}" type="image/webp">', html)
+            self.assertIn(f'<img src="{small.fallback}"', html)
+
+            # the navbar shows the small one too, on every page
+            html = c.get('/users/1/likes').get_data(as_text=True)
+            self.assertIn(f'<source srcset="{small.webp}" type="image/webp">', html)
+
+            resp = c.get(small.webp)
+            self.assertEqual(resp.mimetype, 'image/webp')
+            self.assertIn('immutable', resp.headers['Cache-Control'])
+            resp.close()
@@ -0,0 +1,56 @@
+"""Dataset loader tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_loader.py
+
+
+import os
+from tempfile import TemporaryDirectory
+from unittest import TestCase
+
+from loader import batches, count_users, dataset_files, read_rows
+
+
+class LoaderTestCase(TestCase):
+    """Tests for reading datasets in batches."""
+
+    def setUp(self):
+        self.dir = TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+
+        self.write('users.csv', 'email,username\na@a.com,a\nb@b.com,b\n')
+        self.write('follows-00.csv', 'user_being_followed_id,user_following_id\n1,2\n')
+        self.write('follows-01.csv', 'user_being_followed_id,user_following_id\n2,1\n')
+
+    def write(self, name, text):
+        with open(os.path.join(self.dir.name, name), 'w') as f:
+            f.write(text)
+
+    def test_dataset_files(self):
+        '''are a table's shards found in order?'''
+        self.assertEqual([os.path.basename(name) for name in dataset_files(self.dir.name, 'follows')],
+                         ['follows-00.csv', 'follows-01.csv'])
+
+    def test_users_numbered(self):
+        '''are users without ids numbered in file order?'''
+        files = dataset_files(self.dir.name, 'users')
+        columns, rows = read_rows('users', files, 1, count_users(files))
+
+        self.assertEqual(columns, ['id', 'email', 'username'])
+        self.assertEqual(list(rows), [[1, 'a@a.com', 'a'], [2, 'b@b.com', 'b']])
+
+    def test_scale(self):
+        '''do scaled copies get their own users and unique names?'''
+        users = dataset_files(self.dir.name, 'users')
+        _, rows = read_rows('users', users, 2, count_users(users))
+        self.assertEqual([row[2] for row in rows], ['a', 'b', '1.a', '1.b'])
+
+        follows = dataset_files(self.dir.name, 'follows')
+        _, rows = read_rows('follows', follows, 2, count_users(users))
+        self.assertEqual([[int(id) for id in row] for row in rows],
+                         [[1, 2], [2, 1], [3, 4], [4, 3]])
+
+    def test_batches(self):
+        '''are rows split into batches of at most the batch size?'''
+        self.assertEqual(list(batches(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
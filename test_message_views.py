@@ -155,4 +155,19 @@ class MessageViewTestCase(TestCase):
         self.assertEqual(resp.status_code, 200)
         self.assertIn('<p class="single-message">Hello</p>', html)
 
-        
+    def test_show_message_conditional_get(self):
+        '''does the message page revalidate by ETag, and not by its timestamp alone?'''
+        msg = Message(id=3, text="Cache me", user_id=self.testuser.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        resp = self.client.get('/messages/3')
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotIn('Last-Modified', resp.headers)
+
+        resp = self.client.get('/messages/3', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+
+        # the author may have changed since the message was posted
+        resp = self.client.get('/messages/3', headers={'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+        self.assertEqual(resp.status_code, 200)
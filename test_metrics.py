@@ -0,0 +1,70 @@
+"""Metrics tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_metrics.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+class MetricsTestCase(TestCase):
+    """Test request metrics and the /metrics endpoint."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser", email="test@test.com", password="testuser", image_url=None)
+        self.testuser.id = 1
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_request_metrics(self):
+        '''are requests and their SQL counted per endpoint?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            c.get('/users/1')
+
+        resp = self.client.get('/metrics')
+        text = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('warbler_request_duration_seconds_count{endpoint="users_show",method="GET",status="200"}', text)
+        self.assertIn('warbler_request_sql_statements_count{endpoint="users_show"}', text)
+        self.assertIn('warbler_request_sql_seconds_sum{endpoint="users_show"}', text)
+        self.assertIn('warbler_user_cache_lookups_total{result="miss"}', text)
+
+    def test_slow_query_log(self):
+        '''are slow statements logged with the endpoint that ran them?'''
+        app.config['METRICS_SLOW_QUERY_MS'] = 0
+        self.addCleanup(app.config.__setitem__, 'METRICS_SLOW_QUERY_MS', 100)
+
+        with self.assertLogs('warbler.slow_queries', 'WARNING') as logs:
+            self.client.get('/users')
+
+        self.assertIn('in list_users: SELECT', logs.output[0])
+
+    def test_bcrypt_metrics(self):
+        '''is time spent hashing passwords recorded?'''
+        self.client.post('/login', data={'username': 'testuser', 'password': 'testuser'})
+
+        text = self.client.get('/metrics').get_data(as_text=True)
+        self.assertIn('warbler_bcrypt_seconds_count{operation="check_password"}', text)
@@ -0,0 +1,165 @@
+"""User deletion tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_purge.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Message, Follows, Likes
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+from following import set_following
+import purge
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+class PurgeTestCase(TestCase):
+    """Test deleting users and fixing up what they touched."""
+
+    def setUp(self):
+        """user1 follows user2, is followed by user3, and has two messages
+        that user2 and user3 like; user1 likes user2's message."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        for id in range(1, 4):
+            user = User.signup(f"user{id}", f"user{id}@test.com", "password", None)
+            user.id = id
+        db.session.commit()
+
+        db.session.add_all([
+            Follows(user_following_id=1, user_being_followed_id=2),
+            Follows(user_following_id=3, user_being_followed_id=1),
+            Message(id=1, text="first", user_id=1),
+            Message(id=2, text="second", user_id=1),
+            Message(id=3, text="other", user_id=2),
+        ])
+        db.session.commit()
+
+        db.session.add_all([
+            Likes(user_id=2, message_id=1),
+            Likes(user_id=2, message_id=2),
+            Likes(user_id=3, message_id=1),
+            Likes(user_id=1, message_id=3),
+        ])
+        db.session.commit()
+
+        User.repair_counters()
+        Message.repair_like_counts()
+        db.session.commit()
+
+        self.addCleanup(app.config.update, PURGE_BATCH_SIZE=app.config['PURGE_BATCH_SIZE'],
+                        PURGE_INLINE_MAX_ROWS=app.config['PURGE_INLINE_MAX_ROWS'])
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def delete_user1(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            resp = c.post("/users/delete")
+            self.assertEqual(resp.status_code, 302)
+
+        # the purge thread runs one purge at a time, so this waits for it
+        purge.executor.submit(lambda: None).result()
+
+    def assert_deleted(self):
+        db.session.expire_all()
+
+        self.assertIsNone(User.query.get(1))
+        self.assertEqual(Message.query.filter_by(user_id=1).count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+
+        u2 = User.query.get(2)
+        u3 = User.query.get(3)
+        self.assertEqual((u2.followers_count, u2.following_count, u2.likes_count), (0, 0, 0))
+        self.assertEqual((u3.following_count, u3.likes_count), (0, 0))
+        self.assertEqual(Message.query.get(3).like_count, 0)
+
+    def test_delete_small_account(self):
+        '''is a small account deleted during the request, fixing counters?'''
+        self.delete_user1()
+        self.assert_deleted()
+
+    def test_delete_big_account(self):
+        '''is a big account purged in the background, in batches?'''
+        app.config.update(PURGE_BATCH_SIZE=1, PURGE_INLINE_MAX_ROWS=0)
+
+        self.delete_user1()
+        self.assert_deleted()
+
+    def test_resume_interrupted_purge(self):
+        '''is a user marked deleted locked out, and their purge finished later?'''
+        purge.mark_deleted(User.query.get(1))
+        db.session.commit()
+
+        resp = self.client.post('/login', data={'username': 'user1', 'password': 'password'})
+        self.assertIn('Invalid credentials.', resp.get_data(as_text=True))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            html = c.get('/').get_data(as_text=True)
+            self.assertNotIn('@user1', html)
+
+        with app.app_context():
+            self.assertEqual(purge.resume_purges(1), [1])
+        self.assert_deleted()
+        self.assertEqual(purge.pending_user_ids(), [])
+
+    def test_marked_user_hidden(self):
+        '''is a user marked deleted hidden, and impossible to follow?'''
+        purge.mark_deleted(User.query.get(1))
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 2
+
+            self.assertEqual(c.get('/users/1').status_code, 404)
+            self.assertEqual(c.post('/users/follow/1').status_code, 404)
+            self.assertEqual(c.put('/api/v1/users/1/follow').status_code, 404)
+            self.assertEqual(c.get('/api/v1/users/1').status_code, 404)
+            self.assertNotIn('@user1', c.get('/users').get_data(as_text=True))
+            self.assertIn('Sorry, no users found', c.get('/users?q=user1').get_data(as_text=True))
+
+        self.assertEqual(Follows.query.filter_by(user_following_id=2).count(), 0)
+
+    def test_late_follow_swept_up(self):
+        '''does a follow made during a purge still get its counters fixed?'''
+        def follow_late(user_id, batch_size):
+            set_following(2, user_id, True)
+            return False
+
+        self.addCleanup(setattr, purge, 'STEPS', purge.STEPS)
+        purge.STEPS = purge.STEPS + (follow_late,)
+
+        with app.app_context():
+            purge.purge_user(1, 1)
+        self.assert_deleted()
+
+    def test_cascades_without_loading(self):
+        '''does deleting a user leave their rows to the database's cascades?'''
+        user = User.query.get(1)
+        db.session.delete(user)
+        db.session.commit()
+
+        self.assertEqual(Message.query.filter_by(user_id=1).count(), 0)
+        self.assertEqual(Follows.query.count(), 0)
+        self.assertEqual(Likes.query.count(), 0)
+        self.assertNotIn('messages', user.__dict__)
@@ -0,0 +1,166 @@
+"""Query count tests.
+
+These make sure pages run a fixed number of SQL statements however many
+messages they show, i.e. that nothing is lazy-loaded once per row.
+"""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_query_counts.py
+
+
+import os
+from unittest import TestCase
+from sqlalchemy import event
+from models import db, Message, User, Follows, Likes, user_cache
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from timelines import get_timelines
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+class QueryCounter:
+    """Count the SQL statements run on the app's engine while active.
+
+        with QueryCounter() as queries:
+            client.get('/')
+        queries.count
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self.count_query)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(db.engine, 'before_cursor_execute', self.count_query)
+
+    def count_query(self, *args):
+        self.count += 1
+
+
+class QueryCountTestCase(TestCase):
+    """Statement counts for pages that list messages."""
+
+    def setUp(self):
+        """Create a test client and a logged-in user."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        user = User.signup("testuser", "test@test.com", "password", None)
+        user.id = 1
+        db.session.commit()
+
+        self.next_id = 2
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def add_authors(self, count, build_timeline=True):
+        """Add `count` users followed and liked by user 1, with a message each."""
+
+        for _ in range(count):
+            id = self.next_id
+            self.next_id += 1
+
+            user = User.signup(f"user{id}", f"user{id}@test.com", "password", None)
+            user.id = id
+            db.session.add(Message(id=id, text=f"message {id}", user_id=id))
+            db.session.commit()
+
+            db.session.add(Follows(user_being_followed_id=id, user_following_id=1))
+            db.session.add(Likes(user_id=1, message_id=id))
+            db.session.commit()
+
+        if build_timeline:
+            with app.app_context():
+                get_timelines().rebuild(1)
+                db.session.commit()
+
+    def count_queries(self, url, per_page=20):
+        """Count the statements run to GET `url` as user 1."""
+
+        app.config['MESSAGES_PER_PAGE'] = per_page
+        self.addCleanup(app.config.__setitem__, 'MESSAGES_PER_PAGE', 20)
+
+        # look the user up from the database every time, for comparable counts
+        user_cache.clear()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            with QueryCounter() as queries:
+                resp = c.get(url)
+
+            self.assertEqual(resp.status_code, 200)
+            return queries.count
+
+    def add_own_messages(self, count):
+        """Add `count` messages by user 1."""
+
+        for _ in range(count):
+            db.session.add(Message(id=self.next_id, text=f"message {self.next_id}", user_id=1))
+            self.next_id += 1
+        db.session.commit()
+
+    def assertConstantQueries(self, url, add_rows=None):
+        """Fail if GETting `url` runs more statements as rows are added.
+
+        Rows are added with `add_rows(count)`, by default `add_authors`.
+        """
+
+        add_rows = add_rows or self.add_authors
+
+        add_rows(2)
+        few = self.count_queries(url)
+
+        add_rows(8)
+        many = self.count_queries(url)
+
+        self.assertEqual(few, many,
+                         f"{url} ran {few} statements for 2 rows "
+                         f"but {many} for 10")
+
+    def test_homepage(self):
+        '''does the home timeline run a constant number of queries?'''
+        self.add_authors(10)
+        self.assertEqual(self.count_queries('/', per_page=2),
+                         self.count_queries('/', per_page=8))
+
+    def test_homepage_fallback(self):
+        '''does the home timeline run a constant number of queries without a built timeline?'''
+        self.add_authors(10, build_timeline=False)
+        self.assertEqual(self.count_queries('/', per_page=2),
+                         self.count_queries('/', per_page=8))
+
+    def test_likes(self):
+        '''does the likes page run a constant number of queries?'''
+        self.assertConstantQueries('/users/1/likes')
+
+    def test_profile(self):
+        '''does the profile page run a constant number of queries?'''
+        self.assertConstantQueries('/users/1', self.add_own_messages)
+
+        html = self.client.get('/users/1').get_data(as_text=True)
+        self.assertEqual(html.count('class="message-link"'), 10)
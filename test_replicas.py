@@ -0,0 +1,97 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_replicas.py
+#
+# with a second database for the replica:
+#
+#    createdb warbler-test-replica
+
+
+import os
+from unittest import TestCase
+from sqlalchemy import create_engine
+from models import db, User, Message
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL', "postgresql:///warbler-test-replica")
+
+from app import app, CURR_USER_KEY
+from replicas import PRIMARY_UNTIL_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+replica = create_engine(REPLICA_URL)
+db.metadata.create_all(bind=replica)
+
+
+class ReplicaTestCase(TestCase):
+    """Test that read-only pages read from the replica, unless the client just wrote."""
+
+    def setUp(self):
+        User.query.delete()
+        Message.query.delete()
+
+        self.client = app.test_client()
+
+        self.testuser = User.signup(username="testuser", email="test@test.com", password="testuser", image_url=None)
+        self.testuser.id = 1
+        db.session.commit()
+
+        # the replica has caught up with the user, plus someone else
+        # the primary doesn't have, so we can tell which one was read
+        with replica.begin() as conn:
+            conn.execute(Message.__table__.delete())
+            conn.execute(User.__table__.delete())
+            row = {column.name: getattr(self.testuser, column.key)
+                   for column in User.__table__.columns}
+            conn.execute(User.__table__.insert(), row)
+            conn.execute(User.__table__.insert(), dict(row, id=2, username='replicauser',
+                                                        email='replica@test.com'))
+
+        app.extensions['replicas'] = [replica]
+        self.addCleanup(app.extensions.__setitem__, 'replicas', [])
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_reads_from_replica(self):
+        '''do read-only pages read from the replica, and others from the primary?'''
+        html = self.client.get('/users').get_data(as_text=True)
+        self.assertIn('@replicauser', html)
+
+        resp = self.client.post('/signup', data={'username': 'replicauser', 'email': 'new@test.com',
+                                                 'password': 'password'})
+        self.assertEqual(resp.status_code, 302)
+
+    def test_replica_metrics(self):
+        '''are statements run on a replica counted and logged like any other?'''
+        app.config['METRICS_SLOW_QUERY_MS'] = 0
+        self.addCleanup(app.config.__setitem__, 'METRICS_SLOW_QUERY_MS', 100)
+
+        with self.assertLogs('warbler.slow_queries', 'WARNING') as logs:
+            html = self.client.get('/users').get_data(as_text=True)
+
+        self.assertIn('@replicauser', html)
+        self.assertIn('in list_users: SELECT', logs.output[0])
+
+    def test_reads_own_writes(self):
+        '''after writing, does a client read from the primary for a while?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post('/messages/new', data={'text': 'fresh message'})
+            html = c.get('/users/1').get_data(as_text=True)
+            self.assertIn('fresh message', html)
+
+            with c.session_transaction() as sess:
+                sess[PRIMARY_UNTIL_KEY] = 0
+
+            html = c.get('/users/1').get_data(as_text=True)
+            self.assertNotIn('fresh message', html)
@@ -0,0 +1,113 @@
+"""Who to follow suggestion tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_suggestions.py
+
+
+import os
+from unittest import TestCase
+from models import db, User, Follows, Suggestion
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+from app import app, CURR_USER_KEY
+import suggestions
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+class SuggestionsTestCase(TestCase):
+    """Test friend-of-friend suggestions and their upkeep."""
+
+    def setUp(self):
+        """Five users: 1 follows 2 and 3, who both follow 4; 2 follows 5."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.client = app.test_client()
+
+        for id in range(1, 6):
+            user = User.signup(f"user{id}", f"user{id}@test.com", "password", None)
+            user.id = id
+        db.session.commit()
+
+        for follower, followed in [(1, 2), (1, 3), (2, 4), (3, 4), (2, 5)]:
+            db.session.add(Follows(user_following_id=follower, user_being_followed_id=followed))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def suggested(self, user_id):
+        return [(s.suggested_id, s.score) for s in
+                Suggestion.query.filter_by(user_id=user_id).order_by(Suggestion.score.desc(),
+                                                                     Suggestion.suggested_id)]
+
+    def test_top_suggestions(self):
+        '''are friends of friends ranked by how many friends follow them?'''
+        graph = suggestions.make_graph([1, 1, 2, 3, 2, 4], [2, 3, 4, 4, 5, 1])
+        self.assertEqual(list(suggestions.top_suggestions(graph, [1, 2], 10)),
+                         [(1, 4, 2), (1, 5, 1), (2, 1, 1)])
+        self.assertEqual(list(suggestions.top_suggestions(graph, [1], 1)), [(1, 4, 2)])
+
+    def test_graph_size(self):
+        '''is the graph sized by the users in it, not by their ids?'''
+        graph = suggestions.make_graph([10 ** 9], [7], [3])
+        self.assertEqual(graph.matrix.shape, (3, 3))
+        self.assertEqual(list(graph.ids), [3, 7, 10 ** 9])
+        self.assertEqual(list(suggestions.top_suggestions(graph, [3], 10)), [])
+
+    def test_rebuild(self):
+        '''does a rebuild skip people already followed?'''
+        db.session.add(Follows(user_following_id=1, user_being_followed_id=5))
+        db.session.commit()
+
+        with app.app_context():
+            suggestions.rebuild()
+            db.session.commit()
+
+        self.assertEqual(self.suggested(1), [(4, 2)])
+        self.assertEqual(self.suggested(2), [])
+
+    def test_follow_updates_suggestions(self):
+        '''do following and unfollowing update suggestions?'''
+        with app.app_context():
+            suggestions.rebuild()
+            db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post("/users/follow/4")
+            self.assertEqual(self.suggested(1), [(5, 1)])
+
+            c.post("/users/stop-following/2")
+            self.assertEqual(self.suggested(1), [])
+
+            c.post("/users/follow/2")
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("Who to follow", html)
+            self.assertIn("@user5", html)
+
+    def test_followers_scores_adjusted(self):
+        '''does a follow change the scores the follower's followers give?'''
+        db.session.add(Follows(user_following_id=4, user_being_followed_id=1))
+        db.session.commit()
+        with app.app_context():
+            suggestions.rebuild()
+            db.session.commit()
+        self.assertIn((3, 1), self.suggested(4))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post("/users/stop-following/3")
+            self.assertNotIn(3, [id for (id, _) in self.suggested(4)])
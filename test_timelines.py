@@ -0,0 +1,230 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    FLASK_ENV=production python -m unittest test_timelines.py
+
+
+import os
+import re
+from datetime import datetime
+from unittest import TestCase
+from models import db, Message, User, Follows, TimelineEntry
+from timelines import DBTimelineBackend, MemoryTimelineBackend
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+app.config['TESTING'] = True
+
+
+class TimelineTestMixin:
+    """Tests run against each timeline backend."""
+
+    def setUp(self):
+        """Create test client and two users; u1 follows u2."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.timelines = self.make_backend()
+        app.extensions['timelines'] = self.timelines
+
+        self.client = app.test_client()
+
+        u1 = User.signup("testuser", "test@test.com", "password", None)
+        u2 = User.signup("testuser2", "test2@test.com", "password", None)
+        u1.id = 1
+        u2.id = 2
+        db.session.commit()
+
+        db.session.add(Follows(user_following_id=1, user_being_followed_id=2))
+        self.timelines.create(1)
+        self.timelines.create(2)
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+        app.extensions.pop('timelines', None)
+
+    def login(self, c, user_id):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def test_new_message_fans_out(self):
+        '''does a new message land in the author's and followers' timelines?'''
+        with self.client as c:
+            self.login(c, 2)
+            c.post("/messages/new", data={"text": "Hello"})
+
+        msg = Message.query.one()
+        self.assertEqual(self.timelines.read(1, 10), [msg.id])
+        self.assertEqual(self.timelines.read(2, 10), [msg.id])
+
+    def test_follow_backfills_and_unfollow_purges(self):
+        '''is a followed user's history copied in on follow and removed on unfollow?'''
+        db.session.add(Message(id=1, text="older", user_id=1))
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 2)
+            c.post("/users/follow/1")
+            self.assertEqual(self.timelines.read(2, 10), [1])
+
+            c.post("/users/stop-following/1")
+            self.assertEqual(self.timelines.read(2, 10), [])
+
+    def test_delete_message_purges(self):
+        '''is a deleted message removed from every timeline?'''
+        with self.client as c:
+            self.login(c, 2)
+            c.post("/messages/new", data={"text": "Hello"})
+            msg = Message.query.one()
+            c.post(f"/messages/{msg.id}/delete")
+
+        self.assertEqual(self.timelines.read(1, 10), [])
+        self.assertEqual(self.timelines.read(2, 10), [])
+
+    def test_trim(self):
+        '''are timelines cut down to their maximum length?'''
+        self.timelines.max_length = 2
+        for text in ("one", "two", "three"):
+            msg = Message(text=text, user_id=2)
+            db.session.add(msg)
+            self.timelines.add_message(msg)
+        self.timelines.trim()
+        db.session.commit()
+
+        newest = [msg.id for msg in Message.query.order_by(
+            Message.timestamp.desc(), Message.id.desc()).limit(2)]
+        self.assertEqual(self.timelines.read(1, 10), newest)
+
+    def test_follow_backfills_from_horizon(self):
+        '''does following fill a full timeline only with messages newer than its oldest?'''
+        self.timelines.max_length = 2
+        u3 = User.signup("testuser3", "test3@test.com", "password", None)
+        u3.id = 3
+        db.session.commit()
+        db.session.add_all([
+            Message(id=1, text="old", user_id=3, timestamp=datetime(2020, 1, 1)),
+            Message(id=2, text="newer", user_id=3, timestamp=datetime(2020, 1, 4)),
+        ])
+        for id, day in [(3, 2), (4, 3), (5, 5)]:
+            msg = Message(id=id, text="followed", user_id=2, timestamp=datetime(2020, 1, day))
+            db.session.add(msg)
+            self.timelines.add_message(msg)
+        self.timelines.trim()
+        db.session.commit()
+        self.assertEqual(self.timelines.read(1, 10), [5, 4])
+
+        with self.client as c:
+            self.login(c, 1)
+            c.post("/users/follow/3")
+
+        # message 1 is older than anything the timeline still has, and
+        # message 3 (from before it) was trimmed, so it isn't copied in
+        self.assertEqual(self.timelines.read(1, 2), [5, 2])
+        self.assertNotIn(1, self.timelines.read(1, 10))
+
+    def test_homepage_skips_unbuilt_timeline(self):
+        '''does the home page query messages for users without a built timeline?'''
+        app.config['MESSAGES_PER_PAGE'] = 1
+        self.addCleanup(app.config.__setitem__, 'MESSAGES_PER_PAGE', 20)
+        self.timelines.remove_user(1)
+
+        u3 = User.signup("testuser3", "test3@test.com", "password", None)
+        u3.id = 3
+        db.session.commit()
+        db.session.add(Follows(user_following_id=1, user_being_followed_id=3))
+        db.session.add(Message(text="direct", user_id=3, timestamp=datetime(2100, 1, 1)))
+        for text in ("one", "two"):
+            msg = Message(text=text, user_id=2)
+            db.session.add(msg)
+            self.timelines.add_message(msg)
+        db.session.commit()
+
+        with self.client as c:
+            self.login(c, 1)
+            html = c.get("/").get_data(as_text=True)
+            self.assertIn("<p>direct</p>", html)
+
+    def test_signup_builds_timeline(self):
+        '''does a new user start with a built timeline?'''
+        self.client.post("/signup", data={"username": "new", "email": "new@test.com",
+                                          "password": "password"})
+        user = User.query.filter_by(username="new").one()
+        self.assertTrue(self.timelines.is_built(user.id))
+        self.assertFalse(self.timelines.is_built(999))
+
+    def test_homepage_reads_timeline(self):
+        '''does the home page show messages from followed users?'''
+        with self.client as c:
+            self.login(c, 2)
+            c.post("/messages/new", data={"text": "Hello"})
+
+            self.login(c, 1)
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("Hello", html)
+
+
+    def test_homepage_pages_through_timeline(self):
+        '''can the home page be paged back through the timeline?'''
+        app.config['MESSAGES_PER_PAGE'] = 2
+        try:
+            with self.client as c:
+                self.login(c, 2)
+                for text in ("one", "two", "three"):
+                    c.post("/messages/new", data={"text": text})
+
+                self.login(c, 1)
+                html = c.get("/").get_data(as_text=True)
+                self.assertIn("<p>three</p>", html)
+                self.assertIn("<p>two</p>", html)
+                self.assertNotIn("<p>one</p>", html)
+
+                cursor = re.search(r'\?before=([\w-]+)', html).group(1)
+                html = c.get(f"/?before={cursor}").get_data(as_text=True)
+                self.assertIn("<p>one</p>", html)
+                self.assertNotIn("<p>two</p>", html)
+        finally:
+            app.config['MESSAGES_PER_PAGE'] = 20
+
+
+class DBTimelineTestCase(TimelineTestMixin, TestCase):
+    """Timelines stored in the timeline_entries table."""
+
+    def make_backend(self):
+        return DBTimelineBackend()
+
+    def test_rebuild(self):
+        '''does rebuild recreate a timeline from messages and follows?'''
+        db.session.add(Message(id=1, text="hi", user_id=2))
+        db.session.commit()
+
+        self.timelines.rebuild(1)
+        db.session.commit()
+
+        self.assertEqual(TimelineEntry.query.filter_by(user_id=1).count(), 1)
+        self.assertEqual(self.timelines.read(1, 10), [1])
+
+
+class MemoryTimelineTestCase(TimelineTestMixin, TestCase):
+    """Timelines kept in process memory."""
+
+    def make_backend(self):
+        return MemoryTimelineBackend()
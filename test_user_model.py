@@ -8,7 +8,10 @@
 import os
 from unittest import TestCase
 
+from flask import g
+
 from models import db, User, Message, Follows
+from hashing import hasher, get_rounds
 from sqlalchemy import exc
 
 # BEFORE we import our app, let's set an environmental variable
@@ -89,6 +92,52 @@ class UserModelTestCase(TestCase):
         self.assertTrue(self.u2.is_followed_by(self.u1))
         self.assertFalse(self.u1.is_followed_by(self.u2))
 
+    def test_follow_ids_cached_for_current_user(self):
+        '''are the logged-in user's follow sets loaded once per request and shared on g?'''
+        self.u1.following.append(self.u2)
+        db.session.commit()
+
+        with app.test_request_context():
+            g.user = self.u1
+            self.assertTrue(self.u1.is_following(self.u2))
+            self.assertEqual(g.follow_ids, ({2}, set()))
+
+            g.follow_ids = (set(), set())
+            self.assertFalse(self.u1.is_following(self.u2))
+
+            # other users aren't cached
+            self.assertTrue(self.u2.is_followed_by(self.u1))
+
+    def test_liked_among(self):
+        '''does liked_among find just the user's likes among the given messages?'''
+        liked = Message(id=1, text="liked", user_id=2)
+        other = Message(id=2, text="not liked", user_id=2)
+        self.u1.likes.append(liked)
+        db.session.add(other)
+        db.session.commit()
+
+        self.assertEqual(self.u1.liked_among([1, 2]), {1})
+        self.assertEqual(self.u1.liked_among([2]), set())
+        self.assertEqual(self.u2.liked_among([1, 2]), set())
+
+    def test_repair_counters(self):
+        '''does repair_counters recompute counters from the follows, messages and likes tables?'''
+        message = Message(text="hi", user_id=2)
+        self.u1.following.append(self.u2)
+        self.u1.likes.append(message)
+        db.session.commit()
+
+        User.repair_counters()
+        db.session.commit()
+
+        u1 = User.query.get(1)
+        u2 = User.query.get(2)
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(u1.likes_count, 1)
+        self.assertEqual(u1.messages_count, 0)
+        self.assertEqual(u2.followers_count, 1)
+        self.assertEqual(u2.messages_count, 1)
+
     
     def test_failed_user(self):
         '''test to make sure it doesn't create a user if username, email, or password are not passed thru correctly'''
@@ -117,4 +166,19 @@ class UserModelTestCase(TestCase):
         self.assertEqual(u.id, self.u1.id)
 
         self.assertFalse(User.authenticate('testuserwrong', 'HASHED_PASSWORD'))
-        self.assertFalse(User.authenticate('testuser', 'WRONG_PASSWORD'))
\ No newline at end of file
+        self.assertFalse(User.authenticate('testuser', 'WRONG_PASSWORD'))
+
+    def test_authentication_rehash(self):
+        '''is a password hashed at an old cost upgraded on login?'''
+        old_rounds = hasher.rounds
+        self.addCleanup(setattr, hasher, 'rounds', old_rounds)
+        hasher.rounds = 4
+        self.u1.password = hasher.hash('HASHED_PASSWORD')
+        db.session.commit()
+
+        hasher.rounds = 5
+        u = User.authenticate('testuser', 'HASHED_PASSWORD')
+        db.session.commit()
+
+        self.assertEqual(get_rounds(u.password), 5)
+        self.assertTrue(User.authenticate('testuser', 'HASHED_PASSWORD'))
\ No newline at end of file
@@ -6,8 +6,10 @@
 
 
 import os
+import re
+from datetime import datetime
 from unittest import TestCase
-from models import db, connect_db, Message, User, Follows, Likes
+from models import db, connect_db, Message, User, Follows, Likes, user_cache
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -64,6 +66,46 @@ class UserViewTestCase(TestCase):
         self.assertIn('<p>@testuser</p>', html)
 
 
+    def test_all_users_pagination(self):
+        '''is the user list paged, with follow buttons for the people on the page?'''
+        self.testuser.following.append(self.testuser2)
+        db.session.commit()
+        app.config['USERS_PER_PAGE'] = 1
+        self.addCleanup(app.config.__setitem__, 'USERS_PER_PAGE', 30)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            html = c.get('/users').get_data(as_text=True)
+            self.assertIn('<p>@testuser</p>', html)
+            self.assertNotIn('<p>@testuser2</p>', html)
+            self.assertIn('href="/users?after=1"', html)
+
+            html = c.get('/users?after=1').get_data(as_text=True)
+            self.assertIn('<p>@testuser2</p>', html)
+            self.assertIn('Unfollow', html)
+            self.assertNotIn('/users?after=', html)
+
+    def test_search_users(self):
+        '''does searching find users by username, bio and location, best match first?'''
+        self.testuser.bio = "I love the beach"
+        self.testuser2.location = "Beachwood"
+        db.session.commit()
+
+        html = self.client.get('/users?q=testuser2').get_data(as_text=True)
+        self.assertIn('<p>@testuser2</p>', html)
+        self.assertNotIn('<p>@testuser</p>', html)
+
+        html = self.client.get('/users?q=beach').get_data(as_text=True)
+        self.assertIn('<p>@testuser</p>', html)
+        self.assertIn('<p>@testuser2</p>', html)
+        self.assertLess(html.index('<p>@testuser</p>'), html.index('<p>@testuser2</p>'))
+
+        html = self.client.get('/users?q=nobody').get_data(as_text=True)
+        self.assertIn('Sorry, no users found', html)
+
+
     def test_user_show(self):
         '''does the page show user details'''
         resp = self.client.get(f'/users/{self.testuser.id}')
@@ -73,10 +115,37 @@ class UserViewTestCase(TestCase):
 
 
 
+    def test_user_show_pagination(self):
+        '''does the profile page messages page by cursor, in order, even when timestamps tie?'''
+        for i in range(25):
+            db.session.add(Message(id=i + 1, text=f"message {i + 1}", user_id=1,
+                                   timestamp=datetime(2020, 1, 1)))
+        db.session.commit()
+
+        resp = self.client.get('/users/1')
+        html = resp.get_data(as_text=True)
+        self.assertIn('<p>message 25</p>', html)
+        self.assertIn('<p>message 6</p>', html)
+        self.assertNotIn('<p>message 5</p>', html)
+
+        cursor = re.search(r'\?before=([\w-]+)', html).group(1)
+        resp = self.client.get(f'/users/1?before={cursor}')
+        html = resp.get_data(as_text=True)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('<p>message 5</p>', html)
+        self.assertNotIn('<p>message 6</p>', html)
+        self.assertNotIn('Load more', html)
+
+        resp = self.client.get('/users/1?before=garbage')
+        self.assertEqual(resp.status_code, 400)
+
+
     def test_show_following(self):
         '''can a non logged in user see following page? does it work if logged in?'''
         self.testuser.following.append(self.testuser2)
         db.session.commit()
+        User.repair_counters()
+        db.session.commit()
 
         resp = self.client.get(f'/users/{self.testuser.id}/following', follow_redirects=True)
         html = resp.get_data(as_text=True)
@@ -98,6 +167,8 @@ class UserViewTestCase(TestCase):
         '''can a non logged in user see followers page? does it work if logged in?'''
         self.testuser.following.append(self.testuser2)
         db.session.commit()
+        User.repair_counters()
+        db.session.commit()
 
         resp = self.client.get(f'/users/{self.testuser2.id}/followers', follow_redirects=True)
         html = resp.get_data(as_text=True)
@@ -153,6 +224,54 @@ class UserViewTestCase(TestCase):
             self.assertEqual(resp.status_code, 200)
             self.assertEqual(len(user.following), 0)
 
+    def test_follow_idempotent(self):
+        '''does following twice or unfollowing twice count once? are unknown users a 404?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post('/users/follow/2')
+            c.post('/users/follow/2')
+            self.assertEqual(User.query.get(1).following_count, 1)
+            self.assertEqual(User.query.get(2).followers_count, 1)
+
+            c.post('/users/stop-following/2')
+            c.post('/users/stop-following/2')
+            self.assertEqual(User.query.get(1).following_count, 0)
+            self.assertEqual(User.query.get(2).followers_count, 0)
+
+            self.assertEqual(c.post('/users/follow/99').status_code, 404)
+            self.assertEqual(c.post('/users/stop-following/99').status_code, 404)
+
+
+    def test_counters(self):
+        '''do follows, likes and messages made through the app update the user counters?'''
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.post('/users/follow/2')
+            c.post('/messages/new', data={"text": "Hello"})
+            msg = Message.query.one()
+            c.post(f'/users/add_like/{msg.id}')
+
+            user1 = User.query.get(1)
+            user2 = User.query.get(2)
+            self.assertEqual(user1.following_count, 1)
+            self.assertEqual(user2.followers_count, 1)
+            self.assertEqual(user1.messages_count, 1)
+            self.assertEqual(user1.likes_count, 1)
+
+            c.post('/users/stop-following/2')
+            c.post(f'/users/add_like/{msg.id}')
+            c.post(f'/messages/{msg.id}/delete')
+
+            user1 = User.query.get(1)
+            user2 = User.query.get(2)
+            self.assertEqual(user1.following_count, 0)
+            self.assertEqual(user2.followers_count, 0)
+            self.assertEqual(user1.messages_count, 0)
+            self.assertEqual(user1.likes_count, 0)
 
     def test_show_likes(self):
         '''can a non logged in user see likes page? does it work if logged in?'''
@@ -173,6 +292,8 @@ class UserViewTestCase(TestCase):
             user = User.query.get(1)
             user.likes.append(message)
             db.session.commit()
+            User.repair_counters()
+            db.session.commit()
 
             resp = c.get('/users/1/likes', follow_redirects=True)
             html = resp.get_data(as_text=True)
@@ -210,6 +331,106 @@ class UserViewTestCase(TestCase):
             user = User.query.get(1)
             self.assertEqual(len(user.likes), 0)
 
+    def test_like_counts(self):
+        '''can several users like a message, with its like count kept up to date?'''
+        testuser3 = User.signup(username="testuser3",email="test@test3.com",password="testuser3",image_url=None)
+        testuser3.id = 3
+        db.session.add(Message(id=1, text="a test message", user_id=2))
+        db.session.commit()
+
+        for user_id in (1, 3):
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = user_id
+                c.post('/users/add_like/1')
+
+        self.assertEqual(Message.query.get(1).like_count, 2)
+        self.assertEqual(User.query.get(3).likes_count, 1)
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            c.post('/users/add_like/1')
+
+            self.assertEqual(Message.query.get(1).like_count, 1)
+            self.assertEqual(User.query.get(1).likes_count, 0)
+
+            c.post('/users/follow/2')
+            html = c.get('/').get_data(as_text=True)
+            self.assertIn('<span class="like-count">1</span>', html)
+
+    def test_current_user_cache(self):
+        '''is the logged-in user cached between requests and dropped when they change?'''
+        user_cache.clear()
+        before = user_cache.stats()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+
+            c.get('/users/1')
+            c.get('/users/1')
+            c.get('/static/stylesheets/style.css')
+            stats = user_cache.stats()
+            self.assertEqual(stats['misses'] - before['misses'], 1)
+            self.assertEqual(stats['hits'] - before['hits'], 1)
+
+            c.post('/users/follow/2')
+            self.assertEqual(user_cache.stats()['size'], 0)
+
+            html = c.get('/users/1').get_data(as_text=True)
+            self.assertIn('<a href="/users/1/following">1</a>', html)
+
+    def test_current_user_cache_evicts_on_commit(self):
+        '''is a changed user kept cached until the change commits, and dropped after a rollback?'''
+        user_cache.clear()
+        user_cache.get(db.session, User, 1)
+
+        user = User.query.get(1)
+        user.bio = 'changed'
+        db.session.flush()
+        self.assertEqual(user_cache.stats()['size'], 1)
+
+        db.session.commit()
+        self.assertEqual(user_cache.stats()['size'], 0)
+
+        user_cache.get(db.session, User, 1)
+        User.adjust_counters([1], likes_count=1)
+        db.session.rollback()
+        self.assertEqual(user_cache.stats()['size'], 0)
+
+    def test_user_show_conditional_get(self):
+        '''does the profile page answer a current ETag with a 304, and a stale one with the page?'''
+        resp = self.client.get('/users/1')
+        etag = resp.headers['ETag']
+        self.assertIn('no-cache', resp.headers['Cache-Control'])
+
+        resp = self.client.get('/users/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b'')
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 1
+            c.post('/messages/new', data={"text": "Hello"})
+
+        # new message, and now a logged-in viewer
+        resp = self.client.get('/users/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('private', resp.headers['Cache-Control'])
+
+    def test_static_caching(self):
+        '''are unversioned static files revalidated, and answered with a 304 when unchanged?'''
+        resp = self.client.get('/static/images/default-pic.png')
+        self.assertEqual(resp.headers['Cache-Control'], 'public, no-cache')
+        last_modified = resp.headers['Last-Modified']
+        resp.close()
+
+        resp = self.client.get('/static/images/default-pic.png',
+                               headers={'If-Modified-Since': last_modified})
+        self.assertEqual(resp.status_code, 304)
+        resp.close()
+
     def test_edit_profile_route(self):
         '''can a non user get to the edit form? does the user information show in the form correctly?'''
         resp = self.client.get('/users/profile', follow_redirects=True)
@@ -0,0 +1,425 @@
+"""Precomputed home timelines for Warbler.
+
+Instead of querying every followed user's messages on each visit to the
+home page, a reference to each new message is written ("fanned out") into
+the timelines of its author and the author's followers. Reading the home
+page is then a single indexed read of one user's timeline.
+
+A timeline only keeps the newest `max_length` messages, so it's only
+complete back to its "horizon": the oldest message it's sure to have
+every newer message than. Following someone backfills just their
+messages from the horizon on, moving the horizon up if that fills the
+timeline, so nothing older is mixed in with gaps around it. A user's
+timeline also has to have been built (at signup, or with `flask
+rebuild-timelines`) before it's read; see `is_built`.
+
+Two backends are provided: `DBTimelineBackend` keeps timelines in the
+`timeline_entries` table and is the default; `MemoryTimelineBackend` keeps
+them in a dict and is meant for tests. Pick one with the
+`TIMELINE_BACKEND` config key ('db' or 'memory').
+"""
+
+from bisect import bisect_left, insort
+
+from flask import current_app
+from sqlalchemy import func, literal, select, tuple_
+
+from models import db, Follows, Message, TimelineEntry, TimelineState
+from pagination import older_than
+
+DEFAULT_MAX_LENGTH = 800
+
+
+class TimelineBackend:
+    """Store of per-user home timelines.
+
+    Subclasses keep, for every user, the ids of (at most) the `max_length`
+    newest messages written by that user or by the users they follow.
+    """
+
+    def __init__(self, max_length=DEFAULT_MAX_LENGTH):
+        self.max_length = max_length
+
+    def create(self, user_id):
+        """Start an empty, complete timeline for a new user."""
+
+        raise NotImplementedError
+
+    def is_built(self, user_id):
+        """Does `user_id` have a timeline that can be read?"""
+
+        raise NotImplementedError
+
+    def add_message(self, message):
+        """Fan `message` out to its author's and followers' timelines."""
+
+        raise NotImplementedError
+
+    def add_follow(self, user_id, followed_id):
+        """Backfill `user_id`'s timeline with `followed_id`'s messages.
+
+        Only messages from the timeline's horizon on are copied in.
+        """
+
+        raise NotImplementedError
+
+    def remove_follow(self, user_id, followed_id):
+        """Purge `followed_id`'s messages from `user_id`'s timeline."""
+
+        raise NotImplementedError
+
+    def remove_message(self, message_id):
+        """Purge a message from every timeline it was fanned out to."""
+
+        raise NotImplementedError
+
+    def remove_user(self, user_id):
+        """Drop `user_id`'s timeline and their messages from all others."""
+
+        raise NotImplementedError
+
+    def read(self, user_id, limit, before=None):
+        """Return ids of the `limit` newest messages in a timeline.
+
+        If `before` is a (timestamp, message_id) pair, only messages older
+        than it are returned.
+        """
+
+        raise NotImplementedError
+
+    def rebuild(self, user_id):
+        """Recompute `user_id`'s timeline from messages and follows."""
+
+        raise NotImplementedError
+
+    def trim(self):
+        """Cut every timeline down to `max_length` entries."""
+
+        raise NotImplementedError
+
+    def _followed_ids(self, user_id):
+        """Ids of the users that `user_id` follows."""
+
+        return [followed_id for (followed_id,) in (
+            db.session
+            .query(Follows.user_being_followed_id)
+            .filter(Follows.user_following_id == user_id))]
+
+    def _newest_messages(self, author_ids, horizon=None):
+        """Get the newest messages written by `author_ids`, from `horizon` on."""
+
+        query = Message.query.filter(Message.user_id.in_(author_ids))
+
+        if horizon:
+            query = query.filter(~older_than(Message.timestamp, Message.id,
+                                             horizon))
+
+        return (query
+                .order_by(Message.timestamp.desc(), Message.id.desc())
+                .limit(self.max_length)
+                .all())
+
+    def _horizon_after(self, messages):
+        """The horizon after taking in `_newest_messages`, if they filled up."""
+
+        if len(messages) < self.max_length:
+            return None
+
+        return (messages[-1].timestamp, messages[-1].id)
+
+
+class DBTimelineBackend(TimelineBackend):
+    """Timelines stored in the `timeline_entries` table.
+
+    All writes go through `db.session`, so they commit or roll back with
+    the rest of the request. Timelines are trimmed in bulk by `trim()`
+    (see the `trim-timelines` command) rather than on every post, which
+    would cost a scan of each follower's timeline.
+    """
+
+    table = TimelineEntry.__table__
+
+    def create(self, user_id):
+        db.session.add(TimelineState(user_id=user_id))
+
+    def is_built(self, user_id):
+        return (db.session
+                .query(TimelineState.user_id)
+                .filter(TimelineState.user_id == user_id)
+                .first()) is not None
+
+    def add_message(self, message):
+        db.session.flush()
+
+        followers = (select([Follows.user_following_id,
+                             literal(message.id),
+                             literal(message.user_id),
+                             literal(message.timestamp, db.DateTime)])
+                     .where(Follows.user_being_followed_id == message.user_id)
+                     .where(Follows.user_following_id != message.user_id))
+
+        db.session.add(TimelineEntry(user_id=message.user_id,
+                                     message_id=message.id,
+                                     author_id=message.user_id,
+                                     timestamp=message.timestamp))
+        db.session.execute(self.table.insert().from_select(
+            ['user_id', 'message_id', 'author_id', 'timestamp'], followers))
+
+    def add_follow(self, user_id, followed_id):
+        state = TimelineState.query.get(user_id)
+
+        # an unbuilt timeline gets the follow when it's built
+        if user_id == followed_id or state is None:
+            return
+
+        messages = self._newest_messages([followed_id], state.horizon)
+
+        if messages:
+            db.session.execute(self.table.insert(), [
+                dict(user_id=user_id, message_id=msg.id,
+                     author_id=msg.user_id, timestamp=msg.timestamp)
+                for msg in messages])
+
+        # if that filled the timeline, older messages are no longer
+        # complete, so they go
+        horizon = self._horizon_after(messages)
+        if horizon:
+            state.horizon = horizon
+            (TimelineEntry
+             .query
+             .filter(TimelineEntry.user_id == user_id,
+                     older_than(TimelineEntry.timestamp,
+                                TimelineEntry.message_id, horizon))
+             .delete(synchronize_session=False))
+
+    def remove_follow(self, user_id, followed_id):
+        if user_id == followed_id:
+            return
+
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.user_id == user_id,
+                 TimelineEntry.author_id == followed_id)
+         .delete(synchronize_session=False))
+
+    def remove_message(self, message_id):
+        (TimelineEntry
+         .query
+         .filter(TimelineEntry.message_id == message_id)
+         .delete(synchronize_session=False))
+
+    def remove_user(self, user_id):
+        (TimelineEntry
+         .query
+         .filter((TimelineEntry.user_id == user_id) |
+                 (TimelineEntry.author_id == user_id))
+         .delete(synchronize_session=False))
+        TimelineState.query.filter_by(user_id=user_id).delete()
+
+    def read(self, user_id, limit, before=None):
+        query = (db.session
+                 .query(TimelineEntry.message_id)
+                 .filter(TimelineEntry.user_id == user_id))
+
+        if before:
+            query = query.filter(older_than(TimelineEntry.timestamp,
+                                            TimelineEntry.message_id,
+                                            before))
+
+        rows = (query
+                .order_by(TimelineEntry.timestamp.desc(),
+                          TimelineEntry.message_id.desc())
+                .limit(limit)
+                .all())
+        return [message_id for (message_id,) in rows]
+
+    def rebuild(self, user_id):
+        messages = self._newest_messages(
+            [user_id, *self._followed_ids(user_id)])
+
+        TimelineEntry.query.filter_by(user_id=user_id).delete()
+        db.session.add_all(
+            TimelineEntry(user_id=user_id,
+                          message_id=msg.id,
+                          author_id=msg.user_id,
+                          timestamp=msg.timestamp)
+            for msg in messages)
+
+        state = TimelineState.query.get(user_id) or TimelineState(user_id=user_id)
+        state.horizon = self._horizon_after(messages)
+        db.session.add(state)
+
+    def trim(self):
+        overflowing = [user_id for (user_id,) in (
+            db.session
+            .query(TimelineEntry.user_id)
+            .group_by(TimelineEntry.user_id)
+            .having(func.count() > self.max_length))]
+
+        ranked = (select([
+            TimelineEntry.user_id,
+            TimelineEntry.message_id,
+            func.row_number().over(
+                partition_by=TimelineEntry.user_id,
+                order_by=(TimelineEntry.timestamp.desc(),
+                          TimelineEntry.message_id.desc()),
+            ).label('position')])
+            .alias('ranked'))
+
+        overflow = (select([ranked.c.user_id, ranked.c.message_id])
+                    .where(ranked.c.position > self.max_length))
+
+        db.session.execute(self.table.delete().where(
+            tuple_(TimelineEntry.user_id,
+                   TimelineEntry.message_id).in_(overflow)))
+
+        # trimmed timelines are now complete back to their oldest entry
+        def oldest(column):
+            return (select([column])
+                    .where(TimelineEntry.user_id == TimelineState.user_id)
+                    .order_by(TimelineEntry.timestamp, TimelineEntry.message_id)
+                    .limit(1)
+                    .as_scalar())
+
+        if overflowing:
+            (TimelineState
+             .query
+             .filter(TimelineState.user_id.in_(overflowing))
+             .update({
+                 TimelineState.horizon_timestamp: oldest(TimelineEntry.timestamp),
+                 TimelineState.horizon_message_id: oldest(TimelineEntry.message_id),
+             }, synchronize_session=False))
+
+
+class MemoryTimelineBackend(TimelineBackend):
+    """Timelines kept in a per-process dict; a stand-in for tests.
+
+    Each timeline is a list of (timestamp, message_id, author_id) tuples
+    in ascending order, trimmed to `max_length` on every write; `horizons`
+    holds the horizon of each built one. Nothing is rolled back if the
+    surrounding transaction fails.
+    """
+
+    def __init__(self, max_length=DEFAULT_MAX_LENGTH):
+        super().__init__(max_length)
+        self.timelines = {}
+        self.horizons = {}
+
+    def create(self, user_id):
+        self.timelines[user_id] = []
+        self.horizons[user_id] = None
+
+    def is_built(self, user_id):
+        return user_id in self.horizons
+
+    def add_message(self, message):
+        db.session.flush()
+
+        follower_ids = [user_id for (user_id,) in (
+            db.session
+            .query(Follows.user_following_id)
+            .filter(Follows.user_being_followed_id == message.user_id))]
+
+        entry = (message.timestamp, message.id, message.user_id)
+        for user_id in {message.user_id, *follower_ids}:
+            self._insert(user_id, [entry])
+
+    def add_follow(self, user_id, followed_id):
+        if user_id == followed_id or user_id not in self.horizons:
+            return
+
+        messages = self._newest_messages([followed_id], self.horizons[user_id])
+        self._insert(user_id, [(msg.timestamp, msg.id, msg.user_id)
+                               for msg in messages])
+
+        horizon = self._horizon_after(messages)
+        if horizon:
+            self._cut(user_id, horizon)
+
+    def remove_follow(self, user_id, followed_id):
+        if user_id == followed_id:
+            return
+
+        self.timelines[user_id] = [entry
+                                   for entry in self.timelines.get(user_id, [])
+                                   if entry[2] != followed_id]
+
+    def remove_message(self, message_id):
+        for user_id, entries in self.timelines.items():
+            self.timelines[user_id] = [entry for entry in entries
+                                       if entry[1] != message_id]
+
+    def remove_user(self, user_id):
+        self.timelines.pop(user_id, None)
+        self.horizons.pop(user_id, None)
+        for owner_id, entries in self.timelines.items():
+            self.timelines[owner_id] = [entry for entry in entries
+                                        if entry[2] != user_id]
+
+    def read(self, user_id, limit, before=None):
+        entries = self.timelines.get(user_id, [])
+
+        if before:
+            entries = entries[:bisect_left(entries, tuple(before))]
+
+        return [message_id for (_, message_id, _) in reversed(entries[-limit:])]
+
+    def rebuild(self, user_id):
+        messages = self._newest_messages(
+            [user_id, *self._followed_ids(user_id)])
+
+        self.create(user_id)
+        self._insert(user_id, [(msg.timestamp, msg.id, msg.user_id)
+                               for msg in messages])
+        self.horizons[user_id] = self._horizon_after(messages)
+
+    def trim(self):
+        for user_id in self.timelines:
+            self._trim(user_id)
+
+    def clear(self):
+        """Forget every timeline."""
+
+        self.timelines.clear()
+        self.horizons.clear()
+
+    def _insert(self, user_id, new_entries):
+        entries = self.timelines.setdefault(user_id, [])
+        for entry in new_entries:
+            insort(entries, entry)
+        self._trim(user_id)
+
+    def _trim(self, user_id):
+        entries = self.timelines[user_id]
+
+        if len(entries) > self.max_length:
+            self._cut(user_id, entries[-self.max_length][:2])
+
+    def _cut(self, user_id, horizon):
+        """Drop entries older than `horizon`, and make it the horizon."""
+
+        entries = self.timelines[user_id]
+        del entries[:bisect_left(entries, tuple(horizon))]
+
+        if user_id in self.horizons:
+            self.horizons[user_id] = tuple(horizon)
+
+
+BACKENDS = {
+    'db': DBTimelineBackend,
+    'memory': MemoryTimelineBackend,
+}
+
+
+def get_timelines():
+    """Return the timeline backend for the current app, creating it if needed."""
+
+    timelines = current_app.extensions.get('timelines')
+
+    if timelines is None:
+        backend = BACKENDS[current_app.config.get('TIMELINE_BACKEND', 'db')]
+        timelines = backend(current_app.config.get('TIMELINE_MAX_LENGTH',
+                                                   DEFAULT_MAX_LENGTH))
+        current_app.extensions['timelines'] = timelines
+
+    return timelines